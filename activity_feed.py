@@ -0,0 +1,317 @@
+import json
+import logging
+import queue
+import select
+import threading
+import time
+from flask import current_app
+from sqlalchemy import event
+from database import db
+from db_routing import RoutingSession
+
+logger = logging.getLogger(__name__)
+
+# Postgres channel every app process LISTENs on
+ACTIVITY_CHANNEL = 'version_activity'
+# Session.info key of the events a transaction will publish when it commits ('memory' backend)
+_PENDING_KEY = 'pending_activity'
+# Seconds between listener reconnection attempts, doubled up to the maximum
+LISTEN_RETRY_DELAY = 1.0
+LISTEN_RETRY_MAX_DELAY = 30.0
+# Seconds the first subscriber waits for the listener to be LISTENing
+LISTEN_START_TIMEOUT = 5.0
+
+
+class ActivityFeedFull(Exception):
+    """Raised when this process already streams to ACTIVITY_MAX_SUBSCRIBERS clients."""
+
+
+def version_event(version):
+    """The event published for a newly committed Version (small enough for a NOTIFY payload)."""
+    return {
+        'type': 'version_added',
+        'project_id': int(version.project_id), # May still be the form's string until the row is reloaded
+        'version_id': version.version_id,
+        'version_number': version.version_number,
+        'file_name': version.file_name,
+        'uploader_id': version.uploader_id,
+        'size_bytes': version.size_bytes,
+        'attestation_status': bool(version.attestation_status),
+        'uploaded_at': version.uploaded_at.isoformat() if version.uploaded_at else None,
+    }
+
+
+def publish_versions_added(versions):
+    """
+    Announces freshly flushed Versions to their project's subscribers, once
+    the caller's transaction commits (nothing is sent if it rolls back).
+
+    With the 'postgres' backend this is a NOTIFY in the same transaction:
+    Postgres delivers it to every listening app process at commit. With the
+    'memory' backend the events wait in the session until it commits and
+    only reach this process's subscribers.
+    """
+    feed = current_app.extensions.get('activity_feed')
+    if feed is None or not versions:
+        return
+    events = [version_event(version) for version in versions]
+
+    if feed.backend == 'postgres':
+        # One statement for the whole batch, one notification per version
+        db.session.execute(
+            db.text("SELECT pg_notify(:channel, payload) FROM unnest(CAST(:payloads AS text[])) AS payload"),
+            {'channel': ACTIVITY_CHANNEL, 'payloads': [json.dumps(event) for event in events]}
+        )
+    else:
+        db.session.info.setdefault(_PENDING_KEY, []).append((feed.hub, events))
+
+
+@event.listens_for(RoutingSession, 'after_commit')
+def _publish_pending(db_session):
+    for hub, events in db_session.info.pop(_PENDING_KEY, ()):
+        for activity in events:
+            hub.publish(activity)
+
+
+@event.listens_for(RoutingSession, 'after_transaction_end')
+def _discard_pending(db_session, transaction):
+    # Runs after after_commit, so anything left belongs to a rolled back transaction
+    if transaction.parent is None:
+        db_session.info.pop(_PENDING_KEY, None)
+
+
+class Subscriber:
+    """One open stream: the events for its project, queued until the stream sends them."""
+
+    def __init__(self, project_id, queue_max):
+        self.project_id = project_id
+        self.events = queue.Queue(maxsize=queue_max)
+        self.dropped = False
+
+    def offer(self, activity):
+        try:
+            self.events.put_nowait(activity)
+        except queue.Full:
+            # A client this far behind reconnects and catches up from the database
+            self.drop()
+
+    def drop(self):
+        """Ends the stream; the browser reconnects with Last-Event-ID."""
+        self.dropped = True
+        try:
+            self.events.put_nowait(None)
+        except queue.Full:
+            pass
+
+
+class ActivityHub:
+    """Fans events out to this process's subscribers, by project."""
+
+    def __init__(self, max_subscribers, queue_max):
+        self.max_subscribers = max_subscribers
+        self.queue_max = queue_max
+        self._subscribers = {} # project_id -> set of Subscriber
+        self._count = 0
+        self._lock = threading.Lock()
+
+    def subscribe(self, project_id):
+        """
+        Raises:
+            ActivityFeedFull: If max_subscribers streams are already open.
+        """
+        with self._lock:
+            if self._count >= self.max_subscribers:
+                raise ActivityFeedFull("Too many open activity streams.")
+            subscriber = Subscriber(project_id, self.queue_max)
+            self._subscribers.setdefault(project_id, set()).add(subscriber)
+            self._count += 1
+        return subscriber
+
+    def unsubscribe(self, subscriber):
+        with self._lock:
+            subscribers = self._subscribers.get(subscriber.project_id)
+            if subscribers is None or subscriber not in subscribers:
+                return
+            subscribers.discard(subscriber)
+            if not subscribers:
+                del self._subscribers[subscriber.project_id]
+            self._count -= 1
+
+    def publish(self, activity):
+        with self._lock:
+            subscribers = list(self._subscribers.get(activity['project_id'], ()))
+        for subscriber in subscribers:
+            subscriber.offer(activity)
+
+    def drop_all(self):
+        """Ends every stream (after events may have been missed)."""
+        with self._lock:
+            subscribers = [s for project in self._subscribers.values() for s in project]
+        for subscriber in subscribers:
+            subscriber.drop()
+
+    def stats(self):
+        with self._lock:
+            return {'subscribers': self._count, 'projects': len(self._subscribers)}
+
+
+class ActivityFeed:
+    """
+    Per-project version activity for Server-Sent Events streams.
+
+    With ACTIVITY_FEED = 'postgres', each app process holds one extra
+    database connection that LISTENs on ACTIVITY_CHANNEL, on a background
+    thread, and hands each notification to the hub. However many pages are
+    open, a process costs one connection and no polling. The open streams
+    themselves hold no connection. The listener starts with the first
+    subscription, in the process that serves requests (not in a pre-forking
+    master).
+
+    If the listener connection drops, notifications sent meanwhile are lost,
+    so every stream is ended once it is back. Browsers reconnect on their
+    own and catch up from the database (see the Last-Event-ID handling in
+    the activity route).
+
+    With ACTIVITY_FEED = 'memory', events only reach subscribers in the
+    process that committed them (tests, single-process installs).
+    """
+
+    def __init__(self, app):
+        self.app = app
+        self.backend = app.config['ACTIVITY_FEED']
+        self.heartbeat_interval = app.config['ACTIVITY_HEARTBEAT_INTERVAL']
+        self.stream_max_age = app.config['ACTIVITY_STREAM_MAX_AGE']
+        self.retry_ms = app.config['ACTIVITY_RETRY_MS']
+        self.hub = ActivityHub(app.config['ACTIVITY_MAX_SUBSCRIBERS'], app.config['ACTIVITY_SUBSCRIBER_QUEUE_MAX'])
+        self._listener = None
+        self._listener_lock = threading.Lock()
+        self._listening = threading.Event()
+        self._stopped = threading.Event()
+
+    def subscribe(self, project_id):
+        """
+        Raises:
+            ActivityFeedFull: If this process has no room for another stream.
+        """
+        if self.backend == 'postgres':
+            self._start_listener()
+        return self.hub.subscribe(project_id)
+
+    def unsubscribe(self, subscriber):
+        self.hub.unsubscribe(subscriber)
+
+    def stop(self):
+        self._stopped.set()
+
+    def _start_listener(self):
+        with self._listener_lock:
+            if self._listener is None:
+                self._listener = threading.Thread(
+                    target=self._listen_forever, args=(db.engine,), name='activity-listener', daemon=True
+                )
+                self._listener.start()
+        # Otherwise a version committed before LISTEN took effect would be
+        # missed by both the subscriber's catch-up query and the feed
+        if not self._listening.wait(LISTEN_START_TIMEOUT):
+            logger.warning("Activity listener is not connected; streams will only catch up on reconnect")
+
+    def _listen_forever(self, engine):
+        delay = LISTEN_RETRY_DELAY
+        reconnecting = False
+        while not self._stopped.is_set():
+            try:
+                self._listen(engine, reconnecting)
+            except Exception:
+                logger.exception("Activity listener lost its connection")
+            if self._listening.is_set(): # It was up: back off from the start again
+                self._listening.clear()
+                delay = LISTEN_RETRY_DELAY
+            reconnecting = True
+            if self._stopped.wait(delay):
+                return
+            delay = min(delay * 2, LISTEN_RETRY_MAX_DELAY)
+
+    def _listen(self, engine, reconnecting):
+        # A connection of its own, taken out of the pool for good
+        pooled = engine.raw_connection()
+        pooled.detach()
+        connection = pooled.dbapi_connection
+        try:
+            connection.autocommit = True
+            with connection.cursor() as cursor:
+                cursor.execute(f"LISTEN {ACTIVITY_CHANNEL}")
+            self._listening.set()
+            if reconnecting:
+                self.hub.drop_all()
+                logger.info("Activity listener reconnected")
+
+            while not self._stopped.is_set():
+                # Wake up now and then to notice stop() (and dead connections)
+                if select.select([connection], [], [], self.heartbeat_interval) == ([], [], []):
+                    with connection.cursor() as cursor:
+                        cursor.execute("SELECT 1")
+                else:
+                    connection.poll()
+                while connection.notifies:
+                    notification = connection.notifies.pop(0)
+                    try:
+                        activity = json.loads(notification.payload)
+                    except ValueError:
+                        logger.warning("Ignoring a malformed activity notification", extra={'payload': notification.payload[:200]})
+                        continue
+                    self.hub.publish(activity)
+        finally:
+            connection.close() # Detached: no pool reset on the way out
+
+
+def format_event(activity):
+    """One SSE message; its id is the version number, which only grows within a project."""
+    return f"id: {activity['version_number']}\nevent: version\ndata: {json.dumps(activity)}\n\n"
+
+
+def iter_event_stream(feed, subscriber, missed, last_seen):
+    """
+    The body of an activity stream.
+
+    Sends the versions the client missed, then live events as they arrive,
+    with a comment line every ACTIVITY_HEARTBEAT_INTERVAL seconds so proxies
+    keep the connection open. Ends after ACTIVITY_STREAM_MAX_AGE seconds, or
+    when the subscriber is dropped, and the browser reconnects. Reads
+    nothing from the database.
+
+    Args:
+        feed (ActivityFeed): The feed the subscriber belongs to.
+        subscriber (Subscriber): Subscribed before missed was read, so there is no gap.
+        missed (list): Events for the versions after last_seen, already fetched.
+        last_seen (int): The last version number the client has, if it said.
+    """
+    last_seen = last_seen or 0
+    try:
+        yield f"retry: {feed.retry_ms}\n\n"
+        for activity in missed:
+            last_seen = max(last_seen, activity['version_number'])
+            yield format_event(activity)
+
+        deadline = time.monotonic() + feed.stream_max_age
+        while not subscriber.dropped:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return
+            try:
+                activity = subscriber.events.get(timeout=min(feed.heartbeat_interval, remaining))
+            except queue.Empty:
+                yield ": keepalive\n\n"
+                continue
+            if activity is None or subscriber.dropped:
+                return
+            if activity['version_number'] <= last_seen: # Already sent as missed
+                continue
+            last_seen = activity['version_number']
+            yield format_event(activity)
+    finally:
+        feed.unsubscribe(subscriber)
+
+
+def get_activity_feed():
+    """Returns the activity feed created by create_app(), or None when ACTIVITY_FEED is 'off'."""
+    return current_app.extensions.get('activity_feed')
@@ -1,13 +1,44 @@
-from flask import Flask, render_template, redirect, url_for, request, session, flash
+from flask import Flask, render_template, stream_template, redirect, url_for, request, session, flash, jsonify, Response
+from jinja2 import FileSystemBytecodeCache
+from markupsafe import Markup
 from config import Config
 from database import db
 import os 
-from flask_bcrypt import Bcrypt
-from models import db, User, Project, Version
-from s3_upload import upload_file_to_s3, allowed_file
+import logging
+import time
+import hmac
+import json
+import click
+from models import db, User, Project, Version, ProjectMember, ProjectSummary, VersionWaveform
+from s3_upload import allowed_file, create_direct_upload, verify_direct_upload
+from streaming_form import StreamingForm
+from blob_store import find_blob, reference_blob
+from chunk_store import load_version_manifest, load_version_manifests, iter_chunked_file
+from zip_export import export_entries, iter_zip
+from versioning import add_version, add_versions, store_file, file_size
+from project_summary import rebuild_project_summaries, backfill_version_sizes
+from storage_cleanup import StorageCleanup, run_storage_cleanup
+from metadata_export import ExportFilters, EXPORT_FORMATS, EXPORT_MIMETYPES, iter_export, parse_bool
+from activity_feed import ActivityFeed, ActivityFeedFull, get_activity_feed, iter_event_stream, version_event
+from batch_upload import store_batch
+from pagination import encode_cursor, decode_cursor, split_page, KeysetPage
+from search import search_versions
+from url_cache import PresignedUrlCache, get_download_url
+from permissions import ROLES, can_access_project, get_project_role, fetch_version_for_user, set_member_role
+from storage import create_storage, get_storage
+from local_storage import send_local_object
+from db_routing import replica_reads, init_replica_routing, REPLICA_BIND
+from instrumentation import init_instrumentation, phase_recorder, PHASE_RENDER
+from password_hashing import PasswordHasher, HashingOverloaded, get_password_hasher
+from sqlalchemy.dialects.postgresql import aggregate_order_by
+from upload_jobs import UploadPipeline, get_upload_pipeline
+from audio_ingest import AudioIngest, AUDIO_INGEST_AVAILABLE, schedule_audio_ingest
+from waveform import waveform_svg
 from werkzeug.utils import secure_filename
 from functools import wraps
-import boto3
+from datetime import datetime
+
+logger = logging.getLogger(__name__)
 
 def login_required(f):
     """
@@ -24,6 +55,39 @@ def login_required(f):
 
 # INITIALIZE APP & CONFIG
 
+# Approximate bytes per write when streaming a page
+STREAM_FLUSH_SIZE = 4096
+
+def stream_page(template_name, **context):
+    """
+    Renders a template as a streamed response, so a long page starts arriving
+    while its rows are still being read. Jinja yields a tiny fragment per
+    tag; they are sent in pieces of about STREAM_FLUSH_SIZE bytes instead.
+    """
+    record_render = phase_recorder(PHASE_RENDER)
+
+    def coalesced(fragments):
+        buffer = []
+        size = 0
+        rendering = 0.0 # Time spent producing fragments, not waiting on the client
+        while True:
+            started = time.perf_counter()
+            fragment = next(fragments, None)
+            rendering += time.perf_counter() - started
+            if fragment is None:
+                break
+            buffer.append(fragment)
+            size += len(fragment)
+            if size >= STREAM_FLUSH_SIZE:
+                yield ''.join(buffer)
+                buffer.clear()
+                size = 0
+        if buffer:
+            yield ''.join(buffer)
+        record_render(rendering)
+
+    return Response(coalesced(stream_template(template_name, **context)), mimetype='text/html')
+
 def create_app():
     """Application factory function."""
     app = Flask(__name__)
@@ -35,14 +99,65 @@ def create_app():
     # CRITICAL FIX: Explicitly set Flask's secret_key
     app.secret_key = app.config['SECRET_KEY']
 
+    # Structured logs, Server-Timing headers and /metrics histograms
+    init_instrumentation(app)
+
+    # Templates are compiled once per process and cached by Jinja; with a
+    # bytecode cache directory the compiled code also survives restarts
+    if app.config['TEMPLATE_BYTECODE_CACHE_DIR']:
+        os.makedirs(app.config['TEMPLATE_BYTECODE_CACHE_DIR'], exist_ok=True)
+        app.jinja_options = {
+            **app.jinja_options,
+            'bytecode_cache': FileSystemBytecodeCache(app.config['TEMPLATE_BYTECODE_CACHE_DIR']),
+        }
+
+    # Waveform overviews are rendered as inline SVG built only from numbers
+    app.add_template_filter(lambda overview: Markup(waveform_svg(overview)), 'waveform_svg')
+
     # INITIALIZE EXTENSIONS 
     
     # Initialize SQLAlchemy with the application instance
     db.init_app(app) 
+
+    # Read-your-writes for views that read from the replica (if one is configured)
+    init_replica_routing(app)
     
-    # Initialize Bcrypt for password hashing
-    global bcrypt
-    bcrypt = Bcrypt(app)
+    # bcrypt hashing and checks run on a bounded process pool
+    app.extensions['password_hasher'] = PasswordHasher(app)
+
+    # Create the shared storage backend (S3 or local disk) once per app process.
+    # Routes and helpers reach it through get_storage().
+    app.extensions['storage'] = create_storage(app.config)
+
+    # Presigned download URLs are reused until shortly before they expire
+    app.extensions['url_cache'] = PresignedUrlCache(
+        max_entries=app.config['DOWNLOAD_URL_CACHE_SIZE'],
+        refresh_margin=app.config['DOWNLOAD_URL_REFRESH_MARGIN']
+    )
+
+    # Background upload workers (only when ASYNC_UPLOADS is on)
+    if app.config['ASYNC_UPLOADS']:
+        app.extensions['upload_pipeline'] = UploadPipeline(app)
+
+    # Waveform peaks / previews for audio uploads, computed in the background
+    if app.config['AUDIO_INGEST']:
+        if AUDIO_INGEST_AVAILABLE:
+            app.extensions['audio_ingest'] = AudioIngest(app)
+        else:
+            logger.warning("AUDIO_INGEST is on but numpy is not installed; audio waveforms are disabled.")
+
+    # Periodic retention pruning and orphaned-object cleanup (off by default)
+    if app.config['STORAGE_CLEANUP_INTERVAL'] > 0:
+        app.extensions['storage_cleanup'] = StorageCleanup(app)
+
+    # Live version activity for open project pages (one LISTEN connection per process, off by default)
+    if app.config['ACTIVITY_FEED'] != 'off':
+        app.extensions['activity_feed'] = ActivityFeed(app)
+        if app.config['ACTIVITY_MAX_SUBSCRIBERS'] >= app.config['SERVER_THREADS']:
+            logger.warning(
+                "ACTIVITY_MAX_SUBSCRIBERS is not below SERVER_THREADS; open activity streams can take every request thread.",
+                extra={'max_subscribers': app.config['ACTIVITY_MAX_SUBSCRIBERS'], 'server_threads': app.config['SERVER_THREADS']}
+            )
     
     # BASIC ROUTE TEST
     
@@ -67,9 +182,11 @@ def create_app():
                 # In a real app, you'd flash a message
                 return "User already exists. Try logging in.", 409
 
-            # Hash the password for secure storage
-            # The global bcrypt object must be defined outside the function or passed in
-            hashed_password = bcrypt.generate_password_hash(password).decode('utf-8')
+            # Hash the password for secure storage (on the hashing pool)
+            try:
+                hashed_password = get_password_hasher().hash(password)
+            except HashingOverloaded:
+                return "The server is busy. Please try again in a moment.", 503, {'Retry-After': '5'}
             
             # Create a new user instance
             new_user = User(email=email, password_hash=hashed_password)
@@ -82,9 +199,9 @@ def create_app():
                 
                 # Success: Redirect to a confirmation or login page
                 return redirect(url_for('success_page')) # We will create this route next
-            except Exception as e:
+            except Exception:
                 db.session.rollback() # Rollback if anything fails
-                print(f"Database error during registration: {e}")
+                logger.exception("Database error during registration")
                 return "Registration failed due to a database error.", 500
         
         # Handle GET request: Show registration form
@@ -144,14 +261,18 @@ def create_app():
             new_project = Project(name=project_name, owner_id=owner_id)
             
             try:
-                # Add and commit the new project to PostgreSQL
+                # Add and commit the new project to PostgreSQL, together with
+                # the creator's 'owner' membership
                 db.session.add(new_project)
+                db.session.flush()
+                set_member_role(new_project.project_id, owner_id, 'owner')
+                db.session.add(ProjectSummary(project_id=new_project.project_id))
                 db.session.commit()
                 
                 return redirect(url_for('project_success', project_name=project_name))
-            except Exception as e:
+            except Exception:
                 db.session.rollback()
-                print(f"Database error during project creation: {e}")
+                logger.exception("Database error during project creation", extra={'project_name': project_name})
                 return "Project creation failed due to a database error.", 500
 
         # Handle GET request: Show creation form
@@ -169,6 +290,118 @@ def create_app():
         project_name = request.args.get('project_name', 'your new project')
         return f"Project **{project_name}** created successfully! Now ready for file uploads."
 
+    def save_version_metadata(project_id, uploader_id, storage_key, file_name, version_note, chunks=None, size_bytes=None):
+        """
+        Saves the Version row for an uploaded file. For chunked uploads, pass the
+        chunk manifest so it is committed in the same transaction.
+
+        Returns:
+            Version or None: The committed Version, or None if the database write failed.
+        """
+        try:
+            # The version number comes from the project's counter, bumped
+            # atomically in this same transaction (no max() scan, no races)
+            new_version = add_version(
+                project_id, uploader_id, storage_key, file_name, version_note, chunks=chunks, size_bytes=size_bytes
+            )
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            logger.exception("Database error saving version metadata", extra={'project_id': project_id, 'storage_key': storage_key})
+            return None
+
+        schedule_audio_ingest([new_version])
+        return new_version
+
+    def version_saved_response(new_version):
+        """Redirects to the success page, or reports a failed metadata save."""
+        if new_version is None:
+            return "Metadata saving failed due to a database error.", 500
+        return redirect(url_for('upload_success', filename=new_version.file_name, version=new_version.version_number))
+
+    def create_upload_job(project_id, uploader_id, file_name):
+        """Registers a background upload job, or returns an error response if the queue is full."""
+        job = get_upload_pipeline().create_job(int(project_id), uploader_id, secure_filename(file_name))
+        if job is None:
+            return None, ("Too many uploads in progress. Please try again shortly.", 503, {'Retry-After': '30'})
+        return job, None
+
+    def upload_job_accepted_response(job):
+        """202 with the job's status and where to poll it."""
+        status_url = url_for('upload_job_status', job_id=job.job_id)
+        return jsonify(job.to_dict()), 202, {'Location': status_url}
+
+    def upload_version_streaming(uploader_id):
+        """
+        Streaming variant of the upload_version POST handler.
+
+        The multipart body is parsed as it arrives and the file part is fed
+        straight into an S3 multipart upload, so the file is never spooled to
+        a temp file and memory stays bounded by S3_UPLOAD_MEMORY_CAP.
+        The project_id field must come before the file in the form (the upload
+        form below already does this) or be passed in the query string.
+        """
+        form = StreamingForm.from_request(request)
+        if form is None:
+            return "Expected a multipart/form-data upload.", 400
+
+        try:
+            file_part = form.next_file()
+        except ValueError as e:
+            return f"Malformed upload: {e}", 400
+
+        if file_part is None:
+            return "No file part in the request.", 400
+        
+        if file_part.filename == '':
+            return "No selected file.", 400
+
+        if not allowed_file(file_part.filename):
+            return "File type not allowed.", 400
+
+        # We need the project before the first byte goes to S3 (it's part of the key)
+        project_id = form.form.get('project_id') or request.args.get('project_id')
+        if not project_id:
+            return "project_id must be sent before the file.", 400
+
+        if not can_access_project(project_id, uploader_id, 'editor'):
+            return "Project not found or you do not have permission to upload to it.", 403
+
+        if app.config['ASYNC_UPLOADS']:
+            job, error_response = create_upload_job(project_id, uploader_id, file_part.filename)
+            if job is None:
+                return error_response
+            try:
+                get_upload_pipeline().spool(job, file_part)
+                fields = form.finish()
+            except Exception as e:
+                get_upload_pipeline().discard(job)
+                return f"Malformed upload: {e}", 400
+            job.version_note = fields.get('version_note')
+            get_upload_pipeline().start(job)
+            return upload_job_accepted_response(job)
+
+        # Stored according to STORAGE_MODE, reading the body exactly once
+        storage_key, chunks, size_bytes = store_file(
+            file_part,
+            user_id=uploader_id,
+            project_id=project_id,
+            streaming=True
+        )
+        
+        if not storage_key:
+            return "S3 upload failed. Check terminal logs for details.", 500
+
+        # Fields after the file (e.g. version_note) are only available now
+        try:
+            fields = form.finish()
+        except ValueError as e:
+            return f"Malformed upload: {e}", 400
+
+        return version_saved_response(save_version_metadata(
+            project_id, uploader_id, storage_key, file_part.filename, fields.get('version_note'), chunks, size_bytes
+        ))
+
     @app.route('/upload_version', methods=['GET', 'POST'])
     @login_required
     def upload_version():
@@ -180,8 +413,17 @@ def create_app():
         
         # Handle POST request: File Upload
         if request.method == 'POST':
+            # Streaming mode must run before anything touches request.form or
+            # request.files, which would make Werkzeug spool the whole body
+            if app.config['STREAMING_UPLOADS']:
+                return upload_version_streaming(uploader_id)
+
             project_id = request.form.get('project_id')
             version_note = request.form.get('version_note')
+
+            # Uploading needs at least the 'editor' role on the project
+            if not can_access_project(project_id, uploader_id, 'editor'):
+                return "Project not found or you do not have permission to upload to it.", 403
             
             # Check if the post request has the file part
             if 'file' not in request.files:
@@ -194,17 +436,26 @@ def create_app():
 
             # Validation and File Handling 
             if file and allowed_file(file.filename):
+
+                # Background mode: spool locally, let a worker do S3 + commit
+                if app.config['ASYNC_UPLOADS']:
+                    job, error_response = create_upload_job(project_id, uploader_id, file.filename)
+                    if job is None:
+                        return error_response
+                    job.version_note = version_note
+                    try:
+                        get_upload_pipeline().spool(job, file.stream)
+                    except Exception:
+                        get_upload_pipeline().discard(job)
+                        logger.exception("Could not spool upload", extra={'file_name': file.filename})
+                        return "Upload could not be queued. Check terminal logs for details.", 500
+                    get_upload_pipeline().start(job)
+                    return upload_job_accepted_response(job)
                 
-                # 1. Upload to S3
-                # Get configurations needed for S3
-                bucket_name = app.config['S3_BUCKET_NAME']
-                region = app.config['AWS_REGION']
-                
-                storage_key = upload_file_to_s3(
-                    file_data=file, 
-                    bucket_name=bucket_name, 
-                    region_name=region, 
-                    user_id=uploader_id, 
+                # 1. Upload to S3 (plain, content-addressed or chunked per STORAGE_MODE)
+                storage_key, chunks, size_bytes = store_file(
+                    file,
+                    user_id=uploader_id,
                     project_id=project_id
                 )
                 
@@ -212,40 +463,22 @@ def create_app():
                     return "S3 upload failed. Check terminal logs for details.", 500
                 
                 # 2. Save Metadata to PostgreSQL
-                
-                # Simple version number logic: Find the max version number for this project
-                last_version = db.session.scalar(
-                    db.select(db.func.max(Version.version_number))
-                      .filter_by(project_id=project_id)
-                )
-                # If no previous version, start at 1; otherwise, increment
-                version_number = (last_version or 0) + 1
-                
-                new_version = Version(
-                    project_id=project_id,
-                    uploader_id=uploader_id,
-                    version_number=version_number,
-                    storage_key=storage_key,
-                    file_name=secure_filename(file.filename),
-                    version_note=version_note
-                )
-                
-                try:
-                    db.session.add(new_version)
-                    db.session.commit()
-                    return redirect(url_for('upload_success', filename=new_version.file_name, version=version_number))
-                except Exception as e:
-                    db.session.rollback()
-                    print(f"Database error saving version metadata: {e}")
-                    return "Metadata saving failed due to a database error.", 500
+                return version_saved_response(save_version_metadata(
+                    project_id, uploader_id, storage_key, file.filename, version_note, chunks, size_bytes
+                ))
             
             else:
                 return "File type not allowed.", 400
 
         # Handle GET request: Show Upload Form
         
-        # NOTE: We need a list of projects for the user to select from.
-        projects = Project.query.filter_by(owner_id=uploader_id).all()
+        # NOTE: We need a list of projects the user may upload to.
+        projects = db.session.scalars(
+            db.select(Project)
+              .join(ProjectMember, ProjectMember.project_id == Project.project_id)
+              .filter(ProjectMember.user_id == uploader_id, ProjectMember.role.in_(('owner', 'editor')))
+              .order_by(Project.project_id)
+        ).all()
         
         if not projects:
              return "Please create a project first via /create_project."
@@ -273,6 +506,261 @@ def create_app():
         </form>
         """
 
+    @app.route('/upload_versions', methods=['GET', 'POST'])
+    @login_required
+    def upload_versions():
+        """
+        Batch upload: many files for one project (e.g. all stems of a session
+        export). The files go to S3 concurrently and all their Versions are
+        committed in one transaction with consecutive version numbers; if any
+        file fails, nothing is saved and the uploaded objects are deleted.
+        """
+        uploader_id = session['user_id']
+
+        if request.method == 'POST':
+            project_id = request.form.get('project_id')
+            version_note = request.form.get('version_note')
+
+            if not can_access_project(project_id, uploader_id, 'editor'):
+                return "Project not found or you do not have permission to upload to it.", 403
+
+            files = [f for f in request.files.getlist('files') if f.filename]
+            if not files:
+                return "No files in the request.", 400
+
+            if len(files) > app.config['BATCH_UPLOAD_MAX_FILES']:
+                return f"At most {app.config['BATCH_UPLOAD_MAX_FILES']} files per batch.", 400
+
+            rejected = [f.filename for f in files if not allowed_file(f.filename)]
+            if rejected:
+                return f"File type not allowed: {', '.join(rejected)}", 400
+
+            # 1. Upload every file to S3 concurrently (measured first: the
+            # S3 transfer closes each file once it has been sent)
+            sizes = [file_size(f) for f in files]
+            batch = store_batch(files, user_id=uploader_id, project_id=project_id)
+            if batch is None:
+                db.session.rollback()
+                return "S3 upload failed. Check terminal logs for details.", 500
+
+            # 2. Save all Versions in a single transaction
+            try:
+                new_versions = add_versions(
+                    project_id,
+                    uploader_id,
+                    [
+                        (storage_key, f.filename, chunks, size_bytes)
+                        for f, (storage_key, chunks), size_bytes in zip(files, batch.stored, sizes)
+                    ],
+                    version_note
+                )
+                db.session.commit()
+            except Exception:
+                db.session.rollback()
+                batch.discard()
+                logger.exception("Database error saving batch version metadata", extra={'project_id': project_id})
+                return "Metadata saving failed due to a database error.", 500
+
+            schedule_audio_ingest(new_versions)
+
+            return jsonify(versions=[
+                {'version_id': v.version_id, 'version_number': v.version_number, 'file_name': v.file_name}
+                for v in new_versions
+            ]), 201
+
+        projects = db.session.scalars(
+            db.select(Project)
+              .join(ProjectMember, ProjectMember.project_id == Project.project_id)
+              .filter(ProjectMember.user_id == uploader_id, ProjectMember.role.in_(('owner', 'editor')))
+              .order_by(Project.project_id)
+        ).all()
+
+        if not projects:
+             return "Please create a project first via /create_project."
+
+        project_options = "".join(
+            f"<option value='{p.project_id}'>{p.name}</option>" for p in projects
+        )
+
+        return f"""
+        <h1>Upload Several Files</h1>
+        <form method="POST" enctype="multipart/form-data">
+            <label for="project_id">Select Project:</label><br>
+            <select name="project_id" required>
+                {project_options}
+            </select><br><br>
+
+            <label for="files">Files:</label><br>
+            <input type="file" id="files" name="files" multiple required><br><br>
+
+            <label for="version_note">Version Note (applies to every file):</label><br>
+            <textarea id="version_note" name="version_note"></textarea><br><br>
+
+            <input type="submit" value="Upload Versions">
+        </form>
+        """
+
+    def user_can_reuse_blob(sha256, user_id):
+        """
+        True if a blob with this hash exists AND the user can already access a
+        version of it through one of their projects. Knowing a hash alone must
+        never grant access to somebody else's file.
+        """
+        blob = find_blob(sha256)
+        if blob is None:
+            return False
+        return db.session.scalar(
+            db.select(Version.version_id)
+              .join(ProjectMember, ProjectMember.project_id == Version.project_id)
+              .filter(Version.storage_key == blob.storage_key, ProjectMember.user_id == user_id)
+              .limit(1)
+        ) is not None
+
+    @app.route('/upload_version/presign', methods=['POST'])
+    @login_required
+    def presign_upload():
+        """
+        Step 1 of a direct-to-S3 upload: issues a presigned POST (or presigned
+        multipart part URLs for large files) for a new projects/{project_id}/... key.
+        The browser then sends the file bytes to S3 itself.
+        """
+        if not get_storage().supports_direct_upload:
+            return jsonify(error="Direct uploads are not available with this storage backend."), 400
+
+        uploader_id = session['user_id']
+        data = request.get_json(silent=True) or request.form
+
+        project_id = data.get('project_id')
+        file_name = data.get('file_name')
+
+        if not project_id or not file_name:
+            return jsonify(error="project_id and file_name are required."), 400
+
+        try:
+            file_size = int(data.get('file_size')) if data.get('file_size') else None
+        except ValueError:
+            return jsonify(error="file_size must be an integer."), 400
+
+        if not allowed_file(file_name):
+            return jsonify(error="File type not allowed."), 400
+
+        if not can_access_project(project_id, uploader_id, 'editor'):
+            return jsonify(error="Project not found or you do not have permission to upload to it."), 404
+
+        # Content-addressed mode: if the client sent the file's SHA-256 and the
+        # user already stored that content, there is nothing to upload at all
+        sha256 = data.get('sha256')
+        if app.config['STORAGE_MODE'] == 'content_addressed' and sha256 and user_can_reuse_blob(sha256, uploader_id):
+            return jsonify(method='existing', sha256=sha256)
+
+        try:
+            upload = create_direct_upload(project_id, uploader_id, file_name, file_size)
+        except Exception:
+            logger.exception("Could not presign direct upload", extra={'project_id': project_id})
+            return jsonify(error="Could not create upload URL. Check server logs."), 500
+
+        return jsonify(upload)
+
+    @app.route('/upload_version/finalize', methods=['POST'])
+    @login_required
+    def finalize_upload():
+        """
+        Step 2 of a direct-to-S3 upload: checks the object really exists in S3
+        (HEAD, size, ETag) and only then inserts the Version row.
+        """
+        if not get_storage().supports_direct_upload:
+            return jsonify(error="Direct uploads are not available with this storage backend."), 400
+
+        uploader_id = session['user_id']
+        data = request.get_json(silent=True) or {}
+
+        project_id = data.get('project_id')
+        storage_key = data.get('storage_key') or ''
+        file_name = data.get('file_name')
+
+        sha256 = data.get('sha256')
+
+        if not project_id or not file_name or not (storage_key or sha256):
+            return jsonify(error="project_id, file_name and storage_key (or sha256) are required."), 400
+
+        try:
+            file_size = int(data.get('file_size')) if data.get('file_size') else None
+        except (TypeError, ValueError):
+            return jsonify(error="file_size must be an integer."), 400
+
+        if not can_access_project(project_id, uploader_id, 'editor'):
+            return jsonify(error="Project not found or you do not have permission to upload to it."), 404
+
+        # Content-addressed reuse (presign answered method='existing'): no object to check
+        if not storage_key:
+            if app.config['STORAGE_MODE'] != 'content_addressed' or not user_can_reuse_blob(sha256, uploader_id):
+                return jsonify(error="No stored content matches this sha256."), 409
+            blob = find_blob(sha256)
+            storage_key = reference_blob(blob.sha256, blob.storage_key, blob.size_bytes)
+            new_version = save_version_metadata(
+                project_id, uploader_id, storage_key, file_name, data.get('version_note'), size_bytes=blob.size_bytes
+            )
+            if new_version is None:
+                return jsonify(error="Metadata saving failed due to a database error."), 500
+            return jsonify(
+                version_id=new_version.version_id,
+                version_number=new_version.version_number,
+                file_name=new_version.file_name,
+                size=blob.size_bytes
+            ), 201
+
+        # Only accept keys that presign_upload could have issued to this user
+        if not storage_key.startswith(f"projects/{project_id}/{uploader_id}-"):
+            return jsonify(error="Storage key does not belong to this upload."), 403
+
+        # A retried or repeated finalize must not record the object twice (only
+        # blob keys are shared between versions). The key's lock lasts until
+        # save_version_metadata commits, so two concurrent finalizes can't both
+        # get past the check.
+        db.session.execute(db.select(db.func.pg_advisory_xact_lock(db.func.hashtext(storage_key))))
+        existing = db.session.scalar(db.select(Version).filter(Version.storage_key == storage_key))
+        if existing is not None:
+            return jsonify(
+                version_id=existing.version_id,
+                version_number=existing.version_number,
+                file_name=existing.file_name,
+                size=existing.size_bytes
+            ), 200
+
+        head, error = verify_direct_upload(
+            storage_key,
+            expected_size=file_size,
+            expected_etag=data.get('etag'),
+            upload_id=data.get('upload_id'),
+            parts=data.get('parts')
+        )
+        if error:
+            return jsonify(error=error), 409
+
+        new_version = save_version_metadata(
+            project_id, uploader_id, storage_key, file_name, data.get('version_note'), size_bytes=head['size']
+        )
+        if new_version is None:
+            return jsonify(error="Metadata saving failed due to a database error."), 500
+
+        return jsonify(
+            version_id=new_version.version_id,
+            version_number=new_version.version_number,
+            file_name=new_version.file_name,
+            size=head['size']
+        ), 201
+
+    @app.route('/upload_jobs/<job_id>')
+    @login_required
+    def upload_job_status(job_id):
+        """Reports the progress of a background upload to the user who started it."""
+        job = None
+        if app.config['ASYNC_UPLOADS']:
+            job = get_upload_pipeline().get(job_id)
+        if job is None or job.uploader_id != session['user_id']:
+            return "Upload job not found.", 404
+        return jsonify(job.to_dict())
+
     @app.route('/upload_success')
     def upload_success():
         filename = request.args.get('filename')
@@ -291,8 +779,23 @@ def create_app():
                 db.select(User).filter_by(email=email)
             )
 
-            # 2. Verify existence and password hash
-            if user and bcrypt.check_password_hash(user.password_hash, password):
+            # 2. Verify existence and password hash (on the hashing pool)
+            hasher = get_password_hasher()
+            try:
+                password_ok = user is not None and hasher.verify(password, user.password_hash)
+            except HashingOverloaded:
+                return "The server is busy. Please try again in a moment.", 503, {'Retry-After': '5'}
+            if password_ok:
+
+                # 3. Upgrade the stored hash if BCRYPT_LOG_ROUNDS has changed since it was made
+                if hasher.needs_rehash(user.password_hash):
+                    try:
+                        user.password_hash = hasher.hash(password)
+                        db.session.commit()
+                    except Exception:
+                        # The old hash still works: try again on the next login
+                        db.session.rollback()
+                        logger.warning("Could not upgrade password hash", extra={'user_id': user.user_id})
                 
                 # Successful login: Set session variables
                 session['user_id'] = user.user_id
@@ -329,136 +832,667 @@ def create_app():
 
     @app.route('/dashboard')
     @login_required
+    @replica_reads
     def dashboard():
         # 1. Get the current user's ID from the session
         user_id = session['user_id']
         
-        # 2. Query the database for projects owned by this user
-        # We select all Project objects filtered by the owner_id
-        projects = db.session.scalars(
-            db.select(Project).filter_by(owner_id=user_id)
-        ).all()
-        
-        # 3. Create a basic HTML response to display the project list
-        html_content = "<h1>Your Project Dashboard</h1>"
-        html_content += "<h2>Projects:</h2>"
+        # 2. Query the database for one page of projects this user belongs to
+        # Keyset pagination on project_members (user_id, project_id): each page
+        # is one index range scan, however many projects the user has. The
+        # version totals come from project_summaries by primary key, so no
+        # project's versions are aggregated here.
+        page_size = app.config['PAGE_SIZE']
+        query = (
+            db.select(Project, ProjectMember.role, ProjectSummary)
+              .join(ProjectMember, ProjectMember.project_id == Project.project_id)
+              .outerjoin(ProjectSummary, ProjectSummary.project_id == Project.project_id)
+              .filter(ProjectMember.user_id == user_id)
+        )
+        after = decode_cursor(request.args.get('cursor'), (int,))
+        if after:
+            query = query.filter(ProjectMember.project_id > after[0])
+        page = KeysetPage(
+            db.session.execute(
+                query.order_by(ProjectMember.project_id)
+                  .limit(page_size + 1)
+            ).all(),
+            page_size,
+            cursor_key=lambda row: (row[0].project_id,)
+        )
         
-        if projects:
-            html_content += "<ul>"
-            for project in projects:
-                # CHANGE: Now links to the new project_details route
-                project_link = url_for('project_details', project_id=project.project_id)
-                html_content += f"""
-                    <li>
-                        Project ID: {project.project_id} | 
-                        Name: <a href="{project_link}">{project.name}</a>
-                    </li>
-                """
-            html_content += "</ul>"
-        else:
-            html_content += "<p>You do not currently own any projects.</p>"
-            html_content += f'<p><a href="{url_for("create_project")}">Click here to create your first project.</a></p>'
-            
-        return html_content
+        # 3. Stream the page. The rows are read before the view returns: the
+        # session is closed when the app context ends, before the body is sent
+        return stream_page('dashboard.html', page=page, after=after)
     
+    def fetch_version_page(project_id, after):
+        """
+        Returns (versions, has_more) for one page of a project's history, newest first.
+
+        Keyset pagination on (uploaded_at, version_id) walks the
+        (project_id, uploaded_at, version_id) index, so a page costs the same
+        on a project with 10 versions or 100,000.
+        """
+        page_size = app.config['PAGE_SIZE']
+        query = db.select(Version).filter_by(project_id=project_id)
+        if after:
+            query = query.filter(
+                db.tuple_(Version.uploaded_at, Version.version_id) < db.tuple_(*after)
+            )
+        return split_page(db.session.scalars(
+            query
+              .order_by(Version.uploaded_at.desc(), Version.version_id.desc()) # Show newest versions first
+              .limit(page_size + 1)
+        ).all(), page_size)
+
     @app.route('/project/<int:project_id>')
     @login_required
+    @replica_reads
     def project_details(project_id):
         user_id = session['user_id']
         
-        # 1. Fetch the Project and verify ownership
+        # 1. Fetch the Project and verify membership (any role may view)
         project = db.session.scalar(
             db.select(Project)
-              .filter_by(project_id=project_id, owner_id=user_id)
+              .join(ProjectMember, ProjectMember.project_id == Project.project_id)
+              .filter(Project.project_id == project_id, ProjectMember.user_id == user_id)
         )
 
         if not project:
             return "Project not found or you do not have permission to view it.", 404
 
-        # 2. Fetch all Versions associated with this Project
-        versions = db.session.scalars(
-            db.select(Version)
-              .filter_by(project_id=project_id)
-              .order_by(Version.uploaded_at.desc()) # Show newest versions first
-        ).all()
+        # 2. One page of Versions, newest first, with their waveform overviews
+        # (a few hundred bytes each) joined in so the page is a single query
+        after = decode_cursor(request.args.get('cursor'), (datetime, int))
+        query = (
+            db.select(Version, VersionWaveform.overview, VersionWaveform.preview_key)
+              .outerjoin(VersionWaveform, VersionWaveform.version_id == Version.version_id)
+              .filter(Version.project_id == project_id)
+        )
+        if after:
+            query = query.filter(
+                db.tuple_(Version.uploaded_at, Version.version_id) < db.tuple_(*after)
+            )
+        page = KeysetPage(
+            db.session.execute(
+                query
+                  .order_by(Version.uploaded_at.desc(), Version.version_id.desc())
+                  .limit(app.config['PAGE_SIZE'] + 1)
+            ).all(),
+            app.config['PAGE_SIZE'],
+            cursor_key=lambda row: (row[0].uploaded_at, row[0].version_id)
+        )
 
-        # 3. Build the HTML output
-        html_content = f"<h1>Project: {project.name} (ID: {project.project_id})</h1>"
-        html_content += "<h2>Version History:</h2>"
-        
-        if versions:
-            html_content += "<table border='1'>"
-            html_content += "<tr><th>Version #</th><th>File Name</th><th>Uploaded At</th><th>Notes</th><th>Download</th></tr>"
-            
-            for version in versions:
-                # Link directly to the new download route using version_id
-                download_link = url_for('download_file', version_id=version.version_id)
-
-                html_content += f"""
-                    <tr>
-                        <td>{version.version_number}</td>
-                        <td>{version.file_name}</td>
-                        <td>{version.uploaded_at.strftime('%Y-%m-%d %H:%M')}</td>
-                        <td>{version.version_note or 'N/A'}</td>
-                        <td><a href="{download_link}">Download (Future)</a></td>
-                    </tr>
-                """
-            html_content += "</table>"
-        else:
-            html_content += "<p>No versions have been uploaded for this project yet.</p>"
+        # 3. Stream the page. The rows are read before the view returns: the
+        # session is closed when the app context ends, before the body is sent.
+        # The newest page listens for versions newer than the ones it shows
+        # (taken from the rows themselves: a version committed after the
+        # project was read may already be on the page).
+        activity_url = None
+        if not after and get_activity_feed() is not None:
+            shown = max((version.version_number for version, _, _ in page), default=0)
+            activity_url = url_for('project_activity', project_id=project_id, last_event_id=shown)
+        return stream_page('project_details.html', project=project, page=page, after=after, activity_url=activity_url)
 
-        return html_content
+    @app.route('/project/<int:project_id>/activity')
+    @login_required
+    def project_activity(project_id):
+        """
+        Server-Sent Events stream of the versions committed to a project.
+
+        Each event's id is its version number. A reconnecting browser sends
+        the last one it got as Last-Event-ID (the first connection passes
+        ?last_event_id=), and the versions it missed are replayed from the
+        primary with one indexed query before live events follow. Live events
+        come from this process's activity feed, so an open stream holds no
+        database connection.
+        """
+        feed = get_activity_feed()
+        if feed is None:
+            return "Activity feed is disabled.", 404
+        if not can_access_project(project_id, session['user_id']):
+            return "Project not found or you do not have permission to view it.", 404
+
+        last_seen = request.headers.get('Last-Event-ID') or request.args.get('last_event_id')
+        last_seen = int(last_seen) if last_seen and last_seen.isdigit() else None
+
+        # 1. Subscribe before reading, so a version committed in between is not missed
+        try:
+            subscriber = feed.subscribe(project_id)
+        except ActivityFeedFull:
+            return "Too many open activity streams; try again shortly.", 503, {'Retry-After': '30'}
+
+        # 2. Versions committed since the client's last event
+        try:
+            missed = [
+                version_event(version)
+                for version in db.session.scalars(
+                    db.select(Version)
+                      .filter(Version.project_id == project_id, Version.version_number > last_seen)
+                      .order_by(Version.version_number)
+                      .limit(app.config['ACTIVITY_CATCH_UP_MAX'])
+                )
+            ] if last_seen is not None else []
+        except Exception:
+            feed.unsubscribe(subscriber)
+            raise
+
+        # 3. Stream; the generator unsubscribes when the client goes away
+        return Response(
+            iter_event_stream(feed, subscriber, missed, last_seen),
+            mimetype='text/event-stream',
+            headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'} # No proxy buffering (nginx)
+        )
 
     @app.route('/download/<int:version_id>')
     @login_required
+    @replica_reads
     def download_file(version_id):
         user_id = session['user_id']
+        disposition = 'inline' if request.args.get('disposition') == 'inline' else 'attachment'
 
-        # 1. Fetch the Version record
-        version = db.session.scalar(
-            db.select(Version).filter_by(version_id=version_id)
-        )
+        # 1. Fetch the Version record together with the user's role on its project (one query)
+        version, role = fetch_version_for_user(version_id, user_id)
 
         if not version:
             return "Version not found.", 404
 
-        # 2. Authorization Check: Ensure the user owns the project
-        project = db.session.scalar(
-            db.select(Project).filter_by(project_id=version.project_id)
-        )
-        
-        # Deny access if the user is not the project owner
-        if project.owner_id != user_id:
-            return "Permission denied. You do not own this project.", 403
+        # 2. Authorization Check: any project member may download
+        if role is None:
+            return "Permission denied. You are not a member of this project.", 403
 
-        # 3. Generate the Signed S3 URL
-        try:
-            # We use boto3 to generate a pre-signed URL for temporary, secure access
-            s3_client = boto3.client(
-                's3',
-                aws_access_key_id=app.config['AWS_ACCESS_KEY_ID'],
-                aws_secret_access_key=app.config['AWS_SECRET_ACCESS_KEY'],
-                region_name=app.config['AWS_REGION']
-            )
-            
-            # Generate the URL that forces the browser to download the file
-            download_url = s3_client.generate_presigned_url(
-                'get_object',
-                Params={
-                    'Bucket': app.config['S3_BUCKET_NAME'],
-                    'Key': version.storage_key,
-                    'ResponseContentDisposition': f'attachment; filename="{version.file_name}"'
-                },
-                ExpiresIn=300 # URL expires in 5 minutes (300 seconds)
+        # Chunked versions don't exist as one S3 object: stream the chunks back in order
+        if version.storage_kind == 'chunked':
+            manifest = load_version_manifest(version)
+            return Response(
+                iter_chunked_file(get_storage(), version.project_id, manifest),
+                mimetype='application/octet-stream',
+                headers={
+                    'Content-Disposition': f'{disposition}; filename="{version.file_name}"',
+                    'Content-Length': str(sum(size for _, size in manifest)),
+                }
             )
 
+        # 3. Get a Signed S3 URL (reused from the cache until shortly before it expires)
+        try:
+            download_url = get_download_url(version, disposition)
+
             # 4. Redirect the user to the secure download link
             return redirect(download_url)
 
-        except Exception as e:
-            print(f"Error generating S3 signed URL for download: {e}")
+        except Exception:
+            logger.exception("Could not generate download URL", extra={'version_id': version_id})
             return "Could not generate download link. Check server logs.", 500
 
+    @app.route('/files/<token>')
+    def serve_local_object(token):
+        """
+        Local storage backend's counterpart of an S3 presigned URL: the signed,
+        expiring token is the permission, so no login is needed (just like S3).
+        """
+        storage = get_storage()
+        if not hasattr(storage, 'read_download_token'):
+            return "Not found.", 404
+        return send_local_object(storage, token, app.config['LOCAL_STORAGE_ACCEL_REDIRECT'])
+
+    def conditional_json(etag, build):
+        """
+        Answers a poll with 304 if the client already has this ETag; only
+        otherwise calls build(), the part that loads rows, and returns its JSON.
+        """
+        if request.if_none_match.contains_weak(etag):
+            response = Response(status=304)
+        else:
+            response = jsonify(build())
+        response.set_etag(etag, weak=True)
+        # Clients may keep the response but must revalidate before reusing it
+        response.headers['Cache-Control'] = 'private, no-cache'
+        return response
+
+    @app.route('/api/projects')
+    @login_required
+    @replica_reads
+    def api_projects():
+        """
+        The user's projects as JSON (same keyset pages as the dashboard), with
+        each project's latest version number so clients can spot new uploads.
+        """
+        user_id = session['user_id']
+        page_size = app.config['PAGE_SIZE']
+
+        query = (
+            db.select(Project.project_id, Project.name, Project.last_version_number, Project.updated_at, ProjectMember.role)
+              .join(ProjectMember, ProjectMember.project_id == Project.project_id)
+              .filter(ProjectMember.user_id == user_id)
+        )
+        after = decode_cursor(request.args.get('cursor'), (int,))
+        if after:
+            query = query.filter(ProjectMember.project_id > after[0])
+        query = query.order_by(ProjectMember.project_id).limit(page_size + 1)
+
+        # The ETag is a digest of the page computed inside Postgres: one short
+        # string comes back instead of the rows
+        page = query.subquery()
+        digest = db.session.scalar(
+            db.select(db.func.md5(db.func.string_agg(
+                db.func.concat_ws(':', page.c.project_id, page.c.role, page.c.last_version_number, page.c.updated_at, page.c.name),
+                aggregate_order_by(db.literal(','), page.c.project_id)
+            ))).select_from(page)
+        )
+
+        def build():
+            rows, has_more = split_page(db.session.execute(query).all(), page_size)
+            return {
+                'projects': [
+                    {
+                        'project_id': row.project_id,
+                        'name': row.name,
+                        'role': row.role,
+                        'last_version_number': row.last_version_number,
+                        'updated_at': row.updated_at.isoformat() if row.updated_at else None,
+                    }
+                    for row in rows
+                ],
+                'next_cursor': encode_cursor(rows[-1].project_id) if has_more else None,
+            }
+
+        return conditional_json(f"projects-{digest or 'none'}", build)
+
+    @app.route('/api/projects/<int:project_id>/versions')
+    @login_required
+    @replica_reads
+    def api_project_versions(project_id):
+        """
+        One page of a project's version history as JSON (same ?cursor= as
+        project_details). Polls with a matching If-None-Match cost a single
+        primary-key lookup and get a 304.
+        """
+        user_id = session['user_id']
+
+        # Membership check and ETag inputs in one query, without touching versions
+        state = db.session.execute(
+            db.select(Project.last_version_number, Project.updated_at)
+              .join(ProjectMember, ProjectMember.project_id == Project.project_id)
+              .filter(Project.project_id == project_id, ProjectMember.user_id == user_id)
+        ).first()
+        if state is None:
+            return jsonify(error="Project not found or you do not have permission to view it."), 404
+
+        changed = int(state.updated_at.timestamp() * 1000000) if state.updated_at else 0
+        etag = f"project-{project_id}-v{state.last_version_number}-{changed}"
+
+        def build():
+            after = decode_cursor(request.args.get('cursor'), (datetime, int))
+            versions, has_more = fetch_version_page(project_id, after)
+            return {
+                'project_id': project_id,
+                'last_version_number': state.last_version_number,
+                'versions': [version.to_dict() for version in versions],
+                'next_cursor': encode_cursor(versions[-1].uploaded_at, versions[-1].version_id) if has_more else None,
+            }
+
+        return conditional_json(etag, build)
+
+    @app.route('/search')
+    @login_required
+    @replica_reads
+    def search():
+        """
+        Searches file names and version notes across the user's projects.
+        ?q= is required; ?attested=1 keeps only attested versions,
+        ?project_id= limits the search to one project, ?cursor= pages.
+        """
+        user_id = session['user_id']
+        text = (request.args.get('q') or '').strip()
+        if not text:
+            return jsonify(error="q is required."), 400
+
+        project_id = request.args.get('project_id')
+        if project_id is not None:
+            try:
+                project_id = int(project_id)
+            except ValueError:
+                return jsonify(error="project_id must be an integer."), 400
+
+        after = decode_cursor(request.args.get('cursor'), (datetime, int))
+        rows, has_more = search_versions(
+            user_id,
+            text,
+            after=after,
+            page_size=app.config['PAGE_SIZE'],
+            attested_only=request.args.get('attested') == '1',
+            project_id=project_id
+        )
+
+        results = [
+            {**version.to_dict(), 'project_name': project_name}
+            for version, project_name in rows
+        ]
+        next_cursor = None
+        if has_more:
+            last = rows[-1][0]
+            next_cursor = encode_cursor(last.uploaded_at, last.version_id)
+
+        return jsonify(results=results, next_cursor=next_cursor)
+
+    @app.route('/version/<int:version_id>/peaks')
+    @login_required
+    def version_peaks(version_id):
+        """
+        The full multi-resolution peaks of an audio version, in the packed
+        binary format of waveform.pack_peaks(), for zoomable client-side waveforms.
+        """
+        version, role = fetch_version_for_user(version_id, session['user_id'])
+        if not version or role is None:
+            return "Version not found.", 404
+
+        waveform = db.session.get(VersionWaveform, version_id)
+        if waveform is None:
+            return "No waveform for this version (yet).", 404
+
+        # Peaks never change once computed
+        return Response(
+            waveform.peaks,
+            mimetype='application/octet-stream',
+            headers={'Cache-Control': 'private, max-age=86400'}
+        )
+
+    @app.route('/version/<int:version_id>/preview')
+    @login_required
+    def version_preview(version_id):
+        """Redirects to the low-bitrate preview rendition of an audio version."""
+        version, role = fetch_version_for_user(version_id, session['user_id'])
+        if not version or role is None:
+            return "Version not found.", 404
+
+        waveform = db.session.get(VersionWaveform, version_id)
+        if waveform is None or not waveform.preview_key:
+            return "No preview for this version.", 404
+
+        try:
+            return redirect(get_storage().generate_download_url(
+                waveform.preview_key,
+                f"{version.file_name.rsplit('.', 1)[0]}-preview.mp3",
+                expires_in=app.config['DOWNLOAD_URL_EXPIRES'],
+                disposition='inline'
+            ))
+        except Exception:
+            logger.exception("Could not generate preview URL", extra={'version_id': version_id})
+            return "Could not generate preview link. Check server logs.", 500
+
+    @app.route('/project/<int:project_id>/download_urls')
+    @login_required
+    @replica_reads
+    def batch_download_urls(project_id):
+        """
+        Signs download links for every version visible on one page of the
+        project history (same ?cursor= as project_details), or for an explicit
+        ?version_ids=1,2,3 list, in a single request.
+        """
+        user_id = session['user_id']
+        disposition = 'inline' if request.args.get('disposition') == 'inline' else 'attachment'
+
+        if not can_access_project(project_id, user_id, 'viewer'):
+            return jsonify(error="Project not found or you do not have permission to view it."), 404
+
+        requested = request.args.get('version_ids')
+        if requested:
+            try:
+                version_ids = [int(value) for value in requested.split(',')][:app.config['PAGE_SIZE']]
+            except ValueError:
+                return jsonify(error="version_ids must be a comma-separated list of integers."), 400
+            versions = db.session.scalars(
+                db.select(Version).filter(Version.project_id == project_id, Version.version_id.in_(version_ids))
+            ).all()
+            next_cursor = None
+        else:
+            after = decode_cursor(request.args.get('cursor'), (datetime, int))
+            versions, has_more = fetch_version_page(project_id, after)
+            next_cursor = encode_cursor(versions[-1].uploaded_at, versions[-1].version_id) if has_more else None
+
+        urls = {}
+        try:
+            for version in versions:
+                if version.storage_kind == 'chunked':
+                    # Reassembled by the app, so there is no S3 URL to sign
+                    urls[version.version_id] = url_for('download_file', version_id=version.version_id, disposition=disposition)
+                else:
+                    urls[version.version_id] = get_download_url(version, disposition)
+        except Exception:
+            logger.exception("Could not generate download URLs", extra={'project_id': project_id})
+            return jsonify(error="Could not generate download links. Check server logs."), 500
+
+        return jsonify(
+            urls=urls,
+            expires_in=app.config['DOWNLOAD_URL_EXPIRES'],
+            next_cursor=next_cursor
+        )
+
+    @app.route('/project/<int:project_id>/export.zip')
+    @login_required
+    @replica_reads
+    def export_project_zip(project_id):
+        """
+        Streams a ZIP of the project's versions: all of them, an explicit
+        ?version_ids=1,2,3 list, or a ?from=&to= range of version numbers.
+        The archive is built while it is sent (see zip_export.py), so the
+        server never holds it in memory or on disk.
+        """
+        user_id = session['user_id']
+
+        if not can_access_project(project_id, user_id, 'viewer'):
+            return "Project not found or you do not have permission to view it.", 404
+
+        query = db.select(Version).filter(Version.project_id == project_id)
+        try:
+            requested = request.args.get('version_ids')
+            if requested:
+                query = query.filter(Version.version_id.in_([int(value) for value in requested.split(',')]))
+            if request.args.get('from'):
+                query = query.filter(Version.version_number >= int(request.args['from']))
+            if request.args.get('to'):
+                query = query.filter(Version.version_number <= int(request.args['to']))
+        except ValueError:
+            return "version_ids, from and to must be integers.", 400
+
+        versions = db.session.scalars(query.order_by(Version.version_number)).all()
+        if not versions:
+            return "No versions match this selection.", 404
+
+        # Everything the archive needs is read now, while the request's
+        # database session is still open
+        manifests = load_version_manifests(
+            [v.version_id for v in versions if v.storage_kind == 'chunked']
+        )
+        entries = export_entries(versions, manifests)
+        project = db.session.get(Project, project_id)
+
+        return Response(
+            iter_zip(get_storage(), project_id, entries),
+            mimetype='application/zip',
+            headers={'Content-Disposition': f'attachment; filename="{secure_filename(project.name) or "project"}.zip"'}
+        )
+
+    @app.route('/api/export/versions')
+    @login_required
+    def export_versions():
+        """
+        Streams the metadata of every version the user can see, for analysis:
+        ?format=ndjson|csv|parquet, filtered by owner_id, project_id,
+        since/until (ISO dates, UTC) and attested=true|false. Rows come from a
+        server-side cursor on the replica (if configured), so the download
+        starts at once and memory stays flat however many rows match.
+        """
+        export_format = request.args.get('format', 'ndjson')
+        try:
+            filters = ExportFilters.from_args(request.args, member_id=session['user_id'])
+            body = iter_export(
+                db.engines.get(REPLICA_BIND, db.engine), filters, export_format, app.config['EXPORT_BATCH_SIZE']
+            )
+        except ValueError as e:
+            return jsonify(error=str(e)), 400
+
+        extension = 'jsonl' if export_format == 'ndjson' else export_format
+        return Response(
+            body,
+            mimetype=EXPORT_MIMETYPES[export_format],
+            headers={'Content-Disposition': f'attachment; filename="versions.{extension}"'}
+        )
+
+    @app.route('/project/<int:project_id>/members', methods=['GET', 'POST'])
+    @login_required
+    def project_members(project_id):
+        """Lists a project's collaborators; owners can add people or change their role."""
+        user_id = session['user_id']
+        role = get_project_role(project_id, user_id)
+
+        if role is None:
+            return "Project not found or you do not have permission to view it.", 404
+
+        if request.method == 'POST':
+            if role != 'owner':
+                return "Only project owners can manage collaborators.", 403
+
+            email = request.form.get('email')
+            new_role = request.form.get('role')
+            if new_role not in ROLES:
+                return f"Role must be one of: {', '.join(ROLES)}.", 400
+
+            member_user = db.session.scalar(db.select(User).filter_by(email=email))
+            if not member_user:
+                return "No user with that email address.", 404
+
+            project = db.session.get(Project, project_id)
+            if member_user.user_id == project.owner_id and new_role != 'owner':
+                return "The project creator must stay an owner.", 400
+
+            try:
+                set_member_role(project_id, member_user.user_id, new_role)
+                db.session.commit()
+            except Exception:
+                db.session.rollback()
+                logger.exception("Database error updating project members", extra={'project_id': project_id})
+                return "Updating collaborators failed due to a database error.", 500
+
+            return redirect(url_for('project_members', project_id=project_id))
+
+        members = db.session.execute(
+            db.select(User.email, ProjectMember.role)
+              .join(ProjectMember, ProjectMember.user_id == User.user_id)
+              .filter(ProjectMember.project_id == project_id)
+              .order_by(ProjectMember.created_at)
+        ).all()
+
+        html_content = f"<h1>Collaborators on Project {project_id}</h1><ul>"
+        for email, member_role in members:
+            html_content += f"<li>{email} - {member_role}</li>"
+        html_content += "</ul>"
+
+        if role == 'owner':
+            role_options = "".join(f"<option value='{r}'>{r}</option>" for r in ROLES)
+            html_content += f"""
+            <h2>Add or update a collaborator</h2>
+            <form method="POST">
+                <label for="email">Email:</label><br>
+                <input type="email" id="email" name="email" required><br>
+                <label for="role">Role:</label><br>
+                <select name="role">{role_options}</select><br><br>
+                <input type="submit" value="Save">
+            </form>
+            """
+        return html_content
+
+    @app.cli.command('backfill-members')
+    def backfill_members():
+        """Gives every existing project's creator an 'owner' membership row."""
+        result = db.session.execute(db.text("""
+            INSERT INTO project_members (project_id, user_id, role, created_at)
+            SELECT project_id, owner_id, 'owner', created_at FROM projects
+            ON CONFLICT (project_id, user_id) DO NOTHING
+        """))
+        db.session.commit()
+        print(f"Added {result.rowcount} owner memberships.")
+
+    @app.cli.command('backfill-version-counters')
+    def backfill_version_counters():
+        """
+        Sets every project's version counter to its highest existing version
+        number. Needed once on databases that had versions before the counter
+        existed; until then uploads to those projects collide with old numbers.
+        Counters are only ever raised, so it is safe on a live site.
+        """
+        result = db.session.execute(db.text("""
+            UPDATE projects p SET last_version_number = v.max_number
+            FROM (SELECT project_id, max(version_number) AS max_number FROM versions GROUP BY project_id) v
+            WHERE v.project_id = p.project_id AND p.last_version_number < v.max_number
+        """))
+        db.session.commit()
+        print(f"Updated the version counters of {result.rowcount} projects.")
+
+    @app.cli.command('rebuild-project-summaries')
+    @click.option('--sizes', is_flag=True, help='First fill in missing version sizes (HEADs objects in storage).')
+    def rebuild_summaries(sizes):
+        """Recomputes every project's dashboard summary from its versions."""
+        if sizes:
+            counts = backfill_version_sizes(get_storage())
+            print(
+                f"Sized {counts['from_blobs'] + counts['from_chunks'] + counts['from_storage']} versions "
+                f"({counts['from_blobs']} from blobs, {counts['from_chunks']} from chunks, "
+                f"{counts['from_storage']} from storage); {counts['missing']} objects missing."
+            )
+        print(f"Rebuilt the summaries of {rebuild_project_summaries()} projects.")
+
+    @app.cli.command('export-versions')
+    @click.option('--format', 'export_format', type=click.Choice(EXPORT_FORMATS), default='ndjson')
+    @click.option('--output', type=click.Path(dir_okay=False, writable=True, allow_dash=True), default='-',
+                  help='File to write to (default: stdout).')
+    @click.option('--owner-id', type=int)
+    @click.option('--project-id', type=int)
+    @click.option('--since', type=click.DateTime(), help='Uploaded at or after (UTC).')
+    @click.option('--until', type=click.DateTime(), help='Uploaded before (UTC).')
+    @click.option('--attested', type=parse_bool, default=None, help='true or false.')
+    def export_versions_command(export_format, output, owner_id, project_id, since, until, attested):
+        """Exports version metadata from all projects as NDJSON, CSV or Parquet."""
+        filters = ExportFilters(owner_id=owner_id, project_id=project_id, since=since, until=until, attested=attested)
+        try:
+            body = iter_export(db.engine, filters, export_format, app.config['EXPORT_BATCH_SIZE'])
+        except ValueError as e:
+            raise click.UsageError(str(e))
+        with click.open_file(output, 'wb') as f:
+            for piece in body:
+                f.write(piece)
+
+    @app.cli.command('storage-cleanup')
+    @click.option('--dry-run', is_flag=True, help='Only report what would be deleted.')
+    @click.option('--keep-last', type=int, default=None, help='Override RETENTION_KEEP_LAST (0 = no pruning).')
+    @click.option('--no-retention', is_flag=True, help='Skip version pruning; only remove orphaned objects.')
+    def storage_cleanup(dry_run, keep_last, no_retention):
+        """Prunes versions per the retention policy and deletes orphaned stored objects."""
+        report = run_storage_cleanup(get_storage(), dry_run=dry_run, retention=not no_retention, keep_last=keep_last)
+        if report is None:
+            print("Another storage cleanup is running; try again later.")
+            return
+        print(json.dumps(report.to_dict(), indent=2))
+
+    @app.route('/metrics')
+    def metrics():
+        """Request and phase duration histograms in the Prometheus text format."""
+        token = app.config['METRICS_TOKEN']
+        if token and not hmac.compare_digest(request.headers.get('Authorization', ''), f"Bearer {token}"):
+            return "Unauthorized.", 401
+        return Response(
+            app.extensions['request_metrics'].render(),
+            mimetype='text/plain; version=0.0.4'
+        )
+
+    @app.route('/storage_stats')
+    @login_required
+    def storage_stats():
+        """Reports storage backend (S3 connection pool) and presigned URL cache usage for sizing."""
+        stats = get_storage().pool_stats()
+        stats['url_cache'] = app.extensions['url_cache'].stats()
+        return jsonify(stats)
+
     return app
 
 # Run the app
@@ -476,6 +1510,6 @@ if __name__ == '__main__':
         # You will need to define your Python models (users, projects, versions) 
         # before this will work as intended!
         # db.create_all() 
-        print("Database initialized. You may now define your models and routes.")
+        logger.info("Database initialized. You may now define your models and routes.")
         
     app.run(debug=True)
\ No newline at end of file
@@ -0,0 +1,266 @@
+import logging
+import os
+import shutil
+import subprocess
+import tempfile
+import wave
+from concurrent.futures import ThreadPoolExecutor
+from flask import current_app
+from database import db
+from models import Version, VersionWaveform
+from chunk_store import load_version_manifest, iter_chunked_file
+from storage import get_storage
+from waveform import np, PeakAccumulator, build_levels, pack_peaks
+
+logger = logging.getLogger(__name__)
+
+try:
+    import aifc # Removed from the standard library in Python 3.13
+except ImportError:
+    aifc = None
+
+AUDIO_EXTENSIONS = {'wav', 'aif', 'aiff', 'flac', 'mp3'}
+
+# Decoded samples reduced to one waveform peak
+SAMPLES_PER_PEAK = 256
+
+# Bytes of decoded PCM handled per block
+DECODE_BLOCK_SIZE = 1024 * 1024
+
+# Peak detection is vectorized with numpy; without it ingest is switched off
+AUDIO_INGEST_AVAILABLE = np is not None
+
+
+def is_audio_file(filename):
+    return '.' in filename and filename.rsplit('.', 1)[1].lower() in AUDIO_EXTENSIONS
+
+
+def _pcm_to_float(raw, sample_width, channels, big_endian=False):
+    """Converts interleaved integer PCM to mono float32 samples in -1.0 .. 1.0."""
+    if sample_width == 1:
+        # 8-bit WAV is unsigned, 8-bit AIFF is signed
+        samples = np.frombuffer(raw, dtype=np.int8 if big_endian else np.uint8).astype(np.float32)
+        if not big_endian:
+            samples -= 128
+        samples /= 128
+    elif sample_width == 3:
+        data = np.frombuffer(raw, dtype=np.uint8).reshape(-1, 3).astype(np.int32)
+        if big_endian:
+            data = data[:, ::-1]
+        values = data[:, 0] | (data[:, 1] << 8) | (data[:, 2] << 16)
+        values = np.where(values & 0x800000, values - (1 << 24), values)
+        samples = values.astype(np.float32) / (1 << 23)
+    else:
+        dtype = np.dtype(f"{'>' if big_endian else '<'}i{sample_width}")
+        samples = np.frombuffer(raw, dtype=dtype).astype(np.float32) / (1 << (8 * sample_width - 1))
+
+    if channels > 1:
+        samples = samples.reshape(-1, channels).mean(axis=1)
+    return samples
+
+
+def _ffmpeg():
+    return shutil.which(current_app.config['FFMPEG_PATH'])
+
+
+def iter_samples_ffmpeg(ffmpeg, path, sample_rate):
+    """Decodes any format ffmpeg understands to mono float32 blocks."""
+    process = subprocess.Popen(
+        [ffmpeg, '-v', 'error', '-i', path, '-f', 's16le', '-ac', '1', '-ar', str(sample_rate), '-'],
+        stdout=subprocess.PIPE,
+        stderr=subprocess.DEVNULL
+    )
+    try:
+        leftover = b''
+        while True:
+            raw = process.stdout.read(DECODE_BLOCK_SIZE)
+            if not raw:
+                break
+            raw = leftover + raw
+            usable = len(raw) - len(raw) % 2
+            leftover = raw[usable:]
+            yield _pcm_to_float(raw[:usable], 2, 1)
+    finally:
+        process.stdout.close()
+        if process.wait() != 0:
+            raise RuntimeError(f"ffmpeg could not decode {os.path.basename(path)}")
+
+
+def iter_samples_stdlib(path, extension):
+    """
+    Decodes uncompressed WAV/AIFF with the standard library, for hosts
+    without ffmpeg. Returns (sample_rate, blocks).
+    """
+    if extension == 'wav':
+        reader, big_endian = wave.open(path, 'rb'), False
+    elif extension in ('aif', 'aiff') and aifc is not None:
+        reader, big_endian = aifc.open(path, 'rb'), True
+    else:
+        raise RuntimeError(f"Decoding .{extension} files needs ffmpeg.")
+
+    sample_width = reader.getsampwidth()
+    channels = reader.getnchannels()
+    frames_per_block = max(DECODE_BLOCK_SIZE // (sample_width * channels), 1)
+
+    def blocks():
+        with reader:
+            while True:
+                raw = reader.readframes(frames_per_block)
+                if not raw:
+                    return
+                yield _pcm_to_float(raw, sample_width, channels, big_endian)
+
+    return reader.getframerate(), blocks()
+
+
+def compute_waveform(path, extension):
+    """
+    Decodes an audio file and reduces it to multi-resolution peaks.
+
+    Returns:
+        tuple: (packed_peaks, packed_overview, duration_ms, sample_rate)
+    """
+    ffmpeg = _ffmpeg()
+    if ffmpeg:
+        sample_rate = current_app.config['WAVEFORM_SAMPLE_RATE']
+        blocks = iter_samples_ffmpeg(ffmpeg, path, sample_rate)
+    else:
+        sample_rate, blocks = iter_samples_stdlib(path, extension)
+
+    accumulator = PeakAccumulator(SAMPLES_PER_PEAK)
+    for block in blocks:
+        accumulator.add(block)
+    mins, maxs = accumulator.finish()
+
+    levels = build_levels(mins, maxs, current_app.config['WAVEFORM_LEVELS'])
+    duration_ms = int(accumulator.sample_count * 1000 / sample_rate) if sample_rate else 0
+    return pack_peaks(levels), pack_peaks(levels[-1:]), duration_ms, sample_rate
+
+
+def render_preview(path):
+    """
+    Encodes a small mono MP3 rendition of the file with ffmpeg.
+
+    Returns:
+        str or None: Path of the temporary MP3 (caller deletes it), or None if ffmpeg is unavailable.
+    """
+    ffmpeg = _ffmpeg()
+    if not ffmpeg:
+        return None
+    fd, preview_path = tempfile.mkstemp(suffix='.mp3')
+    os.close(fd)
+    subprocess.run(
+        [ffmpeg, '-v', 'error', '-y', '-i', path, '-vn', '-ac', '1',
+         '-b:a', current_app.config['AUDIO_PREVIEW_BITRATE'], '-f', 'mp3', preview_path],
+        check=True,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL
+    )
+    return preview_path
+
+
+def preview_storage_key(version):
+    return f"projects/{version.project_id}/previews/{version.version_id}.mp3"
+
+
+def ingest_version(version_id):
+    """
+    Computes and saves the waveform (and preview) of one audio Version.
+    Content-addressed versions that share an object with an already
+    ingested version reuse its waveform instead of decoding again.
+    """
+    version = db.session.get(Version, version_id)
+    if version is None or not is_audio_file(version.file_name):
+        return
+
+    twin = db.session.scalar(
+        db.select(VersionWaveform)
+          .join(Version, Version.version_id == VersionWaveform.version_id)
+          .filter(Version.storage_key == version.storage_key, Version.version_id != version_id)
+          .limit(1)
+    )
+    if twin is not None:
+        db.session.merge(VersionWaveform(
+            version_id=version_id,
+            duration_ms=twin.duration_ms,
+            sample_rate=twin.sample_rate,
+            overview=twin.overview,
+            peaks=twin.peaks,
+            preview_key=twin.preview_key
+        ))
+        db.session.commit()
+        return
+
+    storage = get_storage()
+    extension = version.file_name.rsplit('.', 1)[1].lower()
+    fd, source_path = tempfile.mkstemp(suffix=f'.{extension}')
+    preview_path = None
+    try:
+        # 1. Fetch the file (the decoders need a seekable local copy)
+        if version.storage_kind == 'chunked':
+            pieces = iter_chunked_file(storage, version.project_id, load_version_manifest(version))
+        else:
+            pieces = storage.iter_object(version.storage_key, chunk_size=DECODE_BLOCK_SIZE)
+        with os.fdopen(fd, 'wb') as source:
+            for piece in pieces:
+                source.write(piece)
+
+        # 2. Peaks
+        peaks, overview, duration_ms, sample_rate = compute_waveform(source_path, extension)
+
+        # 3. Preview rendition
+        preview_key = None
+        preview_path = render_preview(source_path)
+        if preview_path:
+            preview_key = preview_storage_key(version)
+            with open(preview_path, 'rb') as preview:
+                storage.upload_fileobj(preview, preview_key)
+
+        db.session.merge(VersionWaveform(
+            version_id=version_id,
+            duration_ms=duration_ms,
+            sample_rate=sample_rate,
+            overview=overview,
+            peaks=peaks,
+            preview_key=preview_key
+        ))
+        db.session.commit()
+    finally:
+        os.remove(source_path)
+        if preview_path:
+            os.remove(preview_path)
+
+
+class AudioIngest:
+    """
+    Runs ingest_version() for new audio versions on a small worker pool, so
+    uploads never wait for decoding. Versions whose ingest fails (or is
+    lost with the process) simply show no waveform.
+    """
+
+    def __init__(self, app):
+        self.app = app
+        self._executor = ThreadPoolExecutor(
+            max_workers=app.config['AUDIO_INGEST_WORKERS'],
+            thread_name_prefix='audio-ingest'
+        )
+
+    def submit(self, version_ids):
+        for version_id in version_ids:
+            self._executor.submit(self._run, version_id)
+
+    def _run(self, version_id):
+        with self.app.app_context():
+            try:
+                ingest_version(version_id)
+            except Exception:
+                db.session.rollback()
+                logger.exception("Audio ingest failed", extra={'version_id': version_id})
+
+
+def schedule_audio_ingest(versions):
+    """Queues waveform/preview generation for the audio files among freshly committed versions."""
+    ingest = current_app.extensions.get('audio_ingest')
+    if ingest is None:
+        return
+    ingest.submit([v.version_id for v in versions if is_audio_file(v.file_name)])
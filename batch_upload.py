@@ -0,0 +1,148 @@
+import logging
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from flask import current_app
+from database import db
+from models import Blob
+from s3_upload import build_storage_key
+from blob_store import HashingReader, HASH_CHUNK_SIZE, reference_blob, _discard_redundant_copy
+from chunk_store import upload_chunked
+from storage import get_storage
+from instrumentation import timed_call, PHASE_HASH, PHASE_STORAGE
+
+logger = logging.getLogger(__name__)
+
+class StoredBatch:
+    """Result of store_batch(): where each file went, and which objects are new."""
+
+    def __init__(self):
+        self.stored = [] # [(storage_key, chunks), ...] in the order the files were given
+        self.new_keys = [] # Objects this batch created; nothing else references them
+
+    def discard(self):
+        """Deletes the objects this batch created (after its transaction was rolled back)."""
+        storage = get_storage()
+        for storage_key in self.new_keys:
+            try:
+                storage.delete_object(storage_key)
+            except Exception as e:
+                logger.warning("Could not delete orphaned upload", extra={'storage_key': storage_key, 'error': str(e)})
+        self.new_keys = []
+
+
+@timed_call(PHASE_HASH)
+def _hash_file(file_data):
+    """Returns (sha256, size) of a spooled upload."""
+    file_data.seek(0)
+    hasher = HashingReader(file_data)
+    while hasher.read(HASH_CHUNK_SIZE):
+        pass
+    return hasher.hexdigest(), hasher.size
+
+
+@timed_call(PHASE_STORAGE) # The transfers themselves run on pool threads
+def _transfer(storage, uploads, batch, max_workers):
+    """
+    Uploads [(file, storage_key), ...] concurrently. Stops scheduling new
+    transfers after the first failure and re-raises it once the transfers
+    already running have finished (so every key that did land is recorded).
+    """
+    def send(file_data, storage_key):
+        file_data.seek(0)
+        storage.upload_fileobj(file_data, storage_key)
+        return storage_key
+
+    error = None
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        futures = [pool.submit(send, file_data, storage_key) for file_data, storage_key in uploads]
+        for future in as_completed(futures):
+            try:
+                batch.new_keys.append(future.result())
+            except Exception as e:
+                if error is None:
+                    error = e
+                    for pending in futures:
+                        pending.cancel()
+    if error is not None:
+        raise error
+
+
+def store_batch(files, user_id, project_id):
+    """
+    Stores all files of a batch upload, sending them to S3 concurrently
+    (at most BATCH_UPLOAD_CONCURRENCY at a time).
+
+    In 'content_addressed' mode every file is hashed first and only content
+    that isn't stored yet is sent (once, even if the batch contains it twice).
+    In 'chunked' mode files are stored one after another, since each file's
+    chunks are already uploaded in parallel.
+
+    Blob and Chunk rows are added to the session but NOT committed, so the
+    caller commits them together with the Versions. If this returns None, the
+    caller must roll the session back.
+
+    Args:
+        files (list): FileStorage objects from request.files.
+        user_id (int): The ID of the user uploading the files.
+        project_id (int): The ID of the project the files belong to.
+
+    Returns:
+        StoredBatch or None: The stored files, or None if any upload failed
+        (objects already uploaded by the batch are deleted again).
+    """
+    mode = current_app.config['STORAGE_MODE']
+    storage = get_storage()
+    batch = StoredBatch()
+
+    try:
+        if mode == 'chunked':
+            for file_data in files:
+                chunked = upload_chunked(file_data, user_id=user_id, project_id=project_id)
+                if chunked is None:
+                    raise RuntimeError(f"Chunked upload failed for {file_data.filename}")
+                batch.new_keys.append(chunked.storage_key)
+                batch.stored.append((chunked.storage_key, chunked.chunks))
+            return batch
+
+        max_workers = current_app.config['BATCH_UPLOAD_CONCURRENCY']
+
+        if mode != 'content_addressed':
+            uploads = [(file_data, build_storage_key(project_id, user_id, file_data.filename)) for file_data in files]
+            _transfer(storage, uploads, batch, max_workers)
+            batch.stored = [(storage_key, None) for _, storage_key in uploads]
+            return batch
+
+        # 1. Hash locally and look up all hashes in one query
+        hashes = [_hash_file(file_data) for file_data in files]
+        existing = {
+            blob.sha256: blob
+            for blob in db.session.scalars(
+                db.select(Blob).filter(Blob.sha256.in_({sha256 for sha256, _ in hashes}))
+            )
+        }
+
+        # 2. Send each piece of new content once
+        to_send = {} # sha256 -> (file, storage_key)
+        for file_data, (sha256, _) in zip(files, hashes):
+            if sha256 not in existing and sha256 not in to_send:
+                to_send[sha256] = (file_data, build_storage_key(project_id, user_id, file_data.filename))
+        _transfer(storage, list(to_send.values()), batch, max_workers)
+
+        # 3. Reference every file's content
+        for sha256, size in hashes:
+            if sha256 in existing:
+                blob = existing[sha256]
+                storage_key = reference_blob(sha256, blob.storage_key, blob.size_bytes)
+            else:
+                our_key = to_send[sha256][1]
+                storage_key = reference_blob(sha256, our_key, size)
+                if storage_key != our_key and our_key in batch.new_keys:
+                    # A concurrent upload stored the same content first
+                    batch.new_keys.remove(our_key)
+                    _discard_redundant_copy(our_key, storage_key)
+            batch.stored.append((storage_key, None))
+        return batch
+
+    except Exception:
+        logger.exception("Batch upload failed", extra={'project_id': project_id})
+        batch.discard()
+        return None
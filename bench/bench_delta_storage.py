@@ -0,0 +1,131 @@
+"""
+Compares bytes uploaded and stored per version for today's full-copy storage
+against STORAGE_MODE = 'chunked' (content-defined chunk deltas).
+
+Runs entirely in memory: a chunked upload sends exactly the chunks its
+project has not stored yet, so counting new chunk bytes gives the S3 PUT
+traffic without needing a bucket.
+
+Usage:
+    python bench/bench_delta_storage.py [--size-mb 64] [--versions 10] [--json results.json]
+"""
+import argparse
+import hashlib
+import io
+import json
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from chunk_store import ContentDefinedChunker # noqa: E402
+from config import Config # noqa: E402
+
+
+def mb(n):
+    return n / (1024 * 1024)
+
+
+def edit_overwrite(data, rng):
+    """A DWG-style save: a few small regions rewritten in place."""
+    data = bytearray(data)
+    for _ in range(3):
+        offset = rng.randrange(len(data) - 4096)
+        data[offset:offset + 4096] = rng.randbytes(4096)
+    return bytes(data)
+
+
+def edit_insert(data, rng):
+    """A session edit: a short region inserted mid-file, shifting everything after it."""
+    offset = rng.randrange(len(data))
+    return data[:offset] + rng.randbytes(rng.randrange(1, 64 * 1024)) + data[offset:]
+
+
+def edit_append(data, rng):
+    """A ZIP/stem export that grows: new material appended at the end."""
+    return data + rng.randbytes(512 * 1024)
+
+
+SCENARIOS = {
+    'overwrite': edit_overwrite,
+    'insert': edit_insert,
+    'append': edit_append,
+}
+
+
+def run_scenario(name, edit, size, versions, chunker, seed):
+    rng = random.Random(seed)
+    data = rng.randbytes(size)
+    stored_chunks = {}
+    rows = []
+    full_stored = 0
+    chunked_stored = 0
+
+    for version_number in range(1, versions + 1):
+        if version_number > 1:
+            data = edit(data, rng)
+
+        started = time.perf_counter()
+        uploaded = 0
+        chunk_count = 0
+        for chunk in chunker.iter_chunks(io.BytesIO(data)):
+            chunk_count += 1
+            digest = hashlib.sha256(chunk).digest()
+            if digest not in stored_chunks:
+                stored_chunks[digest] = len(chunk)
+                uploaded += len(chunk)
+        elapsed = time.perf_counter() - started
+
+        full_stored += len(data)
+        chunked_stored += uploaded
+        rows.append({
+            'scenario': name,
+            'version': version_number,
+            'file_bytes': len(data),
+            'full_copy_uploaded': len(data),
+            'full_copy_stored_total': full_stored,
+            'chunked_uploaded': uploaded,
+            'chunked_stored_total': chunked_stored,
+            'chunks': chunk_count,
+            'chunking_mb_per_s': round(len(data) / (1024 * 1024) / elapsed, 1),
+        })
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--size-mb', type=int, default=64, help='Size of the first version')
+    parser.add_argument('--versions', type=int, default=10, help='Versions per scenario')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--json', help='Also write the raw rows to this file')
+    args = parser.parse_args()
+
+    chunker = ContentDefinedChunker(Config.CHUNK_MIN_SIZE, Config.CHUNK_AVG_SIZE, Config.CHUNK_MAX_SIZE)
+    all_rows = []
+
+    header = f"{'scenario':<10} {'ver':>3} {'file MB':>8} {'full up MB':>10} {'delta up MB':>11} {'full stored MB':>14} {'delta stored MB':>15} {'chunks':>6}"
+    print(header)
+    print('-' * len(header))
+    for name, edit in SCENARIOS.items():
+        rows = run_scenario(name, edit, args.size_mb * 1024 * 1024, args.versions, chunker, args.seed)
+        all_rows.extend(rows)
+        for row in rows:
+            print(
+                f"{row['scenario']:<10} {row['version']:>3} {mb(row['file_bytes']):>8.1f} "
+                f"{mb(row['full_copy_uploaded']):>10.1f} {mb(row['chunked_uploaded']):>11.2f} "
+                f"{mb(row['full_copy_stored_total']):>14.1f} {mb(row['chunked_stored_total']):>15.1f} "
+                f"{row['chunks']:>6}"
+            )
+        last = rows[-1]
+        print(f"  -> {name}: chunked mode stores {last['chunked_stored_total'] / last['full_copy_stored_total']:.1%} "
+              f"of the full-copy bytes after {args.versions} versions\n")
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(all_rows, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
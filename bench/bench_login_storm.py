@@ -0,0 +1,221 @@
+"""
+Login storm: login throughput, and the latency of other routes while it lasts.
+
+Serves create_app() on a local threaded HTTP server. Many clients then log
+in at once while a probe client keeps loading the dashboard and a
+project page. The probe's latency is measured before the storm (idle) and
+during it. This runs once with bcrypt inline on the request threads
+(PASSWORD_HASH_WORKERS = 0) and once on the hashing process pool, so the
+two can be compared. With the pool, logins beyond PASSWORD_HASH_QUEUE_MAX
+are answered 503 at once, and the probe should stay close to its idle
+latency.
+
+Needs the PostgreSQL database configured in .env (DB_HOST, DB_NAME, ...).
+It creates its own throwaway users and project.
+
+Usage:
+    python bench/bench_login_storm.py [--clients 32] [--seconds 10] [--rounds 12]
+        [--workers 2] [--queue-max 32] [--modes inline,pool] [--json results.json]
+"""
+import argparse
+import http.client
+import json
+import logging
+import math
+import os
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from urllib.parse import urlencode
+import bcrypt
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# The storage settings are read when config is imported, so they are set first
+STORAGE_DIR = tempfile.TemporaryDirectory(prefix='collabtrack-bench-')
+os.environ['STORAGE_BACKEND'] = 'local'
+os.environ['LOCAL_STORAGE_ROOT'] = STORAGE_DIR.name
+os.environ['LOG_REQUESTS'] = 'false'
+
+from werkzeug.serving import make_server # noqa: E402
+from app import create_app # noqa: E402
+from database import db # noqa: E402
+from models import User, Project # noqa: E402
+from permissions import set_member_role # noqa: E402
+from password_hashing import PasswordHasher # noqa: E402
+
+PASSWORD = 'bench-password'
+
+
+def percentile(sorted_values, percent):
+    """Nearest-rank percentile of an already sorted list."""
+    if not sorted_values:
+        return None
+    rank = max(math.ceil(percent / 100 * len(sorted_values)), 1)
+    return round(sorted_values[rank - 1] * 1000, 2)
+
+
+def request(port, method, path, body=None, cookie=None):
+    """Returns (status, seconds, set-cookie header)."""
+    connection = http.client.HTTPConnection('127.0.0.1', port, timeout=60)
+    headers = {}
+    if body is not None:
+        headers['Content-Type'] = 'application/x-www-form-urlencoded'
+    if cookie:
+        headers['Cookie'] = cookie
+    started = time.perf_counter()
+    try:
+        connection.request(method, path, body=body, headers=headers)
+        response = connection.getresponse()
+        response.read()
+        return response.status, time.perf_counter() - started, response.getheader('Set-Cookie')
+    finally:
+        connection.close()
+
+
+def login_body(email):
+    return urlencode({'email': email, 'password': PASSWORD})
+
+
+def seed(app, clients, rounds):
+    """Creates the storm users (sharing one precomputed hash) and the probe's project."""
+    run_id = uuid.uuid4().hex[:8]
+    with app.app_context():
+        password_hash = bcrypt.hashpw(PASSWORD.encode('utf-8'), bcrypt.gensalt(rounds)).decode('utf-8')
+        users = [User(email=f"storm-{run_id}-{i}@example.com", password_hash=password_hash) for i in range(clients + 1)]
+        db.session.add_all(users)
+        db.session.flush()
+        probe_user = users[-1]
+        project = Project(name='storm: probe project', owner_id=probe_user.user_id)
+        db.session.add(project)
+        db.session.flush()
+        set_member_role(project.project_id, probe_user.user_id, 'owner')
+        db.session.commit()
+        return [user.email for user in users[:-1]], probe_user.email, project.project_id
+
+
+def probe(port, cookie, project_id, stop, latencies, interval):
+    paths = ['/dashboard', f'/project/{project_id}']
+    i = 0
+    while not stop.is_set():
+        status, seconds, _ = request(port, 'GET', paths[i % 2], cookie=cookie)
+        if status == 200:
+            latencies.append(seconds)
+        i += 1
+        time.sleep(interval)
+
+
+def storm_client(port, email, stop, results):
+    while not stop.is_set():
+        status, seconds, _ = request(port, 'POST', '/login', body=login_body(email))
+        results.append((status, seconds))
+
+
+def run_mode(app, mode, args, emails, probe_email, project_id):
+    app.config['PASSWORD_HASH_WORKERS'] = 0 if mode == 'inline' else args.workers
+    app.config['PASSWORD_HASH_QUEUE_MAX'] = args.queue_max
+    app.extensions['password_hasher'] = PasswordHasher(app)
+
+    server = make_server('127.0.0.1', 0, app, threaded=True)
+    port = server.server_port
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    try:
+        # Logged-in probe session (this login also starts the hashing pool)
+        status, _, set_cookie = request(port, 'POST', '/login', body=login_body(probe_email))
+        if status != 302 or not set_cookie:
+            raise RuntimeError(f"probe login failed with {status}")
+        cookie = set_cookie.split(';', 1)[0]
+
+        # 1. Probe latency with nothing else going on
+        idle = []
+        stop = threading.Event()
+        probe_thread = threading.Thread(target=probe, args=(port, cookie, project_id, stop, idle, args.probe_interval))
+        probe_thread.start()
+        time.sleep(args.idle_seconds)
+        stop.set()
+        probe_thread.join()
+
+        # 2. Probe latency during the storm
+        busy = []
+        results = []
+        stop = threading.Event()
+        threads = [threading.Thread(target=probe, args=(port, cookie, project_id, stop, busy, args.probe_interval))]
+        threads += [
+            threading.Thread(target=storm_client, args=(port, email, stop, results))
+            for email in emails
+        ]
+        started = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        time.sleep(args.seconds)
+        stop.set()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - started
+    finally:
+        server.shutdown()
+
+    ok = sorted(seconds for status, seconds in results if status == 302)
+    rejected = sum(1 for status, _ in results if status == 503)
+    idle.sort()
+    busy.sort()
+    return {
+        'logins_ok': len(ok),
+        'logins_per_s': round(len(ok) / elapsed, 2),
+        'logins_rejected_503': rejected,
+        'logins_other': len(results) - len(ok) - rejected,
+        'login_p50_ms': percentile(ok, 50),
+        'login_p99_ms': percentile(ok, 99),
+        'probe_idle_p50_ms': percentile(idle, 50),
+        'probe_idle_p99_ms': percentile(idle, 99),
+        'probe_storm_p50_ms': percentile(busy, 50),
+        'probe_storm_p99_ms': percentile(busy, 99),
+        'probe_storm_requests': len(busy),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--clients', type=int, default=32, help='Concurrent logging-in clients')
+    parser.add_argument('--seconds', type=float, default=10, help='Length of the storm')
+    parser.add_argument('--idle-seconds', type=float, default=3, help='Probe time before the storm')
+    parser.add_argument('--probe-interval', type=float, default=0.05, help='Pause between probe requests')
+    parser.add_argument('--rounds', type=int, default=None, help='bcrypt work factor (default: BCRYPT_LOG_ROUNDS)')
+    parser.add_argument('--workers', type=int, default=None, help='Pool size (default: PASSWORD_HASH_WORKERS)')
+    parser.add_argument('--queue-max', type=int, default=None, help='Admission limit (default: PASSWORD_HASH_QUEUE_MAX)')
+    parser.add_argument('--modes', default='inline,pool')
+    parser.add_argument('--json', help='Write the results to this file')
+    args = parser.parse_args()
+
+    app = create_app()
+    logging.getLogger('werkzeug').setLevel(logging.WARNING) # One access-log line per request otherwise
+    args.rounds = args.rounds or app.config['BCRYPT_LOG_ROUNDS']
+    args.workers = args.workers or max(app.config['PASSWORD_HASH_WORKERS'], 1)
+    args.queue_max = args.queue_max or app.config['PASSWORD_HASH_QUEUE_MAX']
+    app.config['BCRYPT_LOG_ROUNDS'] = args.rounds
+    with app.app_context():
+        db.create_all()
+    emails, probe_email, project_id = seed(app, args.clients, args.rounds)
+
+    print(f"{args.clients} clients for {args.seconds:g}s, bcrypt cost {args.rounds}, "
+          f"pool of {args.workers} (admits {args.queue_max}), {os.cpu_count()} CPUs")
+    results = {}
+    try:
+        for mode in args.modes.split(','):
+            result = results[mode] = run_mode(app, mode, args, emails, probe_email, project_id)
+            print(f"{mode:<7} logins {result['logins_per_s']:>7.1f}/s ok, {result['logins_rejected_503']:>5} x 503, "
+                  f"login p50/p99 {result['login_p50_ms']}/{result['login_p99_ms']} ms | "
+                  f"probe idle p50/p99 {result['probe_idle_p50_ms']}/{result['probe_idle_p99_ms']} ms, "
+                  f"storm {result['probe_storm_p50_ms']}/{result['probe_storm_p99_ms']} ms")
+    finally:
+        STORAGE_DIR.cleanup()
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({'settings': vars(args), 'modes': results}, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
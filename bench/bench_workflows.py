@@ -0,0 +1,257 @@
+"""
+End-to-end benchmark of the core workflows, driven through create_app().
+
+Covers register, login, create_project, upload_version (small and large
+files), project_details on projects with 10 to 100,000 versions, and
+download_file. Requests go through Flask's test client, so they take the
+full WSGI path without a network in between. The database is the
+PostgreSQL one configured in .env. Files go to the local storage backend
+in a temporary directory, which stands in for S3 and keeps runs
+repeatable. Each workflow reports throughput, p50/p99 latency and peak
+Python memory. Memory is traced in one extra request per workflow, so
+tracemalloc does not skew the timings.
+
+Results are written as JSON. Save a run as the baseline for a machine
+(--save-baseline). Later runs compared against it (--baseline) exit
+non-zero when a workflow's p99, throughput or peak memory is worse than
+the baseline by more than --tolerance.
+
+Needs the PostgreSQL database configured in .env (DB_HOST, DB_NAME, ...).
+It creates its own throwaway users and projects.
+
+Usage:
+    python bench/bench_workflows.py [--iterations 50] [--history 10,1000,100000]
+        [--large-mb 32] [--json results.json]
+        [--save-baseline bench/baselines/workflows.json]
+        [--baseline bench/baselines/workflows.json] [--tolerance 0.25]
+"""
+import argparse
+import io
+import json
+import math
+import os
+import platform
+import sys
+import tempfile
+import time
+import tracemalloc
+import uuid
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# The storage settings are read when config is imported, so they are set first
+STORAGE_DIR = tempfile.TemporaryDirectory(prefix='collabtrack-bench-')
+os.environ['STORAGE_BACKEND'] = 'local'
+os.environ['LOCAL_STORAGE_ROOT'] = STORAGE_DIR.name
+os.environ['ASYNC_UPLOADS'] = 'false' # Time the upload itself, not the hand-off to a worker
+os.environ['LOG_REQUESTS'] = 'false' # Keep the per-request log lines out of the report
+
+from app import create_app # noqa: E402
+from database import db # noqa: E402
+from models import Project # noqa: E402
+from permissions import set_member_role # noqa: E402
+
+PASSWORD = 'bench-password'
+
+
+def percentile(sorted_values, percent):
+    """Nearest-rank percentile of an already sorted list."""
+    rank = max(math.ceil(percent / 100 * len(sorted_values)), 1)
+    return sorted_values[rank - 1]
+
+
+def measure(name, call, iterations, expected_status):
+    """
+    Runs call(i) for i in 0..iterations-1, then once more under tracemalloc.
+
+    Returns:
+        dict: Throughput, latency percentiles (ms) and peak traced memory (KB).
+    """
+    latencies = []
+    started = time.perf_counter()
+    for i in range(iterations):
+        call_started = time.perf_counter()
+        response = call(i)
+        latencies.append(time.perf_counter() - call_started)
+        if response.status_code != expected_status:
+            raise RuntimeError(f"{name}: expected {expected_status}, got {response.status_code}")
+    elapsed = time.perf_counter() - started
+
+    tracemalloc.start()
+    try:
+        call(iterations)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    latencies.sort()
+    return {
+        'iterations': iterations,
+        'ops_per_s': round(iterations / elapsed, 2),
+        'p50_ms': round(percentile(latencies, 50) * 1000, 3),
+        'p99_ms': round(percentile(latencies, 99) * 1000, 3),
+        'max_ms': round(latencies[-1] * 1000, 3),
+        'peak_kb': round(peak / 1024, 1),
+    }
+
+
+def seed_project(app, user_id, version_count):
+    """Creates a project owned by user_id with version_count versions, in one INSERT ... SELECT."""
+    with app.app_context():
+        project = Project(name=f"bench: {version_count} versions", owner_id=user_id)
+        db.session.add(project)
+        db.session.flush()
+        set_member_role(project.project_id, user_id, 'owner')
+        db.session.execute(
+            db.text("""
+                INSERT INTO versions (project_id, uploader_id, version_number, storage_key, file_name, uploaded_at)
+                SELECT :project_id, :user_id, n, 'bench/' || :project_id || '/' || n, 'take_' || n || '.zip',
+                       timezone('utc', now()) - n * interval '1 second'
+                FROM generate_series(1, :count) AS n
+            """),
+            {'project_id': project.project_id, 'user_id': user_id, 'count': version_count}
+        )
+        project.last_version_number = version_count
+        db.session.commit()
+        # Refresh planner statistics as autovacuum eventually would; right
+        # after a bulk insert they still describe a tiny table
+        db.session.execute(db.text("ANALYZE versions"))
+        db.session.commit()
+        return project.project_id
+
+
+def run(app, args):
+    client = app.test_client()
+    run_id = uuid.uuid4().hex[:8]
+    email = lambda i: f"bench-{run_id}-{i}@example.com"
+    results = {}
+
+    def record(name, call, iterations, expected_status):
+        results[name] = measure(name, call, iterations, expected_status)
+        result = results[name]
+        print(f"{name:<28} {result['ops_per_s']:>9.1f}/s  p50 {result['p50_ms']:>9.2f} ms  "
+              f"p99 {result['p99_ms']:>9.2f} ms  peak {result['peak_kb']:>9.1f} KB")
+
+    # 1. Accounts (both dominated by bcrypt by design)
+    record('register', lambda i: client.post('/register', data={'email': email(i), 'password': PASSWORD}),
+           args.iterations, 302)
+    record('login', lambda i: client.post('/login', data={'email': email(i % args.iterations), 'password': PASSWORD}),
+           args.iterations, 302)
+    with client.session_transaction() as session:
+        user_id = session['user_id']
+
+    # 2. Projects and uploads
+    record('create_project', lambda i: client.post('/create_project', data={'name': f"bench {run_id} {i}"}),
+           args.iterations, 302)
+    project_id = seed_project(app, user_id, 0)
+
+    small = os.urandom(args.small_kb * 1024)
+    large = os.urandom(args.large_mb * 1024 * 1024)
+
+    def upload(data, file_name):
+        return lambda i: client.post(
+            '/upload_version',
+            data={'project_id': str(project_id), 'version_note': 'bench', 'file': (io.BytesIO(data), file_name)},
+            content_type='multipart/form-data'
+        )
+
+    record(f'upload_version_{args.small_kb}kb', upload(small, 'small.zip'), args.iterations, 302)
+    record(f'upload_version_{args.large_mb}mb', upload(large, 'large.zip'), args.large_iterations, 302)
+
+    # 3. First page of the version history, however long it is
+    for version_count in args.history:
+        history_id = seed_project(app, user_id, version_count)
+        record(f'project_details_{version_count}',
+               lambda i: client.get(f'/project/{history_id}', buffered=True),
+               args.iterations, 200)
+
+    # 4. Downloads: the route issues a signed URL and redirects to it
+    with app.app_context():
+        version_id = db.session.scalar(
+            db.text("SELECT min(version_id) FROM versions WHERE project_id = :project_id"),
+            {'project_id': project_id}
+        )
+    record('download_file', lambda i: client.get(f'/download/{version_id}'), args.iterations, 302)
+    downloaded = client.get(f'/download/{version_id}', follow_redirects=True)
+    if downloaded.data != small:
+        raise RuntimeError("download_file: downloaded bytes differ from the upload")
+
+    return results
+
+
+def compare(results, baseline, tolerance):
+    """Returns one message per workflow metric that regressed beyond tolerance."""
+    regressions = []
+    for name, result in results['workflows'].items():
+        base = baseline['workflows'].get(name)
+        if base is None:
+            continue
+        if result['p99_ms'] > base['p99_ms'] * (1 + tolerance):
+            regressions.append(f"{name}: p99 {result['p99_ms']} ms vs baseline {base['p99_ms']} ms")
+        if result['ops_per_s'] < base['ops_per_s'] * (1 - tolerance):
+            regressions.append(f"{name}: {result['ops_per_s']}/s vs baseline {base['ops_per_s']}/s")
+        if result['peak_kb'] > base['peak_kb'] * (1 + tolerance):
+            regressions.append(f"{name}: peak {result['peak_kb']} KB vs baseline {base['peak_kb']} KB")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--iterations', type=int, default=50, help='Requests per workflow')
+    parser.add_argument('--large-iterations', type=int, default=5, help='Requests for the large upload')
+    parser.add_argument('--small-kb', type=int, default=64, help='Size of the small upload')
+    parser.add_argument('--large-mb', type=int, default=32, help='Size of the large upload')
+    parser.add_argument('--history', default='10,1000,100000',
+                        help='Comma-separated version counts for project_details')
+    parser.add_argument('--json', help='Write the results to this file')
+    parser.add_argument('--save-baseline', help='Write the results to this file as the new baseline')
+    parser.add_argument('--baseline', help='Compare against this baseline; exit 1 on regressions')
+    parser.add_argument('--tolerance', type=float, default=0.25,
+                        help='Allowed slowdown/growth relative to the baseline (0.25 = 25%%)')
+    args = parser.parse_args()
+    args.history = [int(count) for count in args.history.split(',') if count]
+
+    app = create_app()
+    with app.app_context():
+        db.create_all()
+
+    try:
+        workflows = run(app, args)
+    finally:
+        STORAGE_DIR.cleanup()
+
+    results = {
+        'created_at': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+        'python': platform.python_version(),
+        'machine': platform.node(),
+        'settings': {
+            'iterations': args.iterations,
+            'large_iterations': args.large_iterations,
+            'small_kb': args.small_kb,
+            'large_mb': args.large_mb,
+            'history': args.history,
+            'storage_mode': app.config['STORAGE_MODE'],
+        },
+        'workflows': workflows,
+    }
+
+    for path in (args.json, args.save_baseline):
+        if path:
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+            with open(path, 'w') as f:
+                json.dump(results, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        if baseline.get('settings') != results['settings']:
+            print("WARNING: Baseline was recorded with different settings; comparing anyway.")
+        regressions = compare(results, baseline, args.tolerance)
+        for message in regressions:
+            print(f"REGRESSION {message}")
+        print(f"{len(regressions)} regressions against {args.baseline} (tolerance {args.tolerance:.0%})")
+        sys.exit(1 if regressions else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,121 @@
+"""
+Concurrent-upload stress test for version number allocation.
+
+Many threads record versions for the same project at once (no S3 involved),
+then the script checks that the numbers handed out are exactly 1..N with no
+duplicates or gaps. It also times allocation on an empty project against one
+with a long history, which should cost the same.
+
+Needs the PostgreSQL database configured in .env (DB_HOST, DB_NAME, ...).
+It creates its own throwaway user and projects.
+
+Usage:
+    python bench/stress_version_allocation.py [--threads 32] [--uploads 50] [--history 100000]
+"""
+import argparse
+import os
+import sys
+import threading
+import time
+import uuid
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app import create_app # noqa: E402
+from database import db # noqa: E402
+from models import User, Project, Version # noqa: E402
+from versioning import add_version, allocate_version_numbers # noqa: E402
+
+
+def record_versions(app, project_id, user_id, uploads, errors):
+    with app.app_context():
+        for _ in range(uploads):
+            try:
+                add_version(project_id, user_id, f"stress/{uuid.uuid4()}", 'take.wav', None)
+                db.session.commit()
+            except Exception as e:
+                db.session.rollback()
+                errors.append(repr(e))
+
+
+def time_allocations(project_id, rounds):
+    started = time.perf_counter()
+    for _ in range(rounds):
+        allocate_version_numbers(project_id)
+        db.session.rollback() # Only measure the allocation itself
+    return (time.perf_counter() - started) / rounds * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--threads', type=int, default=32)
+    parser.add_argument('--uploads', type=int, default=50, help='Versions recorded per thread')
+    parser.add_argument('--history', type=int, default=100000, help='Versions seeded into the "old" project')
+    args = parser.parse_args()
+
+    app = create_app()
+    with app.app_context():
+        db.create_all()
+        user = User(email=f"stress-{uuid.uuid4()}@example.com", password_hash='x')
+        db.session.add(user)
+        db.session.flush()
+        project = Project(name='stress: concurrent uploads', owner_id=user.user_id)
+        empty = Project(name='stress: empty history', owner_id=user.user_id)
+        old = Project(name='stress: long history', owner_id=user.user_id)
+        db.session.add_all([project, empty, old])
+        db.session.commit()
+        user_id, project_id = user.user_id, project.project_id
+        empty_id, old_id = empty.project_id, old.project_id
+
+    # 1. Concurrent uploads to one project
+    errors = []
+    threads = [
+        threading.Thread(target=record_versions, args=(app, project_id, user_id, args.uploads, errors))
+        for _ in range(args.threads)
+    ]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+
+    expected = args.threads * args.uploads
+    with app.app_context():
+        numbers = db.session.scalars(
+            db.select(Version.version_number).filter_by(project_id=project_id)
+        ).all()
+        counter = db.session.get(Project, project_id).last_version_number
+
+    ok = not errors and sorted(numbers) == list(range(1, expected + 1)) and counter == expected
+    print(f"{expected} concurrent versions in {elapsed:.2f}s ({expected / elapsed:.0f}/s) "
+          f"across {args.threads} threads: {'OK' if ok else 'FAILED'}")
+    if errors:
+        print(f"  {len(errors)} errors, first: {errors[0]}")
+    if len(set(numbers)) != len(numbers):
+        print(f"  duplicate numbers: {len(numbers) - len(set(numbers))}")
+
+    # 2. Allocation cost with and without a long history
+    with app.app_context():
+        db.session.execute(
+            db.insert(Version),
+            [
+                {'project_id': old_id, 'uploader_id': user_id, 'version_number': n,
+                 'storage_key': f"stress/{old_id}/{n}", 'file_name': 'take.wav'}
+                for n in range(1, args.history + 1)
+            ]
+        )
+        db.session.execute(
+            db.update(Project).filter_by(project_id=old_id).values(last_version_number=args.history)
+        )
+        db.session.commit()
+
+        empty_ms = time_allocations(empty_id, 200)
+        old_ms = time_allocations(old_id, 200)
+    print(f"allocation: {empty_ms:.3f} ms (0 versions) vs {old_ms:.3f} ms ({args.history} versions)")
+
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,166 @@
+import hashlib
+import logging
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from werkzeug.utils import secure_filename
+from database import db
+from models import Blob
+from s3_upload import build_storage_key
+from storage import get_storage
+
+logger = logging.getLogger(__name__)
+
+# Read size used when hashing a spooled upload before deciding whether to send it
+HASH_CHUNK_SIZE = 1024 * 1024
+
+class HashingReader:
+    """Wraps a reader and SHA-256 hashes every byte that passes through read()."""
+
+    def __init__(self, reader):
+        self._reader = reader
+        self._hash = hashlib.sha256()
+        self.size = 0
+        self.filename = getattr(reader, 'filename', None)
+
+    def read(self, size=-1):
+        data = self._reader.read(size)
+        self._hash.update(data)
+        self.size += len(data)
+        return data
+
+    def hexdigest(self):
+        return self._hash.hexdigest()
+
+
+def find_blob(sha256):
+    """Returns the Blob with this content hash, or None."""
+    return db.session.get(Blob, sha256)
+
+
+def reference_blob(sha256, storage_key, size_bytes):
+    """
+    Records one more reference to the content with this hash, creating the
+    Blob row if this is the first copy.
+
+    This runs as a single INSERT ... ON CONFLICT so two users uploading the same
+    file at the same moment can't both create a row. It is NOT committed here:
+    the caller commits it in the same transaction as the Version insert.
+
+    Returns:
+        str: The storage key every reference should use. If another upload won
+             the race this is *their* key, and storage_key is now redundant.
+    """
+    stmt = (
+        pg_insert(Blob)
+        .values(sha256=sha256, storage_key=storage_key, size_bytes=size_bytes, ref_count=1)
+        .on_conflict_do_update(
+            index_elements=[Blob.sha256],
+            set_={'ref_count': Blob.ref_count + 1}
+        )
+        .returning(Blob.storage_key)
+    )
+    return db.session.execute(stmt).scalar_one()
+
+
+def release_blob(storage_key):
+    """
+    Drops one reference to the blob stored at storage_key (not committed).
+
+    Returns:
+        bool: True if that was the last reference and the S3 object can be deleted.
+    """
+    remaining = db.session.execute(
+        db.update(Blob)
+          .where(Blob.storage_key == storage_key)
+          .values(ref_count=Blob.ref_count - 1)
+          .returning(Blob.ref_count)
+    ).scalar_one_or_none()
+
+    if remaining is not None and remaining <= 0:
+        db.session.execute(db.delete(Blob).where(Blob.storage_key == storage_key))
+        return True
+    return False
+
+
+def _discard_redundant_copy(our_key, shared_key):
+    """Deletes our freshly uploaded object if a concurrent upload already stored the content."""
+    if our_key != shared_key:
+        try:
+            get_storage().delete_object(our_key)
+        except Exception as e:
+            logger.warning("Could not delete redundant copy", extra={'storage_key': our_key, 'error': str(e)})
+
+
+def upload_file_deduplicated(file_data, user_id, project_id):
+    """
+    Content-addressed counterpart of upload_file_to_s3 for spooled uploads.
+
+    The spooled file is hashed locally first; if the content is already stored
+    the S3 upload is skipped entirely and only a reference is added.
+
+    Returns:
+        str or None: The (possibly shared) storage key, or None on failure.
+    """
+    filename = secure_filename(file_data.filename)
+
+    try:
+        file_data.seek(0)
+        hasher = HashingReader(file_data)
+        while hasher.read(HASH_CHUNK_SIZE):
+            pass
+        sha256 = hasher.hexdigest()
+
+        existing = find_blob(sha256)
+        if existing is not None:
+            return reference_blob(sha256, existing.storage_key, existing.size_bytes)
+
+        storage_key = build_storage_key(project_id, user_id, filename)
+        file_data.seek(0)
+        get_storage().upload_fileobj(file_data, storage_key)
+
+        shared_key = reference_blob(sha256, storage_key, hasher.size)
+        _discard_redundant_copy(storage_key, shared_key)
+        return shared_key
+
+    except Exception:
+        logger.exception("Deduplicated upload failed", extra={'file_name': filename})
+        return None
+
+
+def upload_stream_deduplicated(file_part, user_id, project_id):
+    """
+    Content-addressed counterpart of upload_stream_to_s3.
+
+    The body is hashed while it streams to S3. The hash is only known at the
+    end, so parts are still sent, but if the content turns out to be a
+    duplicate the multipart upload is aborted instead of completed and nothing
+    new is stored.
+
+    Returns:
+        str or None: The (possibly shared) storage key, or None on failure.
+    """
+    filename = secure_filename(file_part.filename)
+    storage_key = build_storage_key(project_id, user_id, filename)
+    hasher = HashingReader(file_part)
+    existing = {}
+
+    def keep_only_new_content():
+        blob = find_blob(hasher.hexdigest())
+        if blob is None:
+            return True
+        existing['blob'] = blob
+        return False
+
+    try:
+        get_storage().upload_stream(hasher, storage_key, before_complete=keep_only_new_content)
+
+        if 'blob' in existing:
+            blob = existing['blob']
+            return reference_blob(blob.sha256, blob.storage_key, blob.size_bytes)
+
+        shared_key = reference_blob(hasher.hexdigest(), storage_key, hasher.size)
+        _discard_redundant_copy(storage_key, shared_key)
+        return shared_key
+
+    except Exception:
+        logger.exception("Deduplicated streaming upload failed", extra={'file_name': filename})
+        return None
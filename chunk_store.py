@@ -0,0 +1,352 @@
+import hashlib
+import json
+import logging
+import random
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from flask import current_app
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from werkzeug.utils import secure_filename
+from database import db
+from models import Chunk, VersionChunk, chunk_storage_key
+from s3_upload import build_storage_key
+from storage import get_storage, read_full
+
+try:
+    import numpy as np
+except ImportError: # Only needed for STORAGE_MODE = 'chunked'
+    np = None
+
+logger = logging.getLogger(__name__)
+
+# How many chunk hashes to look up in the chunks table per query
+LOOKUP_BATCH_SIZE = 16
+
+# How many chunks a download fetches ahead of the one being sent
+DOWNLOAD_PREFETCH = 4
+
+
+@lru_cache(maxsize=1)
+def _gear_table():
+    """
+    Random per-byte values for the gear rolling hash. Seeded so that every
+    process (and every deploy) cuts identical content at identical offsets.
+    """
+    rng = random.Random(0x436F6C6C)
+    return np.array([rng.getrandbits(32) for _ in range(256)], dtype=np.uint32)
+
+
+def _top_bits_mask(bits):
+    """A mask over the highest `bits` bits of a 32-bit hash."""
+    return ((1 << bits) - 1) << (32 - bits)
+
+
+def gear_hashes(data):
+    """
+    Computes the 32-bit gear rolling hash at every byte offset of data.
+
+    The gear hash is h = (h << 1) + GEAR[byte], so after 32 steps a byte's
+    contribution has been shifted out completely; the hash at offset n is
+    sum(GEAR[data[n - i]] << i for i in 0..31). That lets us build it for the
+    whole buffer with 5 vectorized doubling steps instead of a per-byte loop.
+    """
+    h = _gear_table()[np.frombuffer(data, dtype=np.uint8)]
+    shifted = np.empty_like(h)
+    width = 1
+    while width < 32:
+        # shifted is filled from the old h before h is updated in place
+        np.left_shift(h[:-width], width, out=shifted[:-width])
+        h[width:] += shifted[:-width]
+        width *= 2
+    return h
+
+
+class ContentDefinedChunker:
+    """
+    Splits a byte stream into content-defined chunks (FastCDC-style).
+
+    Boundaries are placed where the rolling hash matches a mask, so an insert
+    or edit only changes the chunks around it; everything before and after
+    still cuts at the same places and dedupes against earlier versions.
+    """
+
+    def __init__(self, min_size, avg_size, max_size):
+        if np is None:
+            raise RuntimeError("STORAGE_MODE = 'chunked' requires numpy to be installed.")
+        self.min_size = min_size
+        self.avg_size = avg_size
+        self.max_size = max_size
+
+        # Normalized chunking: a stricter mask before the average size and a
+        # looser one after it pull chunk sizes towards avg_size.
+        bits = max(avg_size.bit_length() - 1, 4)
+        self.strict_mask = np.uint32(_top_bits_mask(bits + 2))
+        self.loose_mask = np.uint32(_top_bits_mask(bits - 2))
+
+        self.read_size = max(4 * max_size, 8 * 1024 * 1024)
+
+    @classmethod
+    def from_config(cls, config):
+        return cls(config['CHUNK_MIN_SIZE'], config['CHUNK_AVG_SIZE'], config['CHUNK_MAX_SIZE'])
+
+    def _cut_points(self, buf, final):
+        """
+        Returns the chunk end offsets in buf that are already certain.
+
+        Without `final`, a boundary that depends on bytes not yet read is
+        left for the next call.
+        """
+        n = len(buf)
+        hashes = gear_hashes(buf)
+        # A match at byte p means the chunk ends after p, i.e. at offset p + 1
+        strict = np.flatnonzero((hashes & self.strict_mask) == 0) + 1
+        loose = np.flatnonzero((hashes & self.loose_mask) == 0) + 1
+        del hashes
+
+        cuts = []
+        start = 0
+        while start < n:
+            lowest = start + self.min_size
+            normal = start + self.avg_size
+            highest = start + self.max_size
+
+            if lowest >= n:
+                if final:
+                    cuts.append(n)
+                break
+
+            i = np.searchsorted(strict, lowest)
+            if i < len(strict) and strict[i] < normal:
+                cut = int(strict[i])
+            elif n < normal:
+                if not final:
+                    break
+                cut = n
+            else:
+                j = np.searchsorted(loose, normal)
+                if j < len(loose) and loose[j] < highest:
+                    cut = int(loose[j])
+                elif n >= highest:
+                    cut = highest
+                elif final:
+                    cut = n
+                else:
+                    break
+
+            cuts.append(cut)
+            start = cut
+        return cuts
+
+    def iter_chunks(self, reader):
+        """Yields the chunks of reader's content in order, as bytes."""
+        buf = bytearray()
+        at_eof = False
+        while True:
+            if not at_eof:
+                data = read_full(reader, self.read_size)
+                if data:
+                    buf.extend(data)
+                else:
+                    at_eof = True
+
+            if not buf:
+                return
+
+            previous = 0
+            for cut in self._cut_points(buf, final=at_eof):
+                yield bytes(buf[previous:cut])
+                previous = cut
+            del buf[:previous]
+
+
+class ChunkedUpload:
+    """Result of upload_chunked(): the manifest key plus what was transferred."""
+
+    def __init__(self, storage_key, chunks, total_bytes, uploaded_bytes):
+        self.storage_key = storage_key
+        self.chunks = chunks # [(sha256, size_bytes), ...] in file order
+        self.total_bytes = total_bytes
+        self.uploaded_bytes = uploaded_bytes
+
+
+def upload_chunked(reader, user_id, project_id):
+    """
+    Stores a file in chunked mode.
+
+    The reader is split into content-defined chunks; chunks the project already
+    has are skipped and the rest are uploaded in parallel (bounded by
+    S3_MULTIPART_CONCURRENCY and S3_UPLOAD_MEMORY_CAP). New Chunk rows are
+    added to the session but NOT committed: save_version_metadata commits them
+    together with the Version and its manifest.
+
+    Args:
+        reader: A FileStorage or StreamingForm file part.
+        user_id (int): The ID of the user uploading the file.
+        project_id (int): The ID of the project the file belongs to.
+
+    Returns:
+        ChunkedUpload or None: The upload result, or None on failure.
+    """
+    storage = get_storage()
+    chunker = ContentDefinedChunker.from_config(current_app.config)
+    filename = secure_filename(reader.filename)
+
+    # Bound the bytes held by queued/in-flight chunk uploads
+    slots = threading.BoundedSemaphore(
+        max(current_app.config['S3_UPLOAD_MEMORY_CAP'] // chunker.max_size, 1)
+    )
+
+    def put_chunk(sha256, data):
+        try:
+            storage.put_bytes(chunk_storage_key(project_id, sha256), data)
+        finally:
+            slots.release()
+
+    manifest = []
+    new_chunks = {} # sha256 -> size, uploaded by this call
+    known = set() # sha256s the project already had
+    futures = []
+    uploaded_bytes = 0
+
+    def flush(batch):
+        nonlocal uploaded_bytes
+        unseen = {sha256 for sha256, _ in batch if sha256 not in known and sha256 not in new_chunks}
+        if unseen:
+            known.update(db.session.scalars(
+                db.select(Chunk.sha256)
+                  .filter(Chunk.project_id == project_id, Chunk.sha256.in_(unseen))
+            ))
+        for sha256, data in batch:
+            if sha256 in known or sha256 in new_chunks:
+                continue
+            new_chunks[sha256] = len(data)
+            uploaded_bytes += len(data)
+            slots.acquire()
+            futures.append(pool.submit(put_chunk, sha256, data))
+        batch.clear()
+
+    try:
+        if hasattr(reader, 'seek'):
+            reader.seek(0)
+
+        with ThreadPoolExecutor(max_workers=storage.part_concurrency) as pool:
+            batch = []
+            for data in chunker.iter_chunks(reader):
+                sha256 = hashlib.sha256(data).hexdigest()
+                manifest.append((sha256, len(data)))
+                batch.append((sha256, data))
+                if len(batch) >= LOOKUP_BATCH_SIZE:
+                    flush(batch)
+            flush(batch)
+
+            for future in futures:
+                future.result() # Re-raises the first failed chunk upload
+
+        # Chunks this upload skipped must still be there when its Version
+        # commits. The share lock, held until then, keeps the chunk GC
+        # (storage_cleanup.py) off them; a chunk it already removed fails
+        # the upload here instead of every later download.
+        reused = known - new_chunks.keys()
+        if reused:
+            still_stored = set(db.session.scalars(
+                db.select(Chunk.sha256)
+                  .filter(Chunk.project_id == project_id, Chunk.sha256.in_(reused))
+                  .with_for_update(read=True)
+            ))
+            if still_stored != reused:
+                raise RuntimeError(f"{len(reused - still_stored)} reused chunks were garbage-collected during the upload")
+
+        if new_chunks:
+            db.session.execute(
+                pg_insert(Chunk)
+                  .values([
+                      {'project_id': project_id, 'sha256': sha256, 'size_bytes': size}
+                      for sha256, size in new_chunks.items()
+                  ])
+                  .on_conflict_do_nothing(index_elements=[Chunk.project_id, Chunk.sha256])
+            )
+
+        # Keep a copy of the manifest in S3 as well, so the object a Version
+        # points at describes the whole file even without the database.
+        storage_key = build_storage_key(project_id, user_id, filename) + '.manifest.json'
+        storage.put_bytes(storage_key, json.dumps({
+            'file_name': filename,
+            'size': sum(size for _, size in manifest),
+            'chunks': [{'sha256': sha256, 'size': size} for sha256, size in manifest],
+        }).encode('utf-8'))
+
+        return ChunkedUpload(
+            storage_key,
+            manifest,
+            total_bytes=sum(size for _, size in manifest),
+            uploaded_bytes=uploaded_bytes
+        )
+
+    except Exception:
+        logger.exception("Chunked upload failed", extra={'file_name': filename})
+        return None
+
+
+def add_version_manifest(version, chunks):
+    """Adds the VersionChunk rows for a freshly flushed chunked Version (not committed)."""
+    if not chunks:
+        return
+    db.session.execute(
+        db.insert(VersionChunk),
+        [
+            {'version_id': version.version_id, 'seq': seq, 'chunk_sha256': sha256, 'size_bytes': size}
+            for seq, (sha256, size) in enumerate(chunks)
+        ]
+    )
+
+
+def load_version_manifest(version):
+    """Returns [(sha256, size_bytes), ...] for a chunked Version, in file order."""
+    return db.session.execute(
+        db.select(VersionChunk.chunk_sha256, VersionChunk.size_bytes)
+          .filter_by(version_id=version.version_id)
+          .order_by(VersionChunk.seq)
+    ).all()
+
+
+def load_version_manifests(version_ids):
+    """Returns {version_id: [(sha256, size_bytes), ...]} for several chunked Versions in one query."""
+    manifests = {version_id: [] for version_id in version_ids}
+    if not manifests:
+        return manifests
+    rows = db.session.execute(
+        db.select(VersionChunk.version_id, VersionChunk.chunk_sha256, VersionChunk.size_bytes)
+          .filter(VersionChunk.version_id.in_(manifests))
+          .order_by(VersionChunk.version_id, VersionChunk.seq)
+    )
+    for version_id, sha256, size in rows:
+        manifests[version_id].append((sha256, size))
+    return manifests
+
+
+def iter_chunked_file(storage, project_id, manifest):
+    """
+    Reassembles a chunked file by streaming its chunks in order.
+
+    Fetches up to DOWNLOAD_PREFETCH chunks ahead so S3 latency overlaps with
+    sending the current chunk. Takes the storage service and manifest
+    explicitly because it runs after the request context is gone.
+    """
+    with ThreadPoolExecutor(max_workers=DOWNLOAD_PREFETCH) as pool:
+        pending = deque()
+        chunks = iter(manifest)
+
+        def fetch_next():
+            for sha256, _ in chunks:
+                pending.append(pool.submit(storage.get_bytes, chunk_storage_key(project_id, sha256)))
+                return
+
+        for _ in range(DOWNLOAD_PREFETCH):
+            fetch_next()
+
+        while pending:
+            data = pending.popleft().result()
+            fetch_next()
+            yield data
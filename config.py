@@ -1,4 +1,5 @@
 import os
+import tempfile
 from dotenv import load_dotenv
 
 # CRITICAL STEP: Load .env variables
@@ -18,19 +19,182 @@ class Config:
     DB_PASS = os.environ.get('DB_PASS')
     DB_HOST = os.environ.get('DB_HOST')
     DB_NAME = os.environ.get('DB_NAME')
+    DB_PORT = os.environ.get('DB_PORT', '5432')
     
     # SQLAlchemy format for the connection string
     SQLALCHEMY_DATABASE_URI = (
         f"postgresql://{DB_USER}:"
-        f"{DB_PASS}@{DB_HOST}:5432/{DB_NAME}"
+        f"{DB_PASS}@{DB_HOST}:{DB_PORT}/{DB_NAME}"
     )
     SQLALCHEMY_TRACK_MODIFICATIONS = False # Recommended to suppress warnings
+
+    # Connection pool settings (applied to the primary and the replica)
+    SQLALCHEMY_ENGINE_OPTIONS = {
+        'pool_size': int(os.environ.get('DB_POOL_SIZE', 10)), # Connections kept open per process
+        'max_overflow': int(os.environ.get('DB_MAX_OVERFLOW', 20)), # Extra connections allowed under bursts
+        'pool_timeout': int(os.environ.get('DB_POOL_TIMEOUT', 30)), # Seconds to wait for a free connection
+        'pool_recycle': int(os.environ.get('DB_POOL_RECYCLE', 1800)), # Reconnect before server/proxy idle timeouts
+        'pool_pre_ping': os.environ.get('DB_POOL_PRE_PING', 'true').lower() == 'true', # Drop dead connections on checkout
+    }
+
+    # Optional read replica. Views marked @replica_reads (see db_routing.py)
+    # read from it; a user who just wrote reads from the primary for
+    # REPLICA_READ_YOUR_WRITES_SECONDS so their own changes are visible.
+    # Two local databases work too: same host and port, different DB_REPLICA_NAME.
+    DB_REPLICA_HOST = os.environ.get('DB_REPLICA_HOST')
+    DB_REPLICA_PORT = os.environ.get('DB_REPLICA_PORT', DB_PORT)
+    DB_REPLICA_NAME = os.environ.get('DB_REPLICA_NAME', DB_NAME)
+    SQLALCHEMY_BINDS = {
+        'replica': f"postgresql://{DB_USER}:{DB_PASS}@{DB_REPLICA_HOST}:{DB_REPLICA_PORT}/{DB_REPLICA_NAME}",
+    } if DB_REPLICA_HOST else {}
+    REPLICA_READ_YOUR_WRITES_SECONDS = int(os.environ.get('REPLICA_READ_YOUR_WRITES_SECONDS', 30))
     
+    # Where version files live: 's3' (default) or 'local' (files under
+    # LOCAL_STORAGE_ROOT, for on-prem installs, tests and benchmarks; no
+    # direct browser uploads). See storage.py / local_storage.py.
+    STORAGE_BACKEND = os.environ.get('STORAGE_BACKEND', 's3')
+    LOCAL_STORAGE_ROOT = os.environ.get('LOCAL_STORAGE_ROOT', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'storage-data'))
+    LOCAL_STORAGE_FSYNC = os.environ.get('LOCAL_STORAGE_FSYNC', 'true').lower() == 'true' # fsync before an object becomes visible
+    # Behind nginx: internal location mapped to LOCAL_STORAGE_ROOT (e.g. '/protected-files/').
+    # Downloads are then answered with X-Accel-Redirect and nginx sends the file.
+    LOCAL_STORAGE_ACCEL_REDIRECT = os.environ.get('LOCAL_STORAGE_ACCEL_REDIRECT')
+    # Behind Apache/lighttpd (mod_xsendfile) instead: Flask's own X-Sendfile support
+    USE_X_SENDFILE = os.environ.get('USE_X_SENDFILE', 'false').lower() == 'true'
+
     # WS S3 Configuration 
     AWS_ACCESS_KEY_ID = os.environ.get('AWS_ACCESS_KEY_ID')
     AWS_SECRET_ACCESS_KEY = os.environ.get('AWS_SECRET_ACCESS_KEY')
     S3_BUCKET_NAME = os.environ.get('S3_BUCKET_NAME')
     AWS_REGION = os.environ.get('AWS_REGION')
+    # Optional: point at a local S3 stand-in (MinIO, moto server) instead of AWS
+    S3_ENDPOINT_URL = os.environ.get('S3_ENDPOINT_URL')
+
+    # Shared S3 client tuning (see storage.py)
+    # One client is created per app process, so the pool size caps how many
+    # concurrent S3 calls (uploads, downloads, signing) a process can make.
+    S3_MAX_POOL_CONNECTIONS = int(os.environ.get('S3_MAX_POOL_CONNECTIONS', 50))
+    S3_TCP_KEEPALIVE = os.environ.get('S3_TCP_KEEPALIVE', 'true').lower() == 'true'
+    S3_CONNECT_TIMEOUT = float(os.environ.get('S3_CONNECT_TIMEOUT', 5))
+    S3_READ_TIMEOUT = float(os.environ.get('S3_READ_TIMEOUT', 60))
+    S3_MAX_RETRIES = int(os.environ.get('S3_MAX_RETRIES', 5))
+    S3_RETRY_MODE = os.environ.get('S3_RETRY_MODE', 'adaptive') # 'legacy', 'standard' or 'adaptive'
+
+    # Streaming multipart uploads
+    # When enabled, upload_version streams the request body straight into S3
+    # multipart parts instead of letting Werkzeug spool the whole file first.
+    STREAMING_UPLOADS = os.environ.get('STREAMING_UPLOADS', 'false').lower() == 'true'
+    S3_MULTIPART_PART_SIZE = int(os.environ.get('S3_MULTIPART_PART_SIZE', 8 * 1024 * 1024)) # S3 minimum is 5 MiB
+    S3_MULTIPART_CONCURRENCY = int(os.environ.get('S3_MULTIPART_CONCURRENCY', 4)) # Parallel part uploads per file
+    S3_UPLOAD_MEMORY_CAP = int(os.environ.get('S3_UPLOAD_MEMORY_CAP', 64 * 1024 * 1024)) # Max buffered part bytes per upload
+
+    # How version content is laid out in S3:
+    # 'object'            - one uuid-keyed object per upload (original behaviour)
+    # 'content_addressed' - uploads are SHA-256 hashed and identical content is
+    #                       stored once as a shared, reference-counted Blob
+    # 'chunked'           - files are split into content-defined chunks and a
+    #                       version only uploads chunks its project hasn't stored
+    STORAGE_MODE = os.environ.get('STORAGE_MODE', 'object')
+    # Chunk size bounds for 'chunked' mode (average is a target, not a guarantee)
+    CHUNK_MIN_SIZE = int(os.environ.get('CHUNK_MIN_SIZE', 256 * 1024))
+    CHUNK_AVG_SIZE = int(os.environ.get('CHUNK_AVG_SIZE', 1024 * 1024))
+    CHUNK_MAX_SIZE = int(os.environ.get('CHUNK_MAX_SIZE', 4 * 1024 * 1024))
+
+    # Background uploads: the request only spools the file to local disk and
+    # returns 202 with a job id; a worker pool pushes it to S3 and commits the
+    # Version, retrying failures with exponential backoff (see upload_jobs.py).
+    ASYNC_UPLOADS = os.environ.get('ASYNC_UPLOADS', 'false').lower() == 'true'
+    UPLOAD_SPOOL_DIR = os.environ.get('UPLOAD_SPOOL_DIR', os.path.join(tempfile.gettempdir(), 'collabtrack-spool'))
+    UPLOAD_WORKERS = int(os.environ.get('UPLOAD_WORKERS', 4)) # Concurrent background uploads per process
+    UPLOAD_QUEUE_MAX = int(os.environ.get('UPLOAD_QUEUE_MAX', 64)) # Queued + running jobs before uploads get a 503
+    UPLOAD_MAX_ATTEMPTS = int(os.environ.get('UPLOAD_MAX_ATTEMPTS', 4)) # Tries per job, including the first
+    UPLOAD_RETRY_BACKOFF = float(os.environ.get('UPLOAD_RETRY_BACKOFF', 2.0)) # Seconds before the first retry, doubled after each
+    UPLOAD_JOB_TTL = int(os.environ.get('UPLOAD_JOB_TTL', 3600)) # Seconds a finished job's status stays queryable
+
+    # Batch uploads (/upload_versions): many files, one transaction
+    BATCH_UPLOAD_CONCURRENCY = int(os.environ.get('BATCH_UPLOAD_CONCURRENCY', 8)) # Files sent to S3 at once
+    BATCH_UPLOAD_MAX_FILES = int(os.environ.get('BATCH_UPLOAD_MAX_FILES', 100)) # Files per request
+
+    # Audio ingest: after an audio version (wav/aiff/flac/mp3) is saved, a
+    # background worker computes its waveform peaks and, if ffmpeg is
+    # installed, a low-bitrate preview (see audio_ingest.py). Needs numpy.
+    AUDIO_INGEST = os.environ.get('AUDIO_INGEST', 'true').lower() == 'true'
+    AUDIO_INGEST_WORKERS = int(os.environ.get('AUDIO_INGEST_WORKERS', 2))
+    FFMPEG_PATH = os.environ.get('FFMPEG_PATH', 'ffmpeg')
+    WAVEFORM_SAMPLE_RATE = int(os.environ.get('WAVEFORM_SAMPLE_RATE', 22050)) # Hz audio is decoded at (with ffmpeg)
+    # Peaks per waveform level, finest first; the last level is the history overview
+    WAVEFORM_LEVELS = tuple(int(n) for n in os.environ.get('WAVEFORM_LEVELS', '8192,2048,512,128').split(','))
+    AUDIO_PREVIEW_BITRATE = os.environ.get('AUDIO_PREVIEW_BITRATE', '64k')
+
+    # Direct-to-S3 browser uploads (presigned POST / multipart part URLs)
+    DIRECT_UPLOAD_URL_EXPIRES = int(os.environ.get('DIRECT_UPLOAD_URL_EXPIRES', 3600)) # Seconds
+    DIRECT_UPLOAD_MAX_SIZE = int(os.environ.get('DIRECT_UPLOAD_MAX_SIZE', 5 * 1024 ** 3)) # Presigned POST limit (5 GiB)
+
+    # Storage cleanup (see storage_cleanup.py): prunes versions per the
+    # retention policy, then deletes stored objects no row references any
+    # more. Runs via `flask storage-cleanup`, or every
+    # STORAGE_CLEANUP_INTERVAL seconds in the background (0 = never).
+    STORAGE_CLEANUP_INTERVAL = int(os.environ.get('STORAGE_CLEANUP_INTERVAL', 0))
+    STORAGE_CLEANUP_DRY_RUN = os.environ.get('STORAGE_CLEANUP_DRY_RUN', 'false').lower() == 'true' # Background runs only report
+    # Unreferenced objects younger than this are left alone: their upload may
+    # still be committing (keep it above DIRECT_UPLOAD_URL_EXPIRES)
+    ORPHAN_GRACE_PERIOD = int(os.environ.get('ORPHAN_GRACE_PERIOD', 24 * 3600)) # Seconds
+    STORAGE_CLEANUP_DELETES_PER_SECOND = float(os.environ.get('STORAGE_CLEANUP_DELETES_PER_SECOND', 200)) # Objects and versions; 0 = unthrottled
+    STORAGE_CLEANUP_LIST_PAUSE = float(os.environ.get('STORAGE_CLEANUP_LIST_PAUSE', 0.1)) # Seconds between listing pages
+    RETENTION_KEEP_LAST = int(os.environ.get('RETENTION_KEEP_LAST', 0)) # Newest versions kept per project; 0 = keep all
+    RETENTION_KEEP_ATTESTED = os.environ.get('RETENTION_KEEP_ATTESTED', 'true').lower() == 'true' # Never prune attested versions
+
+    # Presigned download URLs
+    # URLs are cached per (version, disposition) and re-signed once they have
+    # less than DOWNLOAD_URL_REFRESH_MARGIN seconds left to live.
+    DOWNLOAD_URL_EXPIRES = int(os.environ.get('DOWNLOAD_URL_EXPIRES', 900)) # Seconds
+    DOWNLOAD_URL_REFRESH_MARGIN = int(os.environ.get('DOWNLOAD_URL_REFRESH_MARGIN', 120)) # Seconds
+    DOWNLOAD_URL_CACHE_SIZE = int(os.environ.get('DOWNLOAD_URL_CACHE_SIZE', 10000)) # Entries
+
+    # Rows per page on the dashboard and version history (keyset paginated)
+    PAGE_SIZE = int(os.environ.get('PAGE_SIZE', 50))
+
+    # Live version activity on project pages over Server-Sent Events (see activity_feed.py):
+    # 'postgres' - commits NOTIFY, and one LISTEN connection per app process fans
+    #              the events out to every open stream (works across processes)
+    # 'memory'   - events only reach streams in the committing process (tests)
+    # 'off'      - no activity streams (default)
+    # Each open stream holds one of the server's request threads for up to
+    # ACTIVITY_STREAM_MAX_AGE seconds, so only turn it on with an async worker
+    # class (gevent, eventlet) or with SERVER_THREADS set to the real count.
+    ACTIVITY_FEED = os.environ.get('ACTIVITY_FEED', 'off')
+    # Request threads per app process (gunicorn --threads; with gevent, --worker-connections)
+    SERVER_THREADS = int(os.environ.get('SERVER_THREADS', 8))
+    # Open streams per process before new ones get a 503 (the page then works
+    # without live updates). Default: a quarter of SERVER_THREADS, so streams
+    # can never take every thread.
+    ACTIVITY_MAX_SUBSCRIBERS = int(os.environ.get('ACTIVITY_MAX_SUBSCRIBERS', max(SERVER_THREADS // 4, 1)))
+    ACTIVITY_SUBSCRIBER_QUEUE_MAX = int(os.environ.get('ACTIVITY_SUBSCRIBER_QUEUE_MAX', 100)) # Unsent events before a slow stream is dropped
+    ACTIVITY_HEARTBEAT_INTERVAL = float(os.environ.get('ACTIVITY_HEARTBEAT_INTERVAL', 15)) # Seconds between keepalive comments
+    ACTIVITY_STREAM_MAX_AGE = int(os.environ.get('ACTIVITY_STREAM_MAX_AGE', 300)) # Seconds before a stream ends and the browser reconnects
+    ACTIVITY_RETRY_MS = int(os.environ.get('ACTIVITY_RETRY_MS', 3000)) # Browser's reconnect delay
+    ACTIVITY_CATCH_UP_MAX = int(os.environ.get('ACTIVITY_CATCH_UP_MAX', 100)) # Missed versions replayed on reconnect
+
+    # Version metadata exports (see metadata_export.py): rows fetched per
+    # round trip from the server-side cursor, and per Parquet row group
+    EXPORT_BATCH_SIZE = int(os.environ.get('EXPORT_BATCH_SIZE', 10000))
+
+    # Optional directory for Jinja's compiled-template cache (shared across restarts)
+    TEMPLATE_BYTECODE_CACHE_DIR = os.environ.get('TEMPLATE_BYTECODE_CACHE_DIR')
+
+    # Password hashing (see password_hashing.py)
+    BCRYPT_LOG_ROUNDS = int(os.environ.get('BCRYPT_LOG_ROUNDS', 12)) # bcrypt work factor; stored hashes are upgraded on login when it changes
+    PASSWORD_HASH_WORKERS = int(os.environ.get('PASSWORD_HASH_WORKERS', max((os.cpu_count() or 2) // 2, 1))) # Hashing processes; 0 = hash on the request thread
+    PASSWORD_HASH_QUEUE_MAX = int(os.environ.get('PASSWORD_HASH_QUEUE_MAX', 32)) # Queued + running hashes before logins get a 503
+    PASSWORD_HASH_TIMEOUT = float(os.environ.get('PASSWORD_HASH_TIMEOUT', 10)) # Seconds a request waits for its hash
+
+    # Request timing and logs (see instrumentation.py)
+    LOG_FORMAT = os.environ.get('LOG_FORMAT', 'json') # 'json' (one object per line) or 'text'
+    LOG_LEVEL = os.environ.get('LOG_LEVEL', 'INFO')
+    LOG_REQUESTS = os.environ.get('LOG_REQUESTS', 'true').lower() == 'true' # One line per request with its phase timings
+    # Server-Timing header with db/storage/hash durations on every response
+    # (shown in the browser's network tab; turn off to hide timings from clients)
+    SERVER_TIMING = os.environ.get('SERVER_TIMING', 'true').lower() == 'true'
+    METRICS_TOKEN = os.environ.get('METRICS_TOKEN') # If set, /metrics requires "Authorization: Bearer <token>"
 
     # CRITICAL: Fix for session persistence on redirect in development environments
     SESSION_COOKIE_SAMESITE = 'Lax'
\ No newline at end of file
@@ -1,5 +1,7 @@
 from flask_sqlalchemy import SQLAlchemy
+from db_routing import RoutingSession
 
 # Initialize the SQLAlchemy object *without* the app yet.
 # It will be initialized with the app in app.py.
-db = SQLAlchemy()
\ No newline at end of file
+# RoutingSession lets read-only views use the optional read replica.
+db = SQLAlchemy(session_options={'class_': RoutingSession})
@@ -0,0 +1,67 @@
+import time
+from functools import wraps
+from flask import g, has_request_context, session
+from flask_sqlalchemy.session import Session
+from sqlalchemy import event
+
+# Bind key of the optional read replica in SQLALCHEMY_BINDS
+REPLICA_BIND = 'replica'
+
+
+class RoutingSession(Session):
+    """
+    Session that sends a request's queries to the read replica when the view
+    is marked @replica_reads. Flushes (ORM writes) always go to the primary,
+    as does everything outside a request (CLI commands, background workers)
+    and everything when no replica is configured.
+
+    A @replica_reads view must not run explicit INSERT/UPDATE statements: only
+    flushes are recognized as writes.
+    """
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if bind is None and not self._flushing and has_request_context() and g.get('use_replica'):
+            replica = self._db.engines.get(REPLICA_BIND)
+            if replica is not None:
+                return replica
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+
+@event.listens_for(RoutingSession, 'after_flush')
+def _remember_write(db_session, flush_context):
+    if has_request_context():
+        g.db_wrote = True
+
+
+def replica_reads(f):
+    """
+    Route decorator for views that only read. Their queries go to the replica,
+    unless this user wrote something recently (read-your-writes: see
+    REPLICA_READ_YOUR_WRITES_SECONDS), in which case the primary is used so
+    they see their own upload even if the replica lags behind.
+    """
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        if time.time() >= session.get('primary_reads_until', 0):
+            g.use_replica = True
+        return f(*args, **kwargs)
+    return decorated_function
+
+
+def init_replica_routing(app):
+    """Pins a user's reads to the primary for a while after any request of theirs wrote to it."""
+    if REPLICA_BIND not in app.config['SQLALCHEMY_BINDS']:
+        return
+
+    @app.before_request
+    def reset_replica_routing():
+        # g outlives the request when an app context was already pushed
+        # (shell sessions, tests), so never inherit the previous request's flags
+        g.use_replica = False
+        g.db_wrote = False
+
+    @app.after_request
+    def stick_to_primary_after_writes(response):
+        if g.get('db_wrote'):
+            session['primary_reads_until'] = time.time() + app.config['REPLICA_READ_YOUR_WRITES_SECONDS']
+        return response
@@ -0,0 +1,315 @@
+import json
+import logging
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from functools import wraps
+from flask import g, has_request_context, request, session
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+# Phases a request's time is split into (Server-Timing names and metric labels)
+PHASE_DB = 'db'             # SQL statements, primary and replica
+PHASE_STORAGE = 'storage'   # S3 / local storage calls
+PHASE_HASH = 'hash'         # bcrypt and content hashing
+PHASE_RENDER = 'render'     # Template rendering
+
+# Histogram buckets in seconds (the Prometheus client defaults)
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+logger = logging.getLogger(__name__)
+
+
+# --- Phase timing ---
+
+def _add_phase_time(phase, seconds):
+    timings = g.get('phase_timings')
+    if timings is None:
+        return
+    total, count = timings.get(phase, (0.0, 0))
+    timings[phase] = (total + seconds, count + 1)
+
+
+@contextmanager
+def timed(phase):
+    """
+    Adds the time spent in the block to the current request's `phase`.
+
+    Outside a request (CLI, background workers) it does nothing. Nested
+    blocks of the same phase are only counted once, so a storage call made
+    by another storage call is not counted twice.
+    """
+    if not has_request_context() or 'phase_timings' not in g:
+        yield
+        return
+    if phase in g.active_phases:
+        yield
+        return
+
+    g.active_phases.add(phase)
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        g.active_phases.discard(phase)
+        _add_phase_time(phase, time.perf_counter() - started)
+
+
+def timed_call(phase):
+    """Decorator form of timed()."""
+    def decorator(f):
+        @wraps(f)
+        def decorated_function(*args, **kwargs):
+            with timed(phase):
+                return f(*args, **kwargs)
+        return decorated_function
+    return decorator
+
+
+# The start time lives on the statement's execution context, which is
+# discarded with the statement, so a failed one leaves nothing behind on
+# the (pooled, long-lived) connection
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if context is not None:
+        context.query_started = time.perf_counter()
+
+
+def _record_query_time(context):
+    started = getattr(context, 'query_started', None)
+    if started is not None and has_request_context():
+        _add_phase_time(PHASE_DB, time.perf_counter() - started)
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    _record_query_time(context)
+
+
+def _handle_error(exception_context):
+    # A failed statement took database time too
+    _record_query_time(exception_context.execution_context)
+
+
+def _incoming_request_id():
+    """A request id set by the proxy in front of the app, if it looks like one."""
+    request_id = request.headers.get('X-Request-ID', '')
+    if 0 < len(request_id) <= 64 and all(c.isalnum() or c in '-_.' for c in request_id):
+        return request_id
+    return None
+
+
+def _route_label():
+    """The matched URL rule, not the raw path, so label values stay bounded."""
+    return request.url_rule.rule if request.url_rule is not None else 'unmatched'
+
+
+# --- Prometheus metrics ---
+
+def _escape_label_value(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(pairs):
+    return ','.join(f'{name}="{_escape_label_value(value)}"' for name, value in pairs)
+
+
+class Histogram:
+    """A labelled histogram rendered in the Prometheus text format."""
+
+    def __init__(self, name, help_text, label_names, buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = tuple(label_names)
+        self.buckets = tuple(sorted(buckets))
+        self._series = {} # label values -> [bucket counts..., sum, count]
+        self._lock = threading.Lock()
+
+    def observe(self, label_values, seconds):
+        with self._lock:
+            series = self._series.get(label_values)
+            if series is None:
+                series = self._series[label_values] = [0] * len(self.buckets) + [0.0, 0]
+            for i, upper in enumerate(self.buckets):
+                if seconds <= upper:
+                    series[i] += 1
+            series[-2] += seconds
+            series[-1] += 1
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            series = sorted(self._series.items())
+            series = [(label_values, list(values)) for label_values, values in series]
+        for label_values, values in series:
+            pairs = list(zip(self.label_names, label_values))
+            for upper, count in zip(self.buckets, values):
+                lines.append(f"{self.name}_bucket{{{_format_labels(pairs + [('le', repr(upper))])}}} {count}")
+            lines.append(f"{self.name}_bucket{{{_format_labels(pairs + [('le', '+Inf')])}}} {values[-1]}")
+            lines.append(f"{self.name}_sum{{{_format_labels(pairs)}}} {values[-2]}")
+            lines.append(f"{self.name}_count{{{_format_labels(pairs)}}} {values[-1]}")
+        return '\n'.join(lines)
+
+
+class RequestMetrics:
+    """
+    Per-route request and phase duration histograms for /metrics.
+
+    Counts live in this process only: with several worker processes, each
+    one reports its own (scrape them individually or run one worker per
+    container).
+    """
+
+    def __init__(self):
+        self.requests = Histogram(
+            'collabtrack_request_duration_seconds',
+            'Time from request start until the response headers are ready.',
+            ('route', 'method', 'status')
+        )
+        self.phases = Histogram(
+            'collabtrack_request_phase_seconds',
+            'Time a request spent in each phase (db, storage, hash, render).',
+            ('route', 'phase')
+        )
+
+    def render(self):
+        return self.requests.render() + '\n' + self.phases.render() + '\n'
+
+
+def phase_recorder(phase):
+    """
+    Returns a function that records seconds spent in `phase` for the current
+    request's route, usable after the request has ended. Streamed pages
+    render after their headers are sent, so their render time goes to
+    /metrics only, not to Server-Timing.
+    """
+    metrics = g.get('request_metrics')
+    route = g.get('request_route')
+    if metrics is None:
+        return lambda seconds: None
+    return lambda seconds: metrics.phases.observe((route, phase), seconds)
+
+
+# --- Structured logging ---
+
+# Attributes every LogRecord has; anything else was passed with extra={...}
+_STANDARD_RECORD_ATTRS = set(vars(logging.LogRecord('', 0, '', 0, '', (), None))) | {'message', 'asctime'}
+
+
+class RequestContextFilter(logging.Filter):
+    """Tags records logged during a request with its id, method, path and user."""
+
+    def filter(self, record):
+        if has_request_context():
+            record.request_id = g.get('request_id')
+            record.method = request.method
+            record.path = request.path
+            record.user_id = session.get('user_id')
+        return True
+
+
+class StructuredFormatter(logging.Formatter):
+    """
+    Formats records as one JSON object per line ('json'), or as a readable
+    line followed by key=value fields ('text').
+    """
+
+    def __init__(self, style='json'):
+        super().__init__()
+        self.output_style = style
+
+    def format(self, record):
+        fields = {
+            key: value for key, value in vars(record).items()
+            if key not in _STANDARD_RECORD_ATTRS and value is not None
+        }
+        if record.exc_info:
+            fields['exc'] = self.formatException(record.exc_info)
+        timestamp = datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec='milliseconds')
+
+        if self.output_style == 'json':
+            return json.dumps({
+                'ts': timestamp,
+                'level': record.levelname,
+                'logger': record.name,
+                'message': record.getMessage(),
+                **fields,
+            }, default=str)
+
+        line = f"{timestamp} {record.levelname} {record.name}: {record.getMessage()}"
+        if fields:
+            line += ' ' + ' '.join(f"{key}={value}" for key, value in fields.items())
+        return line
+
+
+def configure_logging(app):
+    """Sends all log records through one structured handler on the root logger."""
+    root = logging.getLogger()
+    for handler in root.handlers:
+        if getattr(handler, 'collabtrack', False):
+            root.removeHandler(handler)
+
+    handler = logging.StreamHandler()
+    handler.collabtrack = True
+    handler.setFormatter(StructuredFormatter(app.config['LOG_FORMAT']))
+    handler.addFilter(RequestContextFilter())
+    root.addHandler(handler)
+    root.setLevel(app.config['LOG_LEVEL'])
+
+
+# --- Wiring ---
+
+def init_instrumentation(app):
+    """
+    Times every request and its phases, reports them in a Server-Timing
+    header and in app.extensions['request_metrics'] (served by /metrics),
+    and logs one structured line per request.
+    """
+    configure_logging(app)
+    metrics = app.extensions['request_metrics'] = RequestMetrics()
+
+    if not event.contains(Engine, 'before_cursor_execute', _before_cursor_execute):
+        event.listen(Engine, 'before_cursor_execute', _before_cursor_execute)
+        event.listen(Engine, 'after_cursor_execute', _after_cursor_execute)
+        event.listen(Engine, 'handle_error', _handle_error)
+
+    @app.before_request
+    def start_request_timing():
+        g.request_started = time.perf_counter()
+        g.request_id = _incoming_request_id() or uuid.uuid4().hex
+        g.request_route = _route_label()
+        g.request_metrics = metrics
+        g.phase_timings = {}
+        g.active_phases = set()
+
+    @app.after_request
+    def finish_request_timing(response):
+        started = g.pop('request_started', None)
+        if started is None:
+            return response
+        elapsed = time.perf_counter() - started
+        timings = g.pop('phase_timings')
+        route = g.request_route
+
+        metrics.requests.observe((route, request.method, str(response.status_code)), elapsed)
+        for phase, (seconds, _) in timings.items():
+            metrics.phases.observe((route, phase), seconds)
+
+        response.headers['X-Request-ID'] = g.request_id
+        if app.config['SERVER_TIMING']:
+            entries = [
+                f'{phase};dur={seconds * 1000:.2f};desc="count={count}"'
+                for phase, (seconds, count) in timings.items()
+            ]
+            entries.append(f'total;dur={elapsed * 1000:.2f}')
+            response.headers.add('Server-Timing', ', '.join(entries))
+
+        if app.config['LOG_REQUESTS']:
+            logger.info("request", extra={
+                'route': route,
+                'status': response.status_code,
+                'duration_ms': round(elapsed * 1000, 2),
+                'phases_ms': {phase: round(seconds * 1000, 2) for phase, (seconds, _) in timings.items()},
+            })
+        return response
@@ -0,0 +1,232 @@
+import hashlib
+import io
+import mimetypes
+import os
+import tempfile
+import threading
+import time
+from datetime import datetime, timezone
+from urllib.parse import quote
+from flask import Response, send_file, url_for
+from itsdangerous import BadSignature, URLSafeSerializer
+from storage import StorageBackend, read_full, LIST_PAGE_SIZE
+from instrumentation import timed_call, PHASE_STORAGE
+
+# Copy size for writes and the default read size for iter_object
+COPY_SIZE = 1024 * 1024
+
+
+class LocalStorage(StorageBackend):
+    """
+    Stores objects as files under LOCAL_STORAGE_ROOT, one file per storage key.
+
+    For on-prem deployments without S3, and as a fast, deterministic backend
+    for tests and benchmarks. Writes go to a temp file in the target
+    directory and are renamed into place, so readers never see a partial
+    object. Download URLs point back at the app (serve_local_object), signed
+    and expiring like S3 presigned URLs; the file itself is sent with
+    sendfile or handed to the front-end server (see send_local_object()).
+    """
+
+    def __init__(self, config):
+        self.root = os.path.abspath(config['LOCAL_STORAGE_ROOT'])
+        self.fsync = config['LOCAL_STORAGE_FSYNC']
+        self.part_concurrency = max(config['S3_MULTIPART_CONCURRENCY'], 1)
+        self._signer = URLSafeSerializer(config['SECRET_KEY'], salt='local-storage-download')
+        os.makedirs(self.root, exist_ok=True)
+
+        self._lock = threading.Lock()
+        self._counts = {'writes': 0, 'reads': 0, 'deletes': 0, 'bytes_written': 0}
+
+    def path_for(self, storage_key):
+        """Maps a storage key to its file, refusing keys that would escape the root."""
+        parts = storage_key.split('/')
+        if not storage_key or any(part in ('', '.', '..') for part in parts):
+            raise ValueError(f"Invalid storage key: {storage_key!r}")
+        return os.path.join(self.root, *parts)
+
+    def _count(self, name, amount=1):
+        with self._lock:
+            self._counts[name] += amount
+
+    def _write(self, storage_key, reader, before_complete=None):
+        """Copies reader into a temp file and renames it to the key's path."""
+        path = self.path_for(storage_key)
+        directory = os.path.dirname(path)
+        os.makedirs(directory, exist_ok=True)
+
+        fd, temp_path = tempfile.mkstemp(dir=directory, prefix='.upload-')
+        try:
+            total_bytes = 0
+            with os.fdopen(fd, 'wb') as temp_file:
+                while True:
+                    data = read_full(reader, COPY_SIZE)
+                    if not data:
+                        break
+                    temp_file.write(data)
+                    total_bytes += len(data)
+                if self.fsync:
+                    temp_file.flush()
+                    os.fsync(temp_file.fileno())
+
+            if before_complete is not None and before_complete() is False:
+                os.remove(temp_path)
+                return None
+
+            os.replace(temp_path, path)
+        except BaseException:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
+
+        self._count('writes')
+        self._count('bytes_written', total_bytes)
+        return total_bytes
+
+    @timed_call(PHASE_STORAGE)
+    def upload_fileobj(self, file_obj, storage_key):
+        file_obj.seek(0)
+        self._write(storage_key, file_obj)
+
+    @timed_call(PHASE_STORAGE)
+    def upload_stream(self, reader, storage_key, before_complete=None):
+        return self._write(storage_key, reader, before_complete)
+
+    @timed_call(PHASE_STORAGE)
+    def put_bytes(self, storage_key, data):
+        self._write(storage_key, io.BytesIO(data))
+
+    @timed_call(PHASE_STORAGE)
+    def get_bytes(self, storage_key):
+        self._count('reads')
+        with open(self.path_for(storage_key), 'rb') as f:
+            return f.read()
+
+    def iter_object(self, storage_key, chunk_size=COPY_SIZE):
+        self._count('reads')
+        with open(self.path_for(storage_key), 'rb') as f:
+            while True:
+                piece = f.read(chunk_size)
+                if not piece:
+                    return
+                yield piece
+
+    @timed_call(PHASE_STORAGE)
+    def delete_object(self, storage_key):
+        try:
+            os.remove(self.path_for(storage_key))
+            self._count('deletes')
+        except FileNotFoundError:
+            pass
+
+    @timed_call(PHASE_STORAGE)
+    def delete_objects(self, storage_keys):
+        failed = []
+        for storage_key in storage_keys:
+            try:
+                self.delete_object(storage_key)
+            except OSError:
+                failed.append(storage_key)
+        return failed
+
+    def iter_object_pages(self, prefix):
+        # A sorted walk, so repeated runs list the objects in the same order
+        page = []
+        top = os.path.join(self.root, *[part for part in prefix.split('/') if part])
+        for directory, subdirectories, file_names in os.walk(top):
+            subdirectories.sort()
+            for file_name in sorted(file_names):
+                path = os.path.join(directory, file_name)
+                storage_key = os.path.relpath(path, self.root).replace(os.sep, '/')
+                if not storage_key.startswith(prefix):
+                    continue
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError: # Renamed or deleted while listing
+                    continue
+                page.append({
+                    'key': storage_key,
+                    'size': stat.st_size,
+                    'last_modified': datetime.fromtimestamp(stat.st_mtime, timezone.utc),
+                })
+                if len(page) >= LIST_PAGE_SIZE:
+                    yield page
+                    page = []
+        if page:
+            yield page
+
+    @timed_call(PHASE_STORAGE)
+    def head_object(self, storage_key):
+        try:
+            stat = os.stat(self.path_for(storage_key))
+        except FileNotFoundError:
+            return None
+        # Not a content hash (unlike S3's): only used to spot a replaced file
+        etag = hashlib.md5(f"{stat.st_size}-{stat.st_mtime_ns}".encode()).hexdigest()
+        return {'size': stat.st_size, 'etag': etag}
+
+    @timed_call(PHASE_STORAGE)
+    def generate_download_url(self, storage_key, file_name, expires_in=300, disposition='attachment'):
+        token = self._signer.dumps({
+            'k': storage_key,
+            'f': file_name,
+            'd': disposition,
+            'e': int(time.time() + expires_in),
+        })
+        return url_for('serve_local_object', token=token)
+
+    def read_download_token(self, token):
+        """
+        Checks a token from generate_download_url().
+
+        Returns:
+            tuple or None: (storage_key, file_name, disposition), or None if
+            the token is forged or has expired.
+        """
+        try:
+            payload = self._signer.loads(token)
+        except BadSignature:
+            return None
+        if payload.get('e', 0) < time.time():
+            return None
+        return payload['k'], payload['f'], payload['d']
+
+    def pool_stats(self):
+        with self._lock:
+            return {'backend': 'local', 'root': self.root, **self._counts}
+
+
+def send_local_object(storage, token, accel_redirect_prefix=None):
+    """
+    Answers a signed local download URL.
+
+    With accel_redirect_prefix set (e.g. '/protected-files/'), the response
+    is only an X-Accel-Redirect header: nginx then sends the file itself from
+    an internal location mapped to LOCAL_STORAGE_ROOT, with sendfile and
+    Range support, and no app worker is tied up. Otherwise send_file() serves
+    it: conditional=True answers Range requests with 206, and the body goes
+    through wsgi.file_wrapper (sendfile on servers like gunicorn), or as an
+    X-Sendfile header when Flask's USE_X_SENDFILE is on.
+    """
+    target = storage.read_download_token(token)
+    if target is None:
+        return "Download link is invalid or has expired.", 403
+    storage_key, file_name, disposition = target
+
+    path = storage.path_for(storage_key)
+    if not os.path.isfile(path):
+        return "File not found.", 404
+
+    if accel_redirect_prefix:
+        response = Response(mimetype=mimetypes.guess_type(file_name)[0] or 'application/octet-stream')
+        response.headers['X-Accel-Redirect'] = accel_redirect_prefix.rstrip('/') + '/' + quote(storage_key)
+        response.headers['Content-Disposition'] = f'{disposition}; filename="{file_name}"'
+        return response
+
+    return send_file(
+        path,
+        as_attachment=(disposition == 'attachment'),
+        download_name=file_name,
+        conditional=True,
+        max_age=0
+    )
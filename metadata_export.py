@@ -0,0 +1,254 @@
+import csv
+import io
+import json
+from datetime import datetime
+from database import db
+from models import Project, ProjectMember, Version
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError: # Only needed for format='parquet'
+    pa = pq = None
+
+EXPORT_FORMATS = ('ndjson', 'csv', 'parquet')
+
+EXPORT_MIMETYPES = {
+    'ndjson': 'application/x-ndjson',
+    'csv': 'text/csv',
+    'parquet': 'application/vnd.apache.parquet',
+}
+
+# Exported columns, in order, with their Parquet types
+EXPORT_COLUMNS = (
+    ('version_id', 'int64'),
+    ('project_id', 'int64'),
+    ('project_name', 'string'),
+    ('owner_id', 'int64'),
+    ('uploader_id', 'int64'),
+    ('version_number', 'int64'),
+    ('file_name', 'string'),
+    ('version_note', 'string'),
+    ('storage_kind', 'string'),
+    ('size_bytes', 'int64'),
+    ('attestation_status', 'bool'),
+    ('uploaded_at', 'timestamp'),
+    ('project_created_at', 'timestamp'),
+)
+
+
+class ExportFilters:
+    """
+    Which versions an export includes. Every field is optional.
+
+    Attributes:
+        owner_id (int): Only projects owned by this user.
+        project_id (int): Only this project.
+        since (datetime): Only versions uploaded at or after this time (UTC).
+        until (datetime): Only versions uploaded before this time (UTC).
+        attested (bool): Only attested (True) or unattested (False) versions.
+        member_id (int): Only projects this user is a member of (set by the
+            endpoint, so users can export just what they can see).
+    """
+
+    def __init__(self, owner_id=None, project_id=None, since=None, until=None, attested=None, member_id=None):
+        self.owner_id = owner_id
+        self.project_id = project_id
+        self.since = since
+        self.until = until
+        self.attested = attested
+        self.member_id = member_id
+
+    @classmethod
+    def from_args(cls, args, member_id=None):
+        """
+        Reads owner_id, project_id, since, until (ISO 8601 dates or times) and
+        attested (true/false) from a request's query string.
+
+        Raises:
+            ValueError: If a value can't be parsed.
+        """
+        def optional(name, parse):
+            value = args.get(name)
+            return parse(value) if value not in (None, '') else None
+
+        return cls(
+            owner_id=optional('owner_id', int),
+            project_id=optional('project_id', int),
+            since=optional('since', datetime.fromisoformat),
+            until=optional('until', datetime.fromisoformat),
+            attested=optional('attested', parse_bool),
+            member_id=member_id
+        )
+
+
+def parse_bool(value):
+    if value.lower() in ('1', 'true', 'yes'):
+        return True
+    if value.lower() in ('0', 'false', 'no'):
+        return False
+    raise ValueError(f"Not a boolean: {value!r}")
+
+
+def build_export_query(filters):
+    """The SELECT behind an export, in version_id order (walks the primary key, no sort)."""
+    query = (
+        db.select(
+            Version.version_id,
+            Version.project_id,
+            Project.name.label('project_name'),
+            Project.owner_id,
+            Version.uploader_id,
+            Version.version_number,
+            Version.file_name,
+            Version.version_note,
+            Version.storage_kind,
+            Version.size_bytes,
+            Version.attestation_status,
+            Version.uploaded_at,
+            Project.created_at.label('project_created_at'),
+        )
+        .join(Project, Project.project_id == Version.project_id)
+        .order_by(Version.version_id)
+    )
+    if filters.owner_id is not None:
+        query = query.filter(Project.owner_id == filters.owner_id)
+    if filters.project_id is not None:
+        query = query.filter(Version.project_id == filters.project_id)
+    if filters.since is not None:
+        query = query.filter(Version.uploaded_at >= filters.since)
+    if filters.until is not None:
+        query = query.filter(Version.uploaded_at < filters.until)
+    if filters.attested is True:
+        query = query.filter(Version.attestation_status.is_(True))
+    elif filters.attested is False:
+        query = query.filter(Version.attestation_status.isnot(True))
+    if filters.member_id is not None:
+        query = query.filter(Version.project_id.in_(
+            db.select(ProjectMember.project_id).filter(ProjectMember.user_id == filters.member_id)
+        ))
+    return query
+
+
+def _iter_partitions(engine, query, batch_size):
+    """
+    Runs query on its own connection with a server-side cursor and yields
+    the rows batch_size at a time. Only one batch is in memory at once, and
+    the first one arrives without waiting for the query to finish.
+    """
+    with engine.connect() as connection:
+        result = connection.execution_options(yield_per=batch_size).execute(query)
+        for partition in result.partitions():
+            yield partition
+
+
+def _json_value(value):
+    return value.isoformat() if isinstance(value, datetime) else value
+
+
+def _iter_ndjson(partitions):
+    names = [name for name, _ in EXPORT_COLUMNS]
+    for rows in partitions:
+        yield ''.join(
+            json.dumps(dict(zip(names, map(_json_value, row))), ensure_ascii=False) + '\n'
+            for row in rows
+        ).encode('utf-8')
+
+
+def _iter_csv(partitions):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow([name for name, _ in EXPORT_COLUMNS])
+    for rows in partitions:
+        writer.writerows(
+            [_json_value(value) if value is not None else '' for value in row]
+            for row in rows
+        )
+        yield buffer.getvalue().encode('utf-8')
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue().encode('utf-8')
+
+
+class _ParquetSink:
+    """
+    Write-only file object for ParquetWriter that collects what it writes,
+    so each row group can be sent as soon as it is complete. Parquet only
+    appends (the footer goes last), so no seeking is needed.
+    """
+
+    closed = False
+
+    def __init__(self):
+        self._pieces = []
+        self._position = 0
+
+    def write(self, data):
+        data = bytes(data)
+        self._pieces.append(data)
+        self._position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self._position
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    def drain(self):
+        data = b''.join(self._pieces)
+        self._pieces.clear()
+        return data
+
+
+def _parquet_schema():
+    types = {'int64': pa.int64(), 'string': pa.string(), 'bool': pa.bool_(), 'timestamp': pa.timestamp('us')}
+    return pa.schema([(name, types[kind]) for name, kind in EXPORT_COLUMNS])
+
+
+def _iter_parquet(partitions):
+    """One Parquet row group per batch of rows."""
+    schema = _parquet_schema()
+    sink = _ParquetSink()
+    writer = pq.ParquetWriter(sink, schema, compression='zstd')
+    try:
+        for rows in partitions:
+            columns = list(zip(*rows))
+            writer.write_table(pa.Table.from_arrays(
+                [pa.array(values, type=field.type) for values, field in zip(columns, schema)],
+                schema=schema
+            ))
+            yield sink.drain()
+    finally:
+        writer.close()
+    yield sink.drain()
+
+
+def iter_export(engine, filters, export_format, batch_size):
+    """
+    Yields the versions matching filters as NDJSON, CSV or Parquet.
+
+    Reads from its own connection (not the request's session), so the
+    generator can be handed to a streamed response and keeps working after
+    the request's app context has ended.
+
+    Args:
+        engine: The engine to read from (the replica, when there is one).
+        filters (ExportFilters): Which versions to include.
+        export_format (str): One of EXPORT_FORMATS.
+        batch_size (int): Rows fetched from the server-side cursor at a time.
+
+    Raises:
+        ValueError: For an unknown format, or 'parquet' without pyarrow.
+    """
+    if export_format not in EXPORT_FORMATS:
+        raise ValueError(f"Unknown export format {export_format!r}; use one of {', '.join(EXPORT_FORMATS)}.")
+    if export_format == 'parquet' and pa is None:
+        raise ValueError("Parquet export needs pyarrow (pip install pyarrow).")
+
+    writers = {'ndjson': _iter_ndjson, 'csv': _iter_csv, 'parquet': _iter_parquet}
+    return writers[export_format](_iter_partitions(engine, build_export_query(filters), batch_size))
@@ -1,5 +1,6 @@
 from database import db
 from datetime import datetime
+from sqlalchemy.dialects.postgresql import TSVECTOR
 
 class User(db.Model):
     """
@@ -30,6 +31,12 @@ class Project(db.Model):
     # Foreign Key linking to User
     owner_id = db.Column(db.Integer, db.ForeignKey('users.user_id'), nullable=False)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    # Highest version number handed out so far (see versioning.allocate_version_numbers).
+    # Databases upgraded with existing versions: run `flask backfill-version-counters`
+    last_version_number = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    # When the version history last changed (UTC); bumped together with the
+    # counter, and part of the API's ETags
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow)
     
     # Define the relationship to Versions
     versions = db.relationship('Version', backref='project', lazy=True)
@@ -38,11 +45,49 @@ class Project(db.Model):
         return f"Project('{self.name}', Owner: {self.owner_id})"
 
 
+class ProjectMember(db.Model):
+    """
+    Maps to the 'project_members' table. Grants a user a role on a project:
+    'owner', 'editor' (can upload) or 'viewer' (can browse and download).
+    The project's creator is always stored here as 'owner'.
+    """
+    __tablename__ = 'project_members'
+    __table_args__ = (
+        # Dashboard: every project a user belongs to, in project_id order
+        db.Index('ix_project_members_user_id_project_id', 'user_id', 'project_id'),
+    )
+    
+    # The primary key (project_id, user_id) makes a permission check one index lookup
+    project_id = db.Column(db.Integer, db.ForeignKey('projects.project_id'), primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('users.user_id'), primary_key=True)
+    role = db.Column(db.String(16), nullable=False)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    user = db.relationship('User', lazy=True)
+
+    def __repr__(self):
+        return f"ProjectMember(Project: {self.project_id}, User: {self.user_id}, '{self.role}')"
+
+
 class Version(db.Model):
     """
     Maps to the 'versions' table. Stores metadata about the uploaded files/versions.
     """
     __tablename__ = 'versions'
+    __table_args__ = (
+        # Backstop for the per-project counter: a number can never be reused
+        db.UniqueConstraint('project_id', 'version_number', name='uq_versions_project_version_number'),
+        # Version history: newest first within a project (keyset pagination)
+        db.Index('ix_versions_project_id_uploaded_at', 'project_id', 'uploaded_at', 'version_id'),
+        # Full-text search (see search.py), plus a smaller index holding only
+        # attested versions for searches filtered on human-creation status
+        db.Index('ix_versions_search_vector', 'search_vector', postgresql_using='gin'),
+        db.Index(
+            'ix_versions_search_vector_attested', 'search_vector',
+            postgresql_using='gin',
+            postgresql_where=db.text('attestation_status')
+        ),
+    )
     
     version_id = db.Column(db.Integer, primary_key=True)
     
@@ -51,14 +96,147 @@ class Version(db.Model):
     uploader_id = db.Column(db.Integer, db.ForeignKey('users.user_id'), nullable=False)
     
     version_number = db.Column(db.Integer, nullable=False)
-    storage_key = db.Column(db.String(512), unique=True, nullable=False) # The path in S3
+    # The path in S3. Not unique: in content-addressed mode versions with
+    # identical content share one Blob's storage key.
+    storage_key = db.Column(db.String(512), nullable=False, index=True)
     file_name = db.Column(db.String(255), nullable=False)
     version_note = db.Column(db.Text)
+    # 'object' = storage_key holds the whole file; 'chunked' = the file is
+    # reassembled from the chunks listed in VersionChunk (storage_key is the manifest)
+    storage_kind = db.Column(db.String(16), nullable=False, default='object', server_default='object')
     attestation_status = db.Column(db.Boolean, default=False)
     uploaded_at = db.Column(db.DateTime, default=datetime.utcnow)
+    # Size of the file as uploaded; None for versions recorded before sizes
+    # were (see `flask rebuild-project-summaries --sizes`)
+    size_bytes = db.Column(db.BigInteger)
+    # Searchable words of the file name and note, kept up to date by Postgres.
+    # '_', '-' and '.' are treated as spaces so "drums_take3.wav" matches "drums".
+    search_vector = db.deferred(db.Column(
+        TSVECTOR,
+        db.Computed(
+            "to_tsvector('english', translate(coalesce(file_name, ''), '._-', '   ') || ' ' || coalesce(version_note, ''))",
+            persisted=True
+        )
+    ))
     
     # Relationship to the Uploader
     uploader = db.relationship('User', foreign_keys=[uploader_id], backref='uploaded_versions', lazy=True)
 
+    def to_dict(self):
+        return {
+            'version_id': self.version_id,
+            'project_id': self.project_id,
+            'version_number': self.version_number,
+            'file_name': self.file_name,
+            'version_note': self.version_note,
+            'attestation_status': bool(self.attestation_status),
+            'uploaded_at': self.uploaded_at.isoformat(),
+        }
+
     def __repr__(self):
-        return f"Version('{self.file_name}', v{self.version_number})"
\ No newline at end of file
+        return f"Version('{self.file_name}', v{self.version_number})"
+
+
+class ProjectSummary(db.Model):
+    """
+    Maps to the 'project_summaries' table. Per-project totals for the
+    dashboard, so it never aggregates over versions. Updated in the same
+    transaction as every Version insert and delete (see project_summary.py);
+    `flask rebuild-project-summaries` recomputes it from scratch.
+    """
+    __tablename__ = 'project_summaries'
+    
+    project_id = db.Column(db.Integer, db.ForeignKey('projects.project_id'), primary_key=True)
+    version_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    total_bytes = db.Column(db.BigInteger, nullable=False, default=0, server_default='0')
+    attested_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    # The version with the highest number (None while the project has none)
+    latest_version_id = db.Column(db.Integer)
+    latest_version_number = db.Column(db.Integer)
+    latest_file_name = db.Column(db.String(255))
+    last_uploaded_at = db.Column(db.DateTime)
+
+    def __repr__(self):
+        return f"ProjectSummary(Project: {self.project_id}, {self.version_count} versions)"
+
+
+class VersionWaveform(db.Model):
+    """
+    Maps to the 'version_waveforms' table. Precomputed waveform peaks of an
+    audio Version (see audio_ingest.py), plus its preview rendition if one
+    was made.
+    """
+    __tablename__ = 'version_waveforms'
+    
+    version_id = db.Column(db.Integer, db.ForeignKey('versions.version_id'), primary_key=True)
+    duration_ms = db.Column(db.Integer, nullable=False)
+    sample_rate = db.Column(db.Integer, nullable=False)
+    # Coarsest level only (a few hundred bytes): all the version history needs
+    overview = db.Column(db.LargeBinary, nullable=False)
+    # Every level, packed by waveform.pack_peaks(); only loaded when asked for
+    peaks = db.deferred(db.Column(db.LargeBinary, nullable=False))
+    preview_key = db.Column(db.String(512), index=True) # Low-bitrate MP3 in S3 (None without ffmpeg)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    def __repr__(self):
+        return f"VersionWaveform(Version: {self.version_id}, {self.duration_ms} ms)"
+
+
+class Blob(db.Model):
+    """
+    Maps to the 'blobs' table. One row per distinct file content stored in
+    content-addressed mode; every Version with that content points at
+    storage_key, and ref_count tracks how many do.
+    """
+    __tablename__ = 'blobs'
+    
+    sha256 = db.Column(db.String(64), primary_key=True) # Hex digest of the content
+    storage_key = db.Column(db.String(512), unique=True, nullable=False) # The path in S3
+    size_bytes = db.Column(db.BigInteger, nullable=False)
+    ref_count = db.Column(db.Integer, nullable=False, default=0)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    def __repr__(self):
+        return f"Blob('{self.sha256[:12]}', refs: {self.ref_count})"
+
+
+class Chunk(db.Model):
+    """
+    Maps to the 'chunks' table. One row per distinct content-defined chunk a
+    project has stored in chunked mode, so later versions only upload chunks
+    the project has never seen.
+    """
+    __tablename__ = 'chunks'
+    
+    project_id = db.Column(db.Integer, db.ForeignKey('projects.project_id'), primary_key=True)
+    sha256 = db.Column(db.String(64), primary_key=True) # Hex digest of the chunk
+    size_bytes = db.Column(db.Integer, nullable=False)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    @property
+    def storage_key(self):
+        return chunk_storage_key(self.project_id, self.sha256)
+
+    def __repr__(self):
+        return f"Chunk('{self.sha256[:12]}', Project: {self.project_id})"
+
+
+class VersionChunk(db.Model):
+    """
+    Maps to the 'version_chunks' table: the ordered chunk manifest of a
+    chunked Version. Concatenating the chunks by seq rebuilds the file.
+    """
+    __tablename__ = 'version_chunks'
+    
+    version_id = db.Column(db.Integer, db.ForeignKey('versions.version_id'), primary_key=True)
+    seq = db.Column(db.Integer, primary_key=True) # Position of the chunk in the file
+    chunk_sha256 = db.Column(db.String(64), nullable=False, index=True) # Chunk GC looks chunks up by hash
+    size_bytes = db.Column(db.Integer, nullable=False)
+
+    def __repr__(self):
+        return f"VersionChunk(Version: {self.version_id}, #{self.seq})"
+
+
+def chunk_storage_key(project_id, sha256):
+    """S3 key of a stored chunk. Chunks are shared by every version in the project."""
+    return f"projects/{project_id}/chunks/{sha256}"
\ No newline at end of file
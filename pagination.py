@@ -0,0 +1,80 @@
+import base64
+import json
+from datetime import datetime
+
+# Cursors are opaque to clients: a URL-safe base64 JSON list of the sort key
+# values of the last row on the previous page. Datetimes are tagged so they
+# round-trip exactly.
+
+def encode_cursor(*values):
+    """Encodes the sort key of the last row shown into a page cursor."""
+    payload = [
+        {'dt': value.isoformat()} if isinstance(value, datetime) else value
+        for value in values
+    ]
+    raw = json.dumps(payload, separators=(',', ':')).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor, types):
+    """
+    Decodes a cursor made by encode_cursor().
+
+    Args:
+        cursor (str): The cursor from the query string.
+        types (tuple): The expected type of each sort key value, in order.
+
+    Returns:
+        list or None: The sort key values, or None if the cursor is missing or invalid.
+    """
+    if not cursor:
+        return None
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        payload = json.loads(raw)
+        values = [
+            datetime.fromisoformat(value['dt']) if isinstance(value, dict) else value
+            for value in payload
+        ]
+    except (ValueError, TypeError, KeyError):
+        return None
+    if len(values) != len(types):
+        return None
+    if not all(isinstance(value, kind) for value, kind in zip(values, types)):
+        return None
+    return values
+
+
+def split_page(rows, page_size):
+    """
+    Splits the page_size + 1 rows of a keyset query into the page itself and
+    whether another page follows.
+    """
+    return rows[:page_size], len(rows) > page_size
+
+
+class KeysetPage:
+    """
+    One page of a keyset query, for a streamed template to iterate.
+
+    Give it the already fetched rows of a query with LIMIT page_size + 1: a
+    streamed body is sent after the request's database session has been
+    closed, so it must not read from a live cursor.
+    """
+
+    def __init__(self, rows, page_size, cursor_key):
+        self.rows, self.has_more = split_page(rows, page_size)
+        self.cursor_key = cursor_key # row -> tuple of sort key values
+
+    def __bool__(self):
+        return bool(self.rows)
+
+    def __iter__(self):
+        return iter(self.rows)
+
+    @property
+    def next_cursor(self):
+        """Cursor for the next page, or None if this was the last one."""
+        if not self.has_more:
+            return None
+        return encode_cursor(*self.cursor_key(self.rows[-1]))
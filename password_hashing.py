@@ -0,0 +1,130 @@
+import multiprocessing
+import threading
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FutureTimeoutError
+import bcrypt
+from flask import current_app
+from instrumentation import timed_call, PHASE_HASH
+
+# bcrypt only looks at the first 72 bytes of a password. bcrypt < 5 cut
+# longer ones off silently (and existing hashes were made that way); 5.x
+# raises instead, so the cut is made here.
+BCRYPT_MAX_PASSWORD_BYTES = 72
+
+
+class HashingOverloaded(Exception):
+    """Raised when a hash or check can't be admitted (or finished) in time."""
+
+
+def _password_bytes(password):
+    return password.encode('utf-8')[:BCRYPT_MAX_PASSWORD_BYTES]
+
+
+def _hash_password(password, rounds):
+    """Runs in a pool process."""
+    return bcrypt.hashpw(password, bcrypt.gensalt(rounds)).decode('utf-8')
+
+
+def _check_password(password, password_hash):
+    """Runs in a pool process."""
+    try:
+        return bcrypt.checkpw(password, password_hash.encode('utf-8'))
+    except ValueError: # Not a bcrypt hash
+        return False
+
+
+def hash_rounds(password_hash):
+    """The work factor a bcrypt hash was made with ("$2b$12$..." -> 12), or None."""
+    parts = password_hash.split('$')
+    if len(parts) < 4 or not parts[2].isdigit():
+        return None
+    return int(parts[2])
+
+
+class PasswordHasher:
+    """
+    Hashes and checks passwords with bcrypt on a bounded process pool.
+
+    bcrypt is deliberately slow, CPU-bound work. Inline, a burst of logins
+    keeps every request thread (and core) busy hashing, and uploads and
+    downloads queue behind them. Here at most PASSWORD_HASH_WORKERS hashes
+    run at once, in separate processes. The request thread only waits on
+    the result, so the other cores stay free for the rest of the app. At
+    most PASSWORD_HASH_QUEUE_MAX hashes may be queued or running. Beyond
+    that a login or registration is turned away at once (503) instead of
+    waiting behind a queue it can't get through in time.
+
+    With PASSWORD_HASH_WORKERS = 0 hashing runs inline on the request
+    thread (still admission-controlled), e.g. for tests.
+    """
+
+    def __init__(self, app):
+        self.rounds = app.config['BCRYPT_LOG_ROUNDS']
+        self.workers = app.config['PASSWORD_HASH_WORKERS']
+        self.timeout = app.config['PASSWORD_HASH_TIMEOUT']
+        self._slots = threading.BoundedSemaphore(app.config['PASSWORD_HASH_QUEUE_MAX'])
+        self._executor = None
+        self._executor_lock = threading.Lock()
+
+    def _pool(self):
+        # Created on first use, in the process that serves requests (not in
+        # a pre-forking master). 'spawn' because forking a process that
+        # already runs threads (S3 transfers, upload workers) is unsafe; the
+        # pool processes re-import the main module, so scripts that call
+        # create_app() need an `if __name__ == '__main__':` guard.
+        with self._executor_lock:
+            if self._executor is None:
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.workers,
+                    mp_context=multiprocessing.get_context('spawn')
+                )
+            return self._executor
+
+    def _run(self, fn, *args):
+        if not self._slots.acquire(blocking=False):
+            raise HashingOverloaded("Too many password checks in progress.")
+
+        if self.workers <= 0:
+            try:
+                return fn(*args)
+            finally:
+                self._slots.release()
+
+        try:
+            future = self._pool().submit(fn, *args)
+        except Exception:
+            self._slots.release()
+            raise
+        # The slot is held until the pool is done, even if this request gave up waiting
+        future.add_done_callback(lambda _: self._slots.release())
+        try:
+            return future.result(timeout=self.timeout)
+        except FutureTimeoutError:
+            raise HashingOverloaded("Password check timed out.") from None
+
+    @timed_call(PHASE_HASH)
+    def hash(self, password):
+        """
+        Returns:
+            str: A bcrypt hash of password at the configured work factor.
+
+        Raises:
+            HashingOverloaded: If the pool is saturated.
+        """
+        return self._run(_hash_password, _password_bytes(password), self.rounds)
+
+    @timed_call(PHASE_HASH)
+    def verify(self, password, password_hash):
+        """
+        Raises:
+            HashingOverloaded: If the pool is saturated.
+        """
+        return self._run(_check_password, _password_bytes(password), password_hash)
+
+    def needs_rehash(self, password_hash):
+        """True if the hash was made with a different work factor than BCRYPT_LOG_ROUNDS."""
+        return hash_rounds(password_hash) != self.rounds
+
+
+def get_password_hasher():
+    """Returns the password hasher created by create_app()."""
+    return current_app.extensions['password_hasher']
@@ -0,0 +1,81 @@
+from flask import g
+from database import db
+from models import ProjectMember, Version
+
+# Roles in increasing order of privilege; each role can do everything the
+# roles before it can
+ROLES = ('viewer', 'editor', 'owner')
+ROLE_RANKS = {role: rank for rank, role in enumerate(ROLES, start=1)}
+
+
+def role_allows(role, required_role):
+    """True if `role` is at least as privileged as `required_role`."""
+    return role is not None and ROLE_RANKS.get(role, 0) >= ROLE_RANKS[required_role]
+
+
+def _role_cache():
+    """Per-request {(project_id, user_id): role} cache stored on flask.g."""
+    if 'project_roles' not in g:
+        g.project_roles = {}
+    return g.project_roles
+
+
+def get_project_role(project_id, user_id):
+    """
+    Returns the user's role on a project, or None if they are not a member.
+
+    One primary-key lookup on project_members; repeated checks in the same
+    request are served from a request-scoped cache.
+    """
+    try:
+        key = (int(project_id), user_id)
+    except (TypeError, ValueError):
+        return None
+
+    cache = _role_cache()
+    if key not in cache:
+        cache[key] = db.session.scalar(
+            db.select(ProjectMember.role).filter_by(project_id=key[0], user_id=user_id)
+        )
+    return cache[key]
+
+
+def can_access_project(project_id, user_id, required_role='viewer'):
+    return role_allows(get_project_role(project_id, user_id), required_role)
+
+
+def fetch_version_for_user(version_id, user_id):
+    """
+    Loads a Version and the user's role on its project in a single query.
+
+    Returns:
+        tuple: (Version, role) - role is None if the user is not a member;
+               (None, None) if the version does not exist.
+    """
+    row = db.session.execute(
+        db.select(Version, ProjectMember.role)
+          .outerjoin(
+              ProjectMember,
+              (ProjectMember.project_id == Version.project_id) & (ProjectMember.user_id == user_id)
+          )
+          .filter(Version.version_id == version_id)
+    ).first()
+
+    if row is None:
+        return None, None
+
+    version, role = row
+    _role_cache()[(version.project_id, user_id)] = role
+    return version, role
+
+
+def set_member_role(project_id, user_id, role):
+    """Adds a member or changes their role (added to the session, NOT committed)."""
+    member = db.session.get(ProjectMember, (project_id, user_id))
+    if member is None:
+        member = ProjectMember(project_id=project_id, user_id=user_id, role=role)
+        db.session.add(member)
+    else:
+        member.role = role
+    _role_cache()[(int(project_id), user_id)] = role
+    return member
@@ -0,0 +1,222 @@
+import logging
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from database import db
+from models import Project, ProjectSummary, Version
+
+logger = logging.getLogger(__name__)
+
+# Projects recomputed per transaction by rebuild_project_summaries()
+REBUILD_BATCH_SIZE = 500
+# Versions sized per storage round of backfill_version_sizes()
+SIZE_BACKFILL_BATCH_SIZE = 500
+
+
+def record_versions_added(project_id, versions):
+    """
+    Adds freshly flushed Versions to their project's summary (NOT committed).
+
+    One upsert per call however many versions there are, so a batch upload
+    costs the same single statement as one file. The caller's transaction
+    already holds the project's row lock (allocate_version_numbers), so
+    concurrent uploads to the project can't interleave their updates. A
+    project without a summary row yet (created before the table existed)
+    gets one.
+
+    Args:
+        project_id (int): The project all the versions belong to.
+        versions (list): The new, flushed Versions.
+    """
+    if not versions:
+        return
+    latest = max(versions, key=lambda version: version.version_number)
+
+    stmt = pg_insert(ProjectSummary).values(
+        project_id=project_id,
+        version_count=len(versions),
+        total_bytes=sum(version.size_bytes or 0 for version in versions),
+        attested_count=sum(1 for version in versions if version.attestation_status),
+        latest_version_id=latest.version_id,
+        latest_version_number=latest.version_number,
+        latest_file_name=latest.file_name,
+        last_uploaded_at=latest.uploaded_at
+    )
+    # Version numbers only grow, but don't let a late writer move "latest" backwards
+    is_newer = db.or_(
+        ProjectSummary.latest_version_number.is_(None),
+        stmt.excluded.latest_version_number > ProjectSummary.latest_version_number
+    )
+    db.session.execute(stmt.on_conflict_do_update(
+        index_elements=[ProjectSummary.project_id],
+        set_={
+            'version_count': ProjectSummary.version_count + stmt.excluded.version_count,
+            'total_bytes': ProjectSummary.total_bytes + stmt.excluded.total_bytes,
+            'attested_count': ProjectSummary.attested_count + stmt.excluded.attested_count,
+            **{
+                column: db.case((is_newer, getattr(stmt.excluded, column)), else_=getattr(ProjectSummary, column))
+                for column in ('latest_version_id', 'latest_version_number', 'latest_file_name', 'last_uploaded_at')
+            },
+        }
+    ))
+
+
+def record_version_removed(version):
+    """
+    Takes a deleted (and flushed) Version out of its project's summary (NOT
+    committed). If it was the latest version, the new latest one is found
+    through the (project_id, version_number) unique index.
+    """
+    latest_version_id = db.session.execute(
+        db.update(ProjectSummary)
+          .where(ProjectSummary.project_id == version.project_id)
+          .values(
+              version_count=ProjectSummary.version_count - 1,
+              total_bytes=ProjectSummary.total_bytes - (version.size_bytes or 0),
+              attested_count=ProjectSummary.attested_count - (1 if version.attestation_status else 0)
+          )
+          .returning(ProjectSummary.latest_version_id)
+    ).scalar_one_or_none()
+
+    if latest_version_id != version.version_id:
+        return
+
+    newest = db.session.execute(
+        db.select(Version.version_id, Version.version_number, Version.file_name, Version.uploaded_at)
+          .filter(Version.project_id == version.project_id)
+          .order_by(Version.version_number.desc())
+          .limit(1)
+    ).first()
+    db.session.execute(
+        db.update(ProjectSummary)
+          .where(ProjectSummary.project_id == version.project_id)
+          .values(
+              latest_version_id=newest.version_id if newest else None,
+              latest_version_number=newest.version_number if newest else None,
+              latest_file_name=newest.file_name if newest else None,
+              last_uploaded_at=newest.uploaded_at if newest else None
+          )
+    )
+
+
+# Recomputes the summaries of the given projects from versions
+_REBUILD_SQL = db.text("""
+    INSERT INTO project_summaries (
+        project_id, version_count, total_bytes, attested_count,
+        latest_version_id, latest_version_number, latest_file_name, last_uploaded_at
+    )
+    SELECT p.project_id,
+           coalesce(totals.version_count, 0), coalesce(totals.total_bytes, 0), coalesce(totals.attested_count, 0),
+           latest.version_id, latest.version_number, latest.file_name, latest.uploaded_at
+    FROM projects p
+    LEFT JOIN (
+        SELECT project_id,
+               count(*) AS version_count,
+               coalesce(sum(size_bytes), 0) AS total_bytes,
+               count(*) FILTER (WHERE attestation_status) AS attested_count
+        FROM versions
+        WHERE project_id = ANY(:project_ids)
+        GROUP BY project_id
+    ) totals ON totals.project_id = p.project_id
+    LEFT JOIN LATERAL (
+        SELECT version_id, version_number, file_name, uploaded_at
+        FROM versions v
+        WHERE v.project_id = p.project_id
+        ORDER BY v.version_number DESC
+        LIMIT 1
+    ) latest ON true
+    WHERE p.project_id = ANY(:project_ids)
+    ON CONFLICT (project_id) DO UPDATE SET
+        version_count = excluded.version_count,
+        total_bytes = excluded.total_bytes,
+        attested_count = excluded.attested_count,
+        latest_version_id = excluded.latest_version_id,
+        latest_version_number = excluded.latest_version_number,
+        latest_file_name = excluded.latest_file_name,
+        last_uploaded_at = excluded.last_uploaded_at
+""")
+
+
+def rebuild_project_summaries(batch_size=REBUILD_BATCH_SIZE):
+    """
+    Recomputes every project's summary from its versions (backfill, or repair
+    after versions were changed outside the app).
+
+    Works through the projects in batches, one transaction each. A batch
+    first locks its project rows, the same lock uploads take to number their
+    versions, so no version can be added to those projects while they are
+    being recomputed. Safe to run on a live site.
+
+    Returns:
+        int: The number of projects recomputed.
+    """
+    total = 0
+    after = 0
+    while True:
+        project_ids = db.session.scalars(
+            db.select(Project.project_id)
+              .filter(Project.project_id > after)
+              .order_by(Project.project_id)
+              .limit(batch_size)
+              .with_for_update()
+        ).all()
+        if not project_ids:
+            return total
+
+        db.session.execute(_REBUILD_SQL, {'project_ids': project_ids})
+        db.session.commit()
+        total += len(project_ids)
+        after = project_ids[-1]
+        logger.info("Rebuilt project summaries", extra={'projects': total, 'last_project_id': after})
+
+
+def backfill_version_sizes(storage, batch_size=SIZE_BACKFILL_BATCH_SIZE):
+    """
+    Fills in size_bytes for versions recorded before sizes were captured.
+
+    Content-addressed and chunked versions get theirs from the blobs and
+    version_chunks tables; the rest are looked up in storage with one HEAD
+    per object. Objects that are missing stay None (and count as 0 bytes).
+
+    Returns:
+        dict: How many versions were sized from each source, and how many
+        objects were missing.
+    """
+    # 1. From the database, where the size is already known
+    from_blobs = db.session.execute(db.text("""
+        UPDATE versions v SET size_bytes = b.size_bytes
+        FROM blobs b
+        WHERE v.size_bytes IS NULL AND v.storage_kind = 'object' AND b.storage_key = v.storage_key
+    """)).rowcount
+    from_chunks = db.session.execute(db.text("""
+        UPDATE versions v SET size_bytes = c.total_bytes
+        FROM (SELECT version_id, sum(size_bytes) AS total_bytes FROM version_chunks GROUP BY version_id) c
+        WHERE v.size_bytes IS NULL AND v.storage_kind = 'chunked' AND c.version_id = v.version_id
+    """)).rowcount
+    db.session.commit()
+
+    # 2. From storage, a batch at a time (keyset on version_id)
+    from_storage = missing = 0
+    after = 0
+    while True:
+        rows = db.session.execute(
+            db.select(Version.version_id, Version.storage_key)
+              .filter(Version.size_bytes.is_(None), Version.storage_kind == 'object', Version.version_id > after)
+              .order_by(Version.version_id)
+              .limit(batch_size)
+        ).all()
+        if not rows:
+            break
+        after = rows[-1].version_id
+
+        sizes = []
+        for row in rows:
+            head = storage.head_object(row.storage_key)
+            if head is None:
+                missing += 1
+            else:
+                sizes.append({'version_id': row.version_id, 'size_bytes': head['size']})
+        if sizes:
+            db.session.execute(db.update(Version), sizes)
+        db.session.commit()
+        from_storage += len(sizes)
+
+    return {'from_blobs': from_blobs, 'from_chunks': from_chunks, 'from_storage': from_storage, 'missing': missing}
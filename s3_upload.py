@@ -1,17 +1,33 @@
-import boto3
-from flask import current_app # Used to get config variables from the running app
+import logging
+import math
 import os
+from flask import current_app # Used to get config variables from the running app
 from werkzeug.utils import secure_filename
 import uuid
+from storage import get_storage # Shared, pooled S3 client created in create_app()
 
-def upload_file_to_s3(file_data, bucket_name, region_name, user_id, project_id):
+logger = logging.getLogger(__name__)
+
+def build_storage_key(project_id, user_id, filename):
+    """
+    Generates a unique, structured storage key (path) for a new upload.
+    Format: projects/{project_id}/{user_id}-{unique_id}-{filename}
     """
-    Uploads a file to an S3 bucket and returns the unique storage key (S3 path).
+    unique_file_id = str(uuid.uuid4())
+    
+    return os.path.join(
+        'projects',
+        str(project_id),
+        f'{user_id}-{unique_file_id}-{secure_filename(filename)}'
+    ).replace('\\', '/') # Ensure forward slashes for S3 paths
+
+def upload_file_to_s3(file_data, user_id, project_id):
+    """
+    Uploads a file to the configured bucket (S3_BUCKET_NAME, via the shared
+    storage backend) and returns the unique storage key (S3 path).
     
     Args:
         file_data (FileStorage): The file object from Flask's request.files.
-        bucket_name (str): The name of the S3 bucket.
-        region_name (str): The AWS region of the bucket.
         user_id (int): The ID of the user uploading the file.
         project_id (int): The ID of the project the file belongs to.
         
@@ -19,49 +35,131 @@ def upload_file_to_s3(file_data, bucket_name, region_name, user_id, project_id):
         str or None: The unique S3 storage key (path) if successful, None otherwise.
     """
     
-    # 1. Initialize S3 client
-    try:
-        s3_client = boto3.client(
-            "s3",
-            region_name=region_name,
-            aws_access_key_id=current_app.config['AWS_ACCESS_KEY_ID'],
-            aws_secret_access_key=current_app.config['AWS_SECRET_ACCESS_KEY']
-        )
-    except Exception as e:
-        print(f"ERROR: Could not initialize Boto3 client: {e}")
-        return None
+    # 1. Get the shared S3 client (built once per app process, not per upload)
+    storage = get_storage()
 
     # 2. Generate a unique, structured storage key (path)
-    # Format: projects/{project_id}/{user_id}-{unique_id}-{filename}
     filename = secure_filename(file_data.filename)
-    unique_file_id = str(uuid.uuid4())
-    
-    storage_key = os.path.join(
-        'projects',
-        str(project_id),
-        f'{user_id}-{unique_file_id}-{filename}'
-    ).replace('\\', '/') # Ensure forward slashes for S3 paths
+    storage_key = build_storage_key(project_id, user_id, filename)
 
     # 3. Upload the file
     try:
         # Move the cursor back to the start of the file before uploading
         file_data.seek(0)
         
-        s3_client.upload_fileobj(
-            file_data,
-            bucket_name,
-            storage_key
-        )
+        storage.upload_fileobj(file_data, storage_key)
         # Return the unique path used to retrieve the file later
         return storage_key
         
-    except Exception as e:
-        print(f"ERROR: S3 Upload failed for {filename}: {e}")
+    except Exception:
+        logger.exception("S3 upload failed", extra={'file_name': filename})
+        return None
+
+
+def upload_stream_to_s3(file_part, user_id, project_id):
+    """
+    Streams a file part straight from the request body into S3 as a multipart
+    upload, without spooling it to disk first.
+    
+    Args:
+        file_part (StreamingForm): The current file part of a streaming form.
+        user_id (int): The ID of the user uploading the file.
+        project_id (int): The ID of the project the file belongs to.
+        
+    Returns:
+        str or None: The unique S3 storage key (path) if successful, None otherwise.
+    """
+    storage = get_storage()
+    filename = secure_filename(file_part.filename)
+    storage_key = build_storage_key(project_id, user_id, filename)
+
+    try:
+        storage.upload_stream(file_part, storage_key)
+        return storage_key
+        
+    except Exception:
+        logger.exception("Streaming S3 upload failed", extra={'file_name': filename})
         return None
 
 
+def create_direct_upload(project_id, user_id, file_name, file_size=None):
+    """
+    Issues presigned credentials so the browser can upload a file straight to
+    S3 without the bytes passing through Flask.
+    
+    Small files (or unknown sizes) get a single presigned POST. Files larger
+    than one multipart part get a multipart upload with one presigned PUT URL
+    per part; the client sends the parts' ETags back to the finalize endpoint.
+    
+    Args:
+        project_id (int): The ID of the project the file belongs to.
+        user_id (int): The ID of the user uploading the file.
+        file_name (str): The original file name (used in the storage key).
+        file_size (int, optional): The file size in bytes, if known.
+        
+    Returns:
+        dict: The storage key plus either POST 'url'/'fields' or multipart 'upload_id'/'parts'.
+    """
+    storage = get_storage()
+    expires_in = current_app.config['DIRECT_UPLOAD_URL_EXPIRES']
+    storage_key = build_storage_key(project_id, user_id, file_name)
+
+    if not file_size or file_size <= storage.part_size:
+        post = storage.generate_upload_post(
+            storage_key, current_app.config['DIRECT_UPLOAD_MAX_SIZE'], expires_in
+        )
+        return {
+            'method': 'post',
+            'storage_key': storage_key,
+            'url': post['url'],
+            'fields': post['fields'],
+        }
+
+    # S3 allows at most 10,000 parts, so very large files need bigger parts
+    part_size = max(storage.part_size, math.ceil(file_size / 10000))
+    part_count = math.ceil(file_size / part_size)
+    upload_id = storage.create_multipart_upload(storage_key)
+
+    return {
+        'method': 'multipart',
+        'storage_key': storage_key,
+        'upload_id': upload_id,
+        'part_size': part_size,
+        'parts': storage.generate_upload_part_urls(storage_key, upload_id, part_count, expires_in),
+    }
+
+def verify_direct_upload(storage_key, expected_size=None, expected_etag=None, upload_id=None, parts=None):
+    """
+    Confirms that a direct upload actually landed in S3 before we record it.
+    
+    Completes the multipart upload first when upload_id is given, then HEADs
+    the object and checks its size and ETag against what the client reported.
+    
+    Returns:
+        tuple: (object info dict or None, error message or None)
+    """
+    storage = get_storage()
+
+    try:
+        if upload_id:
+            storage.complete_multipart_upload(storage_key, upload_id, parts or [])
+        head = storage.head_object(storage_key)
+    except Exception:
+        logger.exception("Could not verify direct upload", extra={'storage_key': storage_key})
+        return None, "Could not verify the uploaded object."
+
+    if head is None:
+        return None, "Uploaded object not found in storage."
+    if expected_size is not None and head['size'] != expected_size:
+        return None, f"Size mismatch: expected {expected_size} bytes, found {head['size']}."
+    if expected_etag and head['etag'] != expected_etag.strip('"'):
+        return None, "ETag mismatch: the stored object differs from the one uploaded."
+    return head, None
+
+
 def allowed_file(filename):
     """A basic function to validate file extensions."""
     # Define a simple set of allowed extensions for the MVP
-    ALLOWED_EXTENSIONS = {'txt', 'pdf', 'png', 'jpg', 'jpeg', 'gif', 'zip', 'dwg', 'dxf'}
+    ALLOWED_EXTENSIONS = {'txt', 'pdf', 'png', 'jpg', 'jpeg', 'gif', 'zip', 'dwg', 'dxf',
+                          'wav', 'aif', 'aiff', 'flac', 'mp3'}
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
\ No newline at end of file
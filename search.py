@@ -0,0 +1,52 @@
+from database import db
+from models import Project, Version, ProjectMember
+from pagination import split_page
+
+# Same text search configuration as the Version.search_vector expression
+SEARCH_CONFIG = 'english'
+
+
+def search_versions(user_id, text, after=None, page_size=50, attested_only=False, project_id=None):
+    """
+    Full-text search over the versions of every project the user belongs to.
+
+    Matching uses the GIN index on versions.search_vector (or its partial
+    twin when attested_only is set), so the cost depends on how many versions
+    match, not on how many exist. Results are newest first and keyset
+    paginated on (uploaded_at, version_id), like the version history.
+
+    Args:
+        user_id (int): Only projects this user is a member of are searched.
+        text (str): The search, in web search syntax ("quoted phrases", -exclusions, or).
+        after (list, optional): Decoded cursor: (uploaded_at, version_id) of the last result shown.
+        page_size (int): Results per page.
+        attested_only (bool): Only return versions with attestation_status set.
+        project_id (int, optional): Limit the search to one project.
+
+    Returns:
+        tuple: ([(Version, project_name), ...], has_more)
+    """
+    query = (
+        db.select(Version, Project.name)
+          .join(Project, Project.project_id == Version.project_id)
+          .join(ProjectMember, db.and_(
+              ProjectMember.project_id == Version.project_id,
+              ProjectMember.user_id == user_id
+          ))
+          .filter(Version.search_vector.bool_op('@@')(db.func.websearch_to_tsquery(SEARCH_CONFIG, text)))
+    )
+    if attested_only:
+        # Must match the partial index's predicate for the planner to use it
+        query = query.filter(Version.attestation_status)
+    if project_id is not None:
+        query = query.filter(Version.project_id == project_id)
+    if after:
+        query = query.filter(
+            db.tuple_(Version.uploaded_at, Version.version_id) < db.tuple_(*after)
+        )
+
+    return split_page(db.session.execute(
+        query
+          .order_by(Version.uploaded_at.desc(), Version.version_id.desc())
+          .limit(page_size + 1)
+    ).all(), page_size)
@@ -0,0 +1,489 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import boto3
+from boto3.s3.transfer import TransferConfig
+from botocore.config import Config as BotoConfig
+from flask import current_app
+from instrumentation import timed_call, PHASE_STORAGE
+
+# S3 rejects multipart parts smaller than 5 MiB (except the last part)
+MIN_MULTIPART_PART_SIZE = 5 * 1024 * 1024
+# Most keys S3 returns per ListObjectsV2 page and accepts per DeleteObjects call
+LIST_PAGE_SIZE = 1000
+DELETE_BATCH_SIZE = 1000
+
+class StorageBackend:
+    """
+    The storage operations the rest of the app relies on. Objects are
+    addressed by storage key ("projects/1/..."); a backend decides where the
+    bytes actually live. STORAGE_BACKEND picks the implementation (see
+    create_storage()).
+    """
+
+    # Whether browsers can upload straight to the backend (presigned POST /
+    # multipart part URLs). Without it, /upload_version/presign is refused.
+    supports_direct_upload = False
+
+    # Parallel part/chunk transfers per upload
+    part_concurrency = 1
+
+    def upload_fileobj(self, file_obj, storage_key):
+        """Stores a seekable file-like object under storage_key."""
+        raise NotImplementedError
+
+    def upload_stream(self, reader, storage_key, before_complete=None):
+        """
+        Stores a non-seekable reader under storage_key, reading it once.
+        If before_complete() returns False after everything was read, nothing
+        is stored and None is returned; otherwise returns the byte count.
+        """
+        raise NotImplementedError
+
+    def put_bytes(self, storage_key, data):
+        raise NotImplementedError
+
+    def get_bytes(self, storage_key):
+        raise NotImplementedError
+
+    def iter_object(self, storage_key, chunk_size=64 * 1024):
+        """Yields an object's bytes in pieces."""
+        raise NotImplementedError
+
+    def delete_object(self, storage_key):
+        """Deletes an object (a no-op if it does not exist)."""
+        raise NotImplementedError
+
+    def delete_objects(self, storage_keys):
+        """
+        Deletes many objects, up to DELETE_BATCH_SIZE per request.
+
+        Returns:
+            list: The keys that could not be deleted.
+        """
+        raise NotImplementedError
+
+    def iter_object_pages(self, prefix):
+        """
+        Yields every object under prefix, a page (at most LIST_PAGE_SIZE) at
+        a time, as lists of {'key', 'size', 'last_modified'} (aware UTC).
+        """
+        raise NotImplementedError
+
+    def head_object(self, storage_key):
+        """Returns {'size', 'etag'} for an object, or None if it does not exist."""
+        raise NotImplementedError
+
+    def generate_download_url(self, storage_key, file_name, expires_in=300, disposition='attachment'):
+        """Returns a URL anyone holding it can download the object from until it expires."""
+        raise NotImplementedError
+
+    def generate_upload_post(self, storage_key, max_size, expires_in):
+        raise NotImplementedError("This storage backend does not support direct uploads.")
+
+    def create_multipart_upload(self, storage_key):
+        raise NotImplementedError("This storage backend does not support direct uploads.")
+
+    def generate_upload_part_urls(self, storage_key, upload_id, part_count, expires_in):
+        raise NotImplementedError("This storage backend does not support direct uploads.")
+
+    def complete_multipart_upload(self, storage_key, upload_id, parts):
+        raise NotImplementedError("This storage backend does not support direct uploads.")
+
+    def pool_stats(self):
+        """Usage counters for /storage_stats."""
+        return {}
+
+
+class S3Storage(StorageBackend):
+    """
+    Owns the single S3 client shared by every request in an app process.
+
+    boto3 clients are thread-safe once created, so building one here at startup
+    means credential resolution, endpoint setup and the HTTP connection pool are
+    paid for once instead of on every upload/download.
+    """
+
+    supports_direct_upload = True
+
+    def __init__(self, config):
+        self.bucket_name = config['S3_BUCKET_NAME']
+        self.region_name = config['AWS_REGION']
+        self.max_pool_connections = config['S3_MAX_POOL_CONNECTIONS']
+
+        # Multipart settings shared by buffered and streaming uploads
+        self.part_size = max(config['S3_MULTIPART_PART_SIZE'], MIN_MULTIPART_PART_SIZE)
+        self.part_concurrency = max(config['S3_MULTIPART_CONCURRENCY'], 1)
+        # How many parts may sit in memory at once (queued + uploading)
+        self.max_buffered_parts = max(config['S3_UPLOAD_MEMORY_CAP'] // self.part_size, 1)
+        self.transfer_config = TransferConfig(
+            multipart_threshold=self.part_size,
+            multipart_chunksize=self.part_size,
+            max_concurrency=self.part_concurrency,
+        )
+
+        boto_config = BotoConfig(
+            region_name=self.region_name,
+            max_pool_connections=self.max_pool_connections,
+            tcp_keepalive=config['S3_TCP_KEEPALIVE'],
+            connect_timeout=config['S3_CONNECT_TIMEOUT'],
+            read_timeout=config['S3_READ_TIMEOUT'],
+            retries={
+                'max_attempts': config['S3_MAX_RETRIES'],
+                'mode': config['S3_RETRY_MODE'],
+            },
+        )
+
+        # A dedicated session keeps us from sharing boto3's global default
+        # session, which is NOT thread-safe.
+        session = boto3.session.Session(
+            aws_access_key_id=config['AWS_ACCESS_KEY_ID'],
+            aws_secret_access_key=config['AWS_SECRET_ACCESS_KEY'],
+            region_name=self.region_name,
+        )
+        self.client = session.client(
+            's3',
+            config=boto_config,
+            endpoint_url=config.get('S3_ENDPOINT_URL') # None means real AWS
+        )
+
+        # Request counters used by pool_stats()
+        self._lock = threading.Lock()
+        self._in_flight = 0
+        self._peak_in_flight = 0
+        self._total_requests = 0
+        self._failed_requests = 0
+
+        events = self.client.meta.events
+        events.register('before-send.s3', self._on_before_send)
+        events.register('response-received.s3', self._on_response_received)
+
+    def _on_before_send(self, **kwargs):
+        with self._lock:
+            self._in_flight += 1
+            self._total_requests += 1
+            self._peak_in_flight = max(self._peak_in_flight, self._in_flight)
+        # Returning None lets botocore send the request as normal
+
+    def _on_response_received(self, exception=None, **kwargs):
+        with self._lock:
+            self._in_flight -= 1
+            if exception is not None:
+                self._failed_requests += 1
+
+    @timed_call(PHASE_STORAGE)
+    def upload_fileobj(self, file_obj, storage_key):
+        """Uploads a file-like object to the configured bucket under storage_key."""
+        self.client.upload_fileobj(
+            file_obj,
+            self.bucket_name,
+            storage_key,
+            Config=self.transfer_config
+        )
+
+    @timed_call(PHASE_STORAGE)
+    def upload_stream(self, reader, storage_key, before_complete=None):
+        """
+        Streams a non-seekable reader into S3 as a multipart upload.
+
+        Parts are uploaded in parallel while the next part is still being read,
+        so the S3 transfer overlaps with the client sending the body. At most
+        max_buffered_parts parts are held in memory at once, which keeps peak
+        RSS per upload at roughly S3_UPLOAD_MEMORY_CAP.
+
+        Args:
+            reader: Any object with a read(size) method (e.g. a streaming form part).
+            storage_key (str): The S3 key to write to.
+            before_complete (callable, optional): Called once every byte has been
+                read and uploaded; returning False aborts the upload so no object
+                is created (used to drop duplicate content).
+
+        Returns:
+            int or None: The total number of bytes uploaded, or None if aborted.
+        """
+        # A buffer slot must be taken before a part is read and is only given
+        # back once that part has been uploaded.
+        slots = threading.BoundedSemaphore(self.max_buffered_parts)
+
+        slots.acquire()
+        first_part = read_full(reader, self.part_size)
+
+        # Small files fit in a single part: skip the multipart round trips
+        if len(first_part) < self.part_size:
+            slots.release()
+            if before_complete is not None and before_complete() is False:
+                return None
+            self.client.put_object(Bucket=self.bucket_name, Key=storage_key, Body=first_part)
+            return len(first_part)
+
+        upload_id = self.client.create_multipart_upload(
+            Bucket=self.bucket_name, Key=storage_key
+        )['UploadId']
+
+        total_bytes = 0
+        futures = []
+        try:
+            with ThreadPoolExecutor(max_workers=self.part_concurrency) as pool:
+                part_number = 1
+                data = first_part
+                first_part = None
+                while data:
+                    total_bytes += len(data)
+                    futures.append(pool.submit(
+                        self._upload_part, storage_key, upload_id, part_number, data, slots
+                    ))
+                    data = None # The worker owns the buffer now
+
+                    # Stop reading the body as soon as any part has failed
+                    for future in futures:
+                        if future.done() and future.exception() is not None:
+                            raise future.exception()
+
+                    part_number += 1
+                    slots.acquire()
+                    data = read_full(reader, self.part_size)
+                    if not data:
+                        slots.release()
+
+                parts = [future.result() for future in futures]
+
+            if before_complete is not None and before_complete() is False:
+                self.client.abort_multipart_upload(
+                    Bucket=self.bucket_name, Key=storage_key, UploadId=upload_id
+                )
+                return None
+
+            self.client.complete_multipart_upload(
+                Bucket=self.bucket_name,
+                Key=storage_key,
+                UploadId=upload_id,
+                MultipartUpload={'Parts': parts}
+            )
+            return total_bytes
+
+        except Exception:
+            # Don't leave billable, invisible parts behind in the bucket
+            for future in futures:
+                future.cancel()
+            self.client.abort_multipart_upload(
+                Bucket=self.bucket_name, Key=storage_key, UploadId=upload_id
+            )
+            raise
+
+    def _upload_part(self, storage_key, upload_id, part_number, data, slots):
+        """Uploads one multipart part and frees its buffer slot when done."""
+        try:
+            response = self.client.upload_part(
+                Bucket=self.bucket_name,
+                Key=storage_key,
+                UploadId=upload_id,
+                PartNumber=part_number,
+                Body=data
+            )
+            return {'PartNumber': part_number, 'ETag': response['ETag']}
+        finally:
+            slots.release()
+
+    @timed_call(PHASE_STORAGE)
+    def put_bytes(self, storage_key, data):
+        """Stores a small in-memory object (chunks, manifests) in one PUT."""
+        self.client.put_object(Bucket=self.bucket_name, Key=storage_key, Body=data)
+
+    @timed_call(PHASE_STORAGE)
+    def get_bytes(self, storage_key):
+        """Reads a small object fully into memory."""
+        return self.client.get_object(Bucket=self.bucket_name, Key=storage_key)['Body'].read()
+
+    def iter_object(self, storage_key, chunk_size=64 * 1024):
+        """Yields an object's bytes in pieces without holding it all in memory."""
+        body = self.client.get_object(Bucket=self.bucket_name, Key=storage_key)['Body']
+        try:
+            for piece in body.iter_chunks(chunk_size):
+                yield piece
+        finally:
+            body.close()
+
+    @timed_call(PHASE_STORAGE)
+    def delete_object(self, storage_key):
+        """Deletes a single object (a no-op if it does not exist)."""
+        self.client.delete_object(Bucket=self.bucket_name, Key=storage_key)
+
+    @timed_call(PHASE_STORAGE)
+    def delete_objects(self, storage_keys):
+        """Deletes many objects with one DeleteObjects request per 1,000 keys."""
+        failed = []
+        for start in range(0, len(storage_keys), DELETE_BATCH_SIZE):
+            response = self.client.delete_objects(
+                Bucket=self.bucket_name,
+                Delete={
+                    'Objects': [{'Key': key} for key in storage_keys[start:start + DELETE_BATCH_SIZE]],
+                    'Quiet': True, # Only failures are listed in the response
+                }
+            )
+            failed.extend(error['Key'] for error in response.get('Errors', []))
+        return failed
+
+    def iter_object_pages(self, prefix):
+        """Lists the bucket under prefix with ListObjectsV2, one page per request."""
+        paginator = self.client.get_paginator('list_objects_v2')
+        for response in paginator.paginate(
+            Bucket=self.bucket_name,
+            Prefix=prefix,
+            PaginationConfig={'PageSize': LIST_PAGE_SIZE}
+        ):
+            page = [
+                {'key': item['Key'], 'size': item['Size'], 'last_modified': item['LastModified']}
+                for item in response.get('Contents', [])
+            ]
+            if page:
+                yield page
+
+    @timed_call(PHASE_STORAGE)
+    def generate_download_url(self, storage_key, file_name, expires_in=300, disposition='attachment'):
+        """
+        Returns a pre-signed GET URL for the object. 'attachment' forces the
+        browser to download the file; 'inline' lets it display/play it.
+        """
+        return self.client.generate_presigned_url(
+            'get_object',
+            Params={
+                'Bucket': self.bucket_name,
+                'Key': storage_key,
+                'ResponseContentDisposition': f'{disposition}; filename="{file_name}"'
+            },
+            ExpiresIn=expires_in
+        )
+
+    @timed_call(PHASE_STORAGE)
+    def generate_upload_post(self, storage_key, max_size, expires_in):
+        """
+        Returns a presigned POST (url + form fields) that lets a browser upload
+        one object directly to S3, restricted to exactly storage_key and to
+        at most max_size bytes.
+        """
+        return self.client.generate_presigned_post(
+            Bucket=self.bucket_name,
+            Key=storage_key,
+            Conditions=[['content-length-range', 0, max_size]],
+            ExpiresIn=expires_in
+        )
+
+    @timed_call(PHASE_STORAGE)
+    def create_multipart_upload(self, storage_key):
+        """Starts a multipart upload and returns its UploadId."""
+        return self.client.create_multipart_upload(
+            Bucket=self.bucket_name, Key=storage_key
+        )['UploadId']
+
+    @timed_call(PHASE_STORAGE)
+    def generate_upload_part_urls(self, storage_key, upload_id, part_count, expires_in):
+        """Returns one presigned PUT URL per part number (1..part_count)."""
+        return [
+            {
+                'part_number': part_number,
+                'url': self.client.generate_presigned_url(
+                    'upload_part',
+                    Params={
+                        'Bucket': self.bucket_name,
+                        'Key': storage_key,
+                        'UploadId': upload_id,
+                        'PartNumber': part_number
+                    },
+                    ExpiresIn=expires_in
+                )
+            }
+            for part_number in range(1, part_count + 1)
+        ]
+
+    @timed_call(PHASE_STORAGE)
+    def complete_multipart_upload(self, storage_key, upload_id, parts):
+        """
+        Completes a multipart upload.
+
+        Args:
+            parts (list): Dicts with 'PartNumber' and 'ETag', in any order.
+        """
+        self.client.complete_multipart_upload(
+            Bucket=self.bucket_name,
+            Key=storage_key,
+            UploadId=upload_id,
+            MultipartUpload={'Parts': sorted(parts, key=lambda part: part['PartNumber'])}
+        )
+
+    @timed_call(PHASE_STORAGE)
+    def head_object(self, storage_key):
+        """
+        Returns the object's size and ETag, or None if it does not exist.
+        """
+        try:
+            response = self.client.head_object(Bucket=self.bucket_name, Key=storage_key)
+        except self.client.exceptions.ClientError as e:
+            if e.response['Error']['Code'] in ('404', 'NoSuchKey', 'NotFound'):
+                return None
+            raise
+        return {
+            'size': response['ContentLength'],
+            'etag': response['ETag'].strip('"'),
+        }
+
+    def pool_stats(self):
+        """
+        Reports how busy the shared connection pool is, so
+        S3_MAX_POOL_CONNECTIONS can be sized from real traffic.
+
+        Returns:
+            dict: Configured pool size, request counters and, per S3 host,
+                  the number of connections urllib3 has opened so far.
+        """
+        with self._lock:
+            stats = {
+                'max_pool_connections': self.max_pool_connections,
+                'in_flight': self._in_flight,
+                'peak_in_flight': self._peak_in_flight,
+                'total_requests': self._total_requests,
+                'failed_requests': self._failed_requests,
+                'hosts': {},
+            }
+
+        # The urllib3 pools live on botocore internals; treat them as
+        # best-effort so a botocore upgrade can't break the stats endpoint.
+        try:
+            manager = self.client._endpoint.http_session._manager
+            for key in list(manager.pools.keys()):
+                pool = manager.pools.get(key)
+                if pool is None:
+                    continue
+                stats['hosts'][pool.host] = {
+                    'connections_opened': pool.num_connections,
+                    'requests_sent': pool.num_requests,
+                    'idle_connections': sum(1 for conn in list(pool.pool.queue) if conn is not None),
+                }
+        except Exception:
+            pass
+
+        return stats
+
+
+def read_full(reader, size):
+    """Reads until size bytes are collected or the reader is exhausted."""
+    chunks = []
+    remaining = size
+    while remaining > 0:
+        chunk = reader.read(remaining)
+        if not chunk:
+            break
+        chunks.append(chunk)
+        remaining -= len(chunk)
+    return b''.join(chunks)
+
+
+def create_storage(config):
+    """Builds the storage backend selected by STORAGE_BACKEND ('s3' or 'local')."""
+    if config['STORAGE_BACKEND'] == 'local':
+        from local_storage import LocalStorage # Not needed by S3 deployments
+        return LocalStorage(config)
+    return S3Storage(config)
+
+
+def get_storage():
+    """Returns the storage backend created by create_app() for the running app."""
+    return current_app.extensions['storage']
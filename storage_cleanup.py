@@ -0,0 +1,335 @@
+import logging
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+from flask import current_app
+from database import db
+from models import Blob, Chunk, ProjectSummary, Version, VersionChunk, VersionWaveform, chunk_storage_key
+from versioning import delete_version
+
+logger = logging.getLogger(__name__)
+
+# Every object the app stores lives under this prefix
+STORAGE_PREFIX = 'projects/'
+# Versions examined per round of the retention pass
+RETENTION_BATCH_SIZE = 500
+# Chunk rows examined per round (and transaction) of the chunk GC
+CHUNK_GC_BATCH_SIZE = 1000
+# Keys and version ids listed in a report, per kind
+REPORT_SAMPLE_SIZE = 100
+# pg_try_advisory_lock() key held while a cleanup runs (any process)
+CLEANUP_LOCK_ID = 7_236_001
+
+
+class CleanupReport:
+    """What a cleanup run found and did (in a dry run: would have done)."""
+
+    def __init__(self, dry_run):
+        self.dry_run = dry_run
+        self.counts = {
+            'versions_pruned': 0,
+            'projects_pruned': 0,
+            'chunks_collected': 0, # Chunk rows no version uses any more
+            'chunk_bytes_collected': 0,
+            'objects_listed': 0,
+            'objects_referenced': 0,
+            'orphans_too_recent': 0, # Unreferenced, but inside ORPHAN_GRACE_PERIOD
+            'orphans_found': 0,
+            'orphan_bytes': 0,
+            'orphans_deleted': 0,
+            'orphans_failed': 0,
+        }
+        self.samples = {'pruned_versions': [], 'orphans': []}
+
+    def count(self, name, amount=1):
+        self.counts[name] += amount
+
+    def sample(self, kind, value):
+        if len(self.samples[kind]) < REPORT_SAMPLE_SIZE:
+            self.samples[kind].append(value)
+
+    def to_dict(self):
+        return {'dry_run': self.dry_run, **self.counts, 'samples': self.samples}
+
+
+class _Throttle:
+    """Spaces out work so it averages at most per_second units a second (0 = no limit)."""
+
+    def __init__(self, per_second):
+        self.interval = 1 / per_second if per_second > 0 else 0
+        self._next = time.monotonic()
+
+    def wait(self, units=1):
+        if not self.interval:
+            return
+        now = time.monotonic()
+        if self._next > now:
+            time.sleep(self._next - now)
+            now = self._next
+        self._next = now + units * self.interval
+
+
+def _parse_chunk_key(storage_key):
+    """(project_id, sha256) for a chunk key ("projects/<id>/chunks/<sha256>"), else None."""
+    parts = storage_key.split('/')
+    if len(parts) == 4 and parts[0] == 'projects' and parts[1].isdigit() and parts[2] == 'chunks':
+        return int(parts[1]), parts[3]
+    return None
+
+
+def referenced_keys(storage_keys):
+    """
+    Returns the subset of storage_keys that some row still points at: a
+    Version (its file, blob or chunk manifest), a Blob, an audio preview or a
+    Chunk. Each lookup is an index probe per key, so a page of keys costs the
+    same however large the tables are.
+    """
+    referenced = set(db.session.scalars(
+        db.select(Version.storage_key).filter(Version.storage_key.in_(storage_keys))
+    ))
+    referenced.update(db.session.scalars(
+        db.select(Blob.storage_key).filter(Blob.storage_key.in_(storage_keys))
+    ))
+    referenced.update(db.session.scalars(
+        db.select(VersionWaveform.preview_key).filter(VersionWaveform.preview_key.in_(storage_keys))
+    ))
+
+    # Chunks are kept while their Chunk row exists, referenced by a version
+    # or not: a concurrent chunked upload may be about to reuse one. Rows
+    # no version uses are removed by collect_unreferenced_chunks() first.
+    chunk_keys = [pair for pair in map(_parse_chunk_key, storage_keys) if pair is not None]
+    if chunk_keys:
+        referenced.update(
+            chunk_storage_key(project_id, sha256)
+            for project_id, sha256 in db.session.execute(
+                db.select(Chunk.project_id, Chunk.sha256)
+                  .filter(db.tuple_(Chunk.project_id, Chunk.sha256).in_(chunk_keys))
+            )
+        )
+    return referenced
+
+
+def apply_retention(report, keep_last, keep_attested, throttle):
+    """
+    Deletes every project's versions beyond its keep_last newest (by version
+    number), sparing attested versions when keep_attested is set.
+
+    Only projects whose summary shows more than keep_last versions are looked
+    at. Versions go through delete_version(), so the project summaries stay
+    right; their stored objects become orphans for reconcile_orphans(). Each
+    round of deletions is its own transaction. In a dry run the versions are
+    only counted.
+    """
+    after = 0
+    while True:
+        project_ids = db.session.scalars(
+            db.select(ProjectSummary.project_id)
+              .filter(ProjectSummary.project_id > after, ProjectSummary.version_count > keep_last)
+              .order_by(ProjectSummary.project_id)
+              .limit(RETENTION_BATCH_SIZE)
+        ).all()
+        if not project_ids:
+            return
+        after = project_ids[-1]
+
+        for project_id in project_ids:
+            pruned = 0
+            below = None # Keyset on version_number, newest first
+            while True:
+                query = (
+                    db.select(Version.version_id, Version.version_number, Version.attestation_status)
+                      .filter(Version.project_id == project_id)
+                      .order_by(Version.version_number.desc())
+                      .limit(RETENTION_BATCH_SIZE)
+                )
+                if below is None:
+                    query = query.offset(keep_last)
+                else:
+                    query = query.filter(Version.version_number < below)
+                rows = db.session.execute(query).all()
+                if not rows:
+                    break
+                below = rows[-1].version_number
+
+                doomed = [row.version_id for row in rows if not (keep_attested and row.attestation_status)]
+                for version_id in doomed:
+                    report.sample('pruned_versions', version_id)
+                if not report.dry_run:
+                    for version in db.session.scalars(db.select(Version).filter(Version.version_id.in_(doomed))).all():
+                        throttle.wait()
+                        delete_version(version)
+                db.session.commit()
+                pruned += len(doomed)
+
+            if pruned:
+                report.count('versions_pruned', pruned)
+                report.count('projects_pruned')
+
+
+def _chunk_unused():
+    """SQL condition: no version of the chunk's project lists it (an index probe on chunk_sha256)."""
+    return ~db.exists().where(
+        VersionChunk.chunk_sha256 == Chunk.sha256,
+        Version.version_id == VersionChunk.version_id,
+        Version.project_id == Chunk.project_id
+    )
+
+
+def collect_unreferenced_chunks(report, grace_period):
+    """
+    Deletes the Chunk rows no version uses any more and that are older than
+    grace_period, so reconcile_orphans() then deletes their objects. Without
+    this, pruning chunked versions would never free their chunk data.
+
+    Works through the chunks in batches, one transaction each. A batch is
+    first locked FOR UPDATE SKIP LOCKED: a chunked upload about to reuse a
+    chunk holds a share lock on its row until it commits (see
+    upload_chunked), so those rows are skipped. The DELETE then checks for
+    references again, so a version committed in the meantime keeps its
+    chunks. In a dry run the chunks are only counted.
+    """
+    unused = db.and_(
+        Chunk.created_at < db.func.timezone('utc', db.func.now()) - timedelta(seconds=grace_period),
+        _chunk_unused()
+    )
+    after = None # Keyset on (project_id, sha256)
+    while True:
+        query = (
+            db.select(Chunk.project_id, Chunk.sha256, Chunk.size_bytes)
+              .filter(unused)
+              .order_by(Chunk.project_id, Chunk.sha256)
+              .limit(CHUNK_GC_BATCH_SIZE)
+        )
+        if after is not None:
+            query = query.filter(db.tuple_(Chunk.project_id, Chunk.sha256) > db.tuple_(*after))
+        if not report.dry_run:
+            query = query.with_for_update(skip_locked=True)
+        rows = db.session.execute(query).all()
+        if not rows:
+            db.session.commit()
+            return
+        after = (rows[-1].project_id, rows[-1].sha256)
+
+        if report.dry_run:
+            collected = rows
+        else:
+            collected = db.session.execute(
+                db.delete(Chunk)
+                  .where(db.tuple_(Chunk.project_id, Chunk.sha256).in_([(row.project_id, row.sha256) for row in rows]))
+                  .where(_chunk_unused())
+                  .returning(Chunk.size_bytes)
+            ).all()
+        db.session.commit()
+        report.count('chunks_collected', len(collected))
+        report.count('chunk_bytes_collected', sum(row.size_bytes for row in collected))
+
+
+def reconcile_orphans(storage, report, grace_period, throttle, list_pause, prefix=STORAGE_PREFIX):
+    """
+    Deletes the objects under prefix that no row references.
+
+    The listing is read a page (up to 1,000 keys) at a time. Each page's keys
+    are checked against the database in one set of indexed lookups, and the
+    difference is deleted with one batched delete per page. Objects newer
+    than grace_period are spared: their upload may not have committed its
+    Version yet. (Incomplete S3 multipart uploads are not objects; an
+    AbortIncompleteMultipartUpload lifecycle rule on the bucket cleans them up.)
+    """
+    cutoff = datetime.now(timezone.utc) - timedelta(seconds=grace_period)
+
+    for page in storage.iter_object_pages(prefix):
+        report.count('objects_listed', len(page))
+        referenced = referenced_keys([item['key'] for item in page])
+        db.session.commit() # Don't hold a snapshot open across the listing
+
+        orphans = []
+        for item in page:
+            if item['key'] in referenced:
+                report.count('objects_referenced')
+            elif item['last_modified'] > cutoff:
+                report.count('orphans_too_recent')
+            else:
+                orphans.append(item)
+                report.count('orphans_found')
+                report.count('orphan_bytes', item['size'])
+                report.sample('orphans', item['key'])
+
+        if orphans and not report.dry_run:
+            throttle.wait(len(orphans))
+            failed = storage.delete_objects([item['key'] for item in orphans])
+            report.count('orphans_deleted', len(orphans) - len(failed))
+            report.count('orphans_failed', len(failed))
+            if failed:
+                logger.warning("Could not delete orphaned objects", extra={'count': len(failed), 'sample': failed[:10]})
+
+        if list_pause:
+            time.sleep(list_pause)
+
+
+def run_storage_cleanup(storage, dry_run=False, retention=True, keep_last=None):
+    """
+    One cleanup run: the retention policy first (if enabled), then the
+    chunk GC, then orphan reconciliation, throttled per the
+    STORAGE_CLEANUP_* settings.
+
+    Only one run at a time is allowed across all processes (a Postgres
+    advisory lock). A run that finds the lock taken does nothing.
+
+    Args:
+        keep_last (int, optional): Overrides RETENTION_KEEP_LAST.
+
+    Returns:
+        CleanupReport or None: The report, or None if another run was in progress.
+    """
+    config = current_app.config
+    keep_last = config['RETENTION_KEEP_LAST'] if keep_last is None else keep_last
+    throttle = _Throttle(config['STORAGE_CLEANUP_DELETES_PER_SECOND'])
+
+    # The lock belongs to this dedicated connection and is released with it
+    with db.engine.connect() as lock_connection:
+        if not lock_connection.scalar(db.select(db.func.pg_try_advisory_lock(CLEANUP_LOCK_ID))):
+            return None
+        try:
+            report = CleanupReport(dry_run)
+            if retention and keep_last > 0:
+                apply_retention(report, keep_last, config['RETENTION_KEEP_ATTESTED'], throttle)
+            collect_unreferenced_chunks(report, config['ORPHAN_GRACE_PERIOD'])
+            reconcile_orphans(
+                storage, report, config['ORPHAN_GRACE_PERIOD'], throttle, config['STORAGE_CLEANUP_LIST_PAUSE']
+            )
+            return report
+        except Exception:
+            db.session.rollback()
+            raise
+        finally:
+            lock_connection.scalar(db.select(db.func.pg_advisory_unlock(CLEANUP_LOCK_ID)))
+
+
+class StorageCleanup:
+    """
+    Runs run_storage_cleanup() every STORAGE_CLEANUP_INTERVAL seconds on a
+    background thread. Every app process may start one; the advisory lock
+    makes sure only one run happens at a time.
+    """
+
+    def __init__(self, app):
+        self.app = app
+        self.interval = app.config['STORAGE_CLEANUP_INTERVAL']
+        self.dry_run = app.config['STORAGE_CLEANUP_DRY_RUN']
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._loop, name='storage-cleanup', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+
+    def _loop(self):
+        while not self._stopped.wait(self.interval):
+            with self.app.app_context():
+                try:
+                    report = run_storage_cleanup(self.app.extensions['storage'], dry_run=self.dry_run)
+                except Exception:
+                    logger.exception("Storage cleanup failed")
+                    continue
+                if report is not None:
+                    logger.info("Storage cleanup finished", extra=report.counts | {'dry_run': self.dry_run})
@@ -0,0 +1,127 @@
+from werkzeug.datastructures import MultiDict
+from werkzeug.sansio.multipart import MultipartDecoder, Field, File, Data, Epilogue, NeedData
+
+class StreamingForm:
+    """
+    Incremental multipart/form-data parser for a live request body.
+
+    Unlike request.form / request.files, nothing is spooled to disk: the file
+    part is exposed as a reader whose read() pulls bytes off the socket only as
+    the caller asks for them. Plain fields that appear before the file are
+    available in `form` as soon as next_file() returns; fields after the file
+    are collected by finish().
+    """
+
+    def __init__(self, stream, boundary, read_size=64 * 1024):
+        self._stream = stream
+        self._read_size = read_size
+        self._decoder = MultipartDecoder(boundary.encode('latin-1'))
+        self._finished = False # Request body fully read
+        self._complete = False # Closing boundary reached
+
+        self._current_part = None
+        self._field_chunks = []
+        self._pending = bytearray() # File bytes decoded but not yet read()
+        self._file_done = True
+
+        self.form = MultiDict()
+        self.filename = None
+        self.name = None
+        self.bytes_read = 0 # Bytes of the current file part read so far
+
+    @classmethod
+    def from_request(cls, request):
+        """Returns a StreamingForm for the request, or None if it is not multipart."""
+        boundary = request.mimetype_params.get('boundary')
+        if request.mimetype != 'multipart/form-data' or not boundary:
+            return None
+        return cls(request.stream, boundary)
+
+    def _next_event(self):
+        """Returns the next decoder event, reading from the stream as needed."""
+        while True:
+            event = self._decoder.next_event()
+            if not isinstance(event, NeedData):
+                return event
+            if self._finished:
+                raise ValueError("Unexpected end of multipart body.")
+            chunk = self._stream.read(self._read_size)
+            if not chunk:
+                self._finished = True
+                self._decoder.receive_data(None)
+            else:
+                self._decoder.receive_data(chunk)
+
+    def _handle_event(self, event):
+        """
+        Applies a single event to the parser state.
+
+        Returns:
+            bool: False once the epilogue (end of the form) has been reached.
+        """
+        if isinstance(event, Epilogue):
+            self._complete = True
+            return False
+
+        if isinstance(event, File):
+            self._current_part = event
+            self.filename = event.filename
+            self.name = event.name
+            self.bytes_read = 0
+            self._file_done = False
+        elif isinstance(event, Field):
+            self._current_part = event
+            self._field_chunks = []
+        elif isinstance(event, Data):
+            if isinstance(self._current_part, File):
+                self._pending.extend(event.data)
+                if not event.more_data:
+                    self._file_done = True
+            else:
+                self._field_chunks.append(event.data)
+                if not event.more_data:
+                    value = b''.join(self._field_chunks).decode('utf-8', 'replace')
+                    self.form.add(self._current_part.name, value)
+        return True
+
+    def next_file(self):
+        """
+        Advances to the next file part, collecting plain fields on the way.
+
+        Returns:
+            StreamingForm or None: self (readable as the file) or None if the
+            form contains no further file parts.
+        """
+        # Skip whatever is left of the previous file part
+        while not self._file_done:
+            self.read(self._read_size)
+
+        while not self._complete and self._handle_event(self._next_event()):
+            if isinstance(self._current_part, File) and not self._file_done:
+                return self
+        return None
+
+    def read(self, size=-1):
+        """Reads up to size bytes of the current file part (b'' at its end)."""
+        if size is None or size < 0:
+            size = float('inf')
+
+        while len(self._pending) < size and not self._file_done:
+            self._handle_event(self._next_event())
+
+        if size >= len(self._pending):
+            data = bytes(self._pending)
+            self._pending.clear()
+        else:
+            data = bytes(self._pending[:size])
+            del self._pending[:size]
+        self.bytes_read += len(data)
+        return data
+
+    def finish(self):
+        """Drains the rest of the body and returns every plain field seen."""
+        while not self._file_done:
+            self.read(self._read_size)
+        while not self._complete and self._handle_event(self._next_event()):
+            pass
+        return self.form
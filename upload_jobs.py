@@ -0,0 +1,269 @@
+import io
+import logging
+import os
+import shutil
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from flask import current_app
+from werkzeug.datastructures import FileStorage
+from database import db
+from storage import get_storage
+from versioning import add_version, store_file
+from audio_ingest import schedule_audio_ingest
+
+logger = logging.getLogger(__name__)
+
+# Copy size used when spooling a request body to local disk
+SPOOL_COPY_SIZE = 1024 * 1024
+
+# Job states, in the order a successful job passes through them
+QUEUED = 'queued'
+UPLOADING = 'uploading'
+COMMITTING = 'committing'
+RETRYING = 'retrying'
+DONE = 'done'
+FAILED = 'failed'
+
+
+class UploadJob:
+    """One background upload: a spooled file on its way to S3 and a Version row."""
+
+    def __init__(self, project_id, uploader_id, file_name, spool_path):
+        self.job_id = uuid.uuid4().hex
+        self.project_id = project_id
+        self.uploader_id = uploader_id
+        self.file_name = file_name
+        self.version_note = None
+        self.spool_path = spool_path
+        self.size = 0
+        self.bytes_read = 0
+        self.status = QUEUED
+        self.attempts = 0
+        self.version_id = None
+        self.version_number = None
+        self.error = None
+        self.created_at = time.time()
+        self.finished_at = None
+
+    @property
+    def finished(self):
+        return self.status in (DONE, FAILED)
+
+    def finish(self, status):
+        """Moves the job to DONE or FAILED. finished_at is set first, so a job seen as finished always has it."""
+        self.finished_at = time.time()
+        self.status = status
+
+    def to_dict(self):
+        return {
+            'job_id': self.job_id,
+            'project_id': self.project_id,
+            'file_name': self.file_name,
+            'status': self.status,
+            'size': self.size,
+            'bytes_read': self.bytes_read,
+            'attempts': self.attempts,
+            'version_id': self.version_id,
+            'version_number': self.version_number,
+            'error': self.error,
+        }
+
+
+class _SpoolFile(io.FileIO):
+    """The spooled file, opened for the worker, reporting read progress to its job."""
+
+    def __init__(self, job):
+        super().__init__(job.spool_path, 'rb')
+        self._job = job
+
+    def read(self, size=-1):
+        data = super().read(size)
+        self._job.bytes_read = self.tell()
+        return data
+
+    def readinto(self, buffer):
+        count = super().readinto(buffer)
+        self._job.bytes_read = self.tell()
+        return count
+
+
+class UploadPipeline:
+    """
+    Pushes spooled uploads to S3 and commits their Versions in the background.
+
+    The request only writes the file to UPLOAD_SPOOL_DIR and hands back a job
+    id; UPLOAD_WORKERS threads then do the S3 upload and the database commit,
+    retrying failures with exponential backoff. At most UPLOAD_QUEUE_MAX jobs
+    may be queued or running at once, so a burst of uploads is turned away
+    (503) instead of filling the disk.
+
+    Job state is kept in this process only: the status endpoint must be served
+    by the process that accepted the upload, and jobs still spooled when the
+    process exits are lost.
+    """
+
+    def __init__(self, app):
+        self.app = app
+        self.spool_dir = app.config['UPLOAD_SPOOL_DIR']
+        self.max_attempts = max(app.config['UPLOAD_MAX_ATTEMPTS'], 1)
+        self.retry_backoff = app.config['UPLOAD_RETRY_BACKOFF']
+        self.job_ttl = app.config['UPLOAD_JOB_TTL']
+        os.makedirs(self.spool_dir, exist_ok=True)
+
+        self._executor = ThreadPoolExecutor(
+            max_workers=app.config['UPLOAD_WORKERS'],
+            thread_name_prefix='upload-worker'
+        )
+        self._slots = threading.BoundedSemaphore(app.config['UPLOAD_QUEUE_MAX'])
+        self._jobs = {}
+        self._lock = threading.Lock()
+
+    def create_job(self, project_id, uploader_id, file_name):
+        """
+        Reserves a queue slot and registers a new job.
+
+        Returns:
+            UploadJob or None: The job, or None if the queue is full.
+        """
+        if not self._slots.acquire(blocking=False):
+            return None
+
+        job = UploadJob(project_id, uploader_id, file_name, spool_path=None)
+        job.spool_path = os.path.join(self.spool_dir, job.job_id)
+        with self._lock:
+            self._purge_finished()
+            self._jobs[job.job_id] = job
+        return job
+
+    def spool(self, job, reader):
+        """Copies the upload to the job's spool file (runs in the request)."""
+        with open(job.spool_path, 'wb') as spool_file:
+            shutil.copyfileobj(reader, spool_file, SPOOL_COPY_SIZE)
+            job.size = spool_file.tell()
+
+    def start(self, job):
+        """Hands a fully spooled job to the worker pool."""
+        self._executor.submit(self._run, job)
+
+    def discard(self, job):
+        """Drops a job that never started (e.g. the request failed while spooling)."""
+        self._remove_spool_file(job)
+        with self._lock:
+            self._jobs.pop(job.job_id, None)
+        self._slots.release()
+
+    def get(self, job_id):
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def _purge_finished(self):
+        """Forgets finished jobs older than UPLOAD_JOB_TTL. Caller holds the lock."""
+        cutoff = time.time() - self.job_ttl
+        expired = [
+            job_id for job_id, job in self._jobs.items()
+            if job.finished and job.finished_at < cutoff
+        ]
+        for job_id in expired:
+            del self._jobs[job_id]
+
+    def _remove_spool_file(self, job):
+        try:
+            os.remove(job.spool_path)
+        except FileNotFoundError:
+            pass
+
+    def _run(self, job):
+        try:
+            with self.app.app_context():
+                self._process(job)
+        except Exception as e:
+            job.error = str(e)
+            job.finish(FAILED)
+            logger.exception("Upload job crashed", extra={'job_id': job.job_id})
+        finally:
+            self._remove_spool_file(job)
+            self._slots.release()
+
+    def _process(self, job):
+        """
+        Uploads the spooled file and commits its Version, with retries.
+
+        In 'object' mode a failed commit only retries the commit: the object
+        already in S3 is reused. The other modes record blob/chunk rows in the
+        same transaction as the Version, so a failed commit repeats the whole
+        store (their dedup makes that cheap).
+        """
+        storage_key = chunks = size_bytes = None
+        keep_stored_object = current_app.config['STORAGE_MODE'] == 'object'
+
+        for attempt in range(1, self.max_attempts + 1):
+            job.attempts = attempt
+            try:
+                # 1. Push the spooled file to S3
+                if storage_key is None:
+                    job.status = UPLOADING
+                    with _SpoolFile(job) as spool_file:
+                        storage_key, chunks, size_bytes = store_file(
+                            FileStorage(spool_file, filename=job.file_name),
+                            user_id=job.uploader_id,
+                            project_id=job.project_id
+                        )
+                    if not storage_key:
+                        raise RuntimeError("S3 upload failed.")
+
+                # 2. Commit the Version row
+                job.status = COMMITTING
+                new_version = add_version(
+                    job.project_id, job.uploader_id, storage_key, job.file_name, job.version_note,
+                    chunks=chunks, size_bytes=size_bytes
+                )
+                db.session.commit()
+
+                job.version_id = new_version.version_id
+                job.version_number = new_version.version_number
+                job.error = None
+                job.finish(DONE)
+                schedule_audio_ingest([new_version])
+                return
+
+            except ValueError as e:
+                # The project is gone: retrying can't help
+                db.session.rollback()
+                job.error = str(e)
+                break
+
+            except Exception as e:
+                db.session.rollback()
+                job.error = str(e)
+                logger.warning("Upload job attempt failed", extra={'job_id': job.job_id, 'attempt': attempt, 'error': str(e)})
+                if storage_key is not None and not keep_stored_object:
+                    self._discard_object(current_app.config['STORAGE_MODE'], storage_key)
+                    storage_key = chunks = size_bytes = None
+
+            if attempt < self.max_attempts:
+                job.status = RETRYING
+                time.sleep(self.retry_backoff * 2 ** (attempt - 1))
+
+        # Out of attempts: don't leave an unreferenced object behind
+        if storage_key is not None:
+            self._discard_object(current_app.config['STORAGE_MODE'], storage_key)
+        job.finish(FAILED)
+
+    def _discard_object(self, storage_mode, storage_key):
+        """
+        Deletes an object no Version will point at. Content-addressed keys may
+        be shared with existing versions, so those are never deleted here.
+        """
+        if storage_mode == 'content_addressed':
+            return
+        try:
+            get_storage().delete_object(storage_key)
+        except Exception as e:
+            logger.warning("Could not delete orphaned upload", extra={'storage_key': storage_key, 'error': str(e)})
+
+
+def get_upload_pipeline():
+    """Returns the upload pipeline created by create_app()."""
+    return current_app.extensions['upload_pipeline']
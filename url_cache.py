@@ -0,0 +1,85 @@
+import threading
+import time
+from collections import OrderedDict
+from flask import current_app
+from storage import get_storage
+
+class PresignedUrlCache:
+    """
+    Bounded, thread-safe LRU cache of presigned download URLs.
+
+    Entries are keyed by (version_id, disposition). A URL is only handed out
+    while it still has at least `refresh_margin` seconds to live, so a client
+    never receives a link that expires before it can be followed; older
+    entries are evicted and re-signed on the next request.
+    """
+
+    def __init__(self, max_entries, refresh_margin):
+        self.max_entries = max_entries
+        self.refresh_margin = refresh_margin
+        self._entries = OrderedDict() # key -> (url, expires_at)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key):
+        """Returns the cached URL for key, or None if missing or about to expire."""
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            url, expires_at = entry
+            if expires_at - now < self.refresh_margin:
+                del self._entries[key]
+                self.evictions += 1
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return url
+
+    def put(self, key, url, expires_in):
+        """Caches a URL that S3 will accept for expires_in seconds from now."""
+        expires_at = time.monotonic() + expires_in
+        with self._lock:
+            self._entries[key] = (url, expires_at)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def stats(self):
+        with self._lock:
+            return {
+                'entries': len(self._entries),
+                'max_entries': self.max_entries,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+            }
+
+
+def get_download_url(version, disposition='attachment'):
+    """
+    Returns a presigned URL for a Version, reusing a cached one when possible.
+
+    Callers must have already checked that the user may download the version:
+    presigned URLs work for whoever holds them.
+    """
+    cache = current_app.extensions['url_cache']
+    key = (version.version_id, disposition)
+
+    url = cache.get(key)
+    if url is None:
+        expires_in = current_app.config['DOWNLOAD_URL_EXPIRES']
+        url = get_storage().generate_download_url(
+            version.storage_key,
+            version.file_name,
+            expires_in=expires_in,
+            disposition=disposition
+        )
+        cache.put(key, url, expires_in)
+    return url
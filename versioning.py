@@ -0,0 +1,197 @@
+import os
+from flask import current_app
+from werkzeug.utils import secure_filename
+from database import db
+from models import Project, Version, VersionChunk, VersionWaveform
+from s3_upload import upload_file_to_s3, upload_stream_to_s3
+from blob_store import upload_file_deduplicated, upload_stream_deduplicated
+from blob_store import release_blob
+from chunk_store import upload_chunked, add_version_manifest
+from project_summary import record_versions_added, record_version_removed
+from activity_feed import publish_versions_added
+
+def file_size(file_data):
+    """Size in bytes of a seekable upload (a spooled FileStorage), leaving it rewound."""
+    file_data.seek(0, os.SEEK_END)
+    size = file_data.tell()
+    file_data.seek(0)
+    return size
+
+def store_file(file_data, user_id, project_id, streaming=False):
+    """
+    Stores an uploaded file the way STORAGE_MODE says to.
+
+    Args:
+        file_data: A FileStorage (or any seekable file with .filename), or a
+            StreamingForm file part when streaming is True.
+        user_id (int): The ID of the user uploading the file.
+        project_id (int): The ID of the project the file belongs to.
+        streaming (bool): True if file_data can only be read once, front to back.
+
+    Returns:
+        tuple: (storage_key, chunks, size_bytes) - storage_key is None if the
+               upload failed; chunks is the manifest for chunked mode, None
+               otherwise; size_bytes is the size of the file.
+    """
+    mode = current_app.config['STORAGE_MODE']
+
+    if mode == 'chunked':
+        # Only chunks this project hasn't stored yet are uploaded
+        chunked = upload_chunked(file_data, user_id=user_id, project_id=project_id)
+        if chunked is None:
+            return None, None, None
+        return chunked.storage_key, chunked.chunks, chunked.total_bytes
+
+    # A spooled file is measured up front; a streamed one counts what was read
+    size_bytes = None if streaming else file_size(file_data)
+
+    if mode == 'content_addressed':
+        # Identical content is stored once and shared between versions
+        upload = upload_stream_deduplicated if streaming else upload_file_deduplicated
+        storage_key = upload(file_data, user_id=user_id, project_id=project_id)
+    elif streaming:
+        storage_key = upload_stream_to_s3(file_data, user_id=user_id, project_id=project_id)
+    else:
+        storage_key = upload_file_to_s3(file_data, user_id=user_id, project_id=project_id)
+
+    if streaming:
+        size_bytes = file_data.bytes_read
+    return storage_key, None, size_bytes
+
+
+def allocate_version_numbers(project_id, count=1):
+    """
+    Reserves the next `count` consecutive version numbers for a project.
+
+    The project's counter is bumped with a single UPDATE ... RETURNING on its
+    primary key. The row lock that UPDATE takes is held until the caller's
+    transaction ends, so concurrent uploads to the same project are serialized
+    on that one row (and only for the length of the commit), and the cost is
+    the same however many versions the project already has. The same UPDATE
+    bumps Project.updated_at, which the API's ETags are built from.
+
+    Must be called inside the transaction that inserts the Versions.
+
+    Returns:
+        int or None: The first reserved number, or None if the project does not exist.
+    """
+    last_number = db.session.execute(
+        db.update(Project)
+          .where(Project.project_id == project_id)
+          .values(
+              last_version_number=Project.last_version_number + count,
+              updated_at=db.func.timezone('utc', db.func.now())
+          )
+          .returning(Project.last_version_number)
+          .execution_options(synchronize_session=False)
+    ).scalar_one_or_none()
+
+    if last_number is None:
+        return None
+    return last_number - count + 1
+
+
+def _insert_version(project_id, uploader_id, storage_key, file_name, version_note, chunks, size_bytes, version_number):
+    """Adds and flushes one Version (and its chunk manifest) under a reserved number."""
+    new_version = Version(
+        project_id=project_id,
+        uploader_id=uploader_id,
+        version_number=version_number,
+        storage_key=storage_key,
+        file_name=secure_filename(file_name),
+        version_note=version_note,
+        storage_kind='chunked' if chunks is not None else 'object',
+        size_bytes=size_bytes
+    )
+    db.session.add(new_version)
+    db.session.flush() # Assigns version_id
+
+    if chunks is not None:
+        add_version_manifest(new_version, chunks)
+    return new_version
+
+
+def add_version(project_id, uploader_id, storage_key, file_name, version_note, chunks=None, size_bytes=None):
+    """
+    Adds a new Version to the session (flushed, NOT committed), and adds it
+    to the project's summary in the same transaction. Its activity event is
+    published when the transaction commits.
+
+    Args:
+        chunks (list, optional): Chunk manifest for chunked uploads.
+        size_bytes (int, optional): The file's size, as returned by store_file().
+
+    Returns:
+        Version: The flushed Version.
+
+    Raises:
+        ValueError: If the project does not exist.
+    """
+    version_number = allocate_version_numbers(project_id)
+    if version_number is None:
+        raise ValueError(f"Project {project_id} does not exist.")
+
+    new_version = _insert_version(
+        project_id, uploader_id, storage_key, file_name, version_note, chunks, size_bytes, version_number
+    )
+    record_versions_added(new_version.project_id, [new_version])
+    publish_versions_added([new_version])
+    return new_version
+
+
+def add_versions(project_id, uploader_id, entries, version_note):
+    """
+    Adds one Version per entry, numbered consecutively, to the session
+    (flushed, NOT committed). The numbers are reserved with a single counter
+    bump and the project summary is updated once, so the batch costs the
+    same two statements however many files it has.
+
+    Args:
+        entries (list): [(storage_key, file_name, chunks, size_bytes), ...] in upload order.
+
+    Returns:
+        list: The flushed Versions, in the same order.
+
+    Raises:
+        ValueError: If the project does not exist.
+    """
+    first_number = allocate_version_numbers(project_id, len(entries))
+    if first_number is None:
+        raise ValueError(f"Project {project_id} does not exist.")
+
+    new_versions = [
+        _insert_version(
+            project_id, uploader_id, storage_key, file_name, version_note,
+            chunks, size_bytes, first_number + offset
+        )
+        for offset, (storage_key, file_name, chunks, size_bytes) in enumerate(entries)
+    ]
+    record_versions_added(new_versions[0].project_id, new_versions)
+    publish_versions_added(new_versions)
+    return new_versions
+
+
+def delete_version(version):
+    """
+    Deletes a Version and the rows that belong to it (flushed, NOT committed),
+    taking it out of the project's summary in the same transaction.
+
+    Bumps Project.updated_at first, which takes the same row lock uploads
+    take to number their versions, so the summary can't race an upload.
+    Stored objects are not deleted here: in content-addressed mode the blob
+    loses a reference, and objects nothing references any more are left for
+    the orphan cleanup.
+    """
+    db.session.execute(
+        db.update(Project)
+          .where(Project.project_id == version.project_id)
+          .values(updated_at=db.func.timezone('utc', db.func.now()))
+          .execution_options(synchronize_session=False)
+    )
+    db.session.execute(db.delete(VersionChunk).where(VersionChunk.version_id == version.version_id))
+    db.session.execute(db.delete(VersionWaveform).where(VersionWaveform.version_id == version.version_id))
+    if version.storage_kind == 'object':
+        release_blob(version.storage_key) # No-op unless the object is a shared blob
+    db.session.delete(version)
+    db.session.flush()
+    record_version_removed(version)
@@ -0,0 +1,130 @@
+import struct
+
+try:
+    import numpy as np
+except ImportError: # Only needed for audio ingest
+    np = None
+
+# Packed peaks: header, one uint32 peak count per level, then each level's
+# (min, max) pairs as int8, finest level first.
+PEAKS_MAGIC = b'CTWF'
+PEAKS_FORMAT_VERSION = 1
+_HEADER = struct.Struct('<4sBBH') # magic, format version, level count, reserved
+
+
+class PeakAccumulator:
+    """
+    Reduces a stream of mono float samples (-1.0 .. 1.0) to min/max peaks,
+    one pair per `samples_per_peak` samples, a block at a time.
+
+    Memory is the peaks themselves plus less than one peak's worth of
+    leftover samples, never the decoded audio.
+    """
+
+    def __init__(self, samples_per_peak):
+        self.samples_per_peak = samples_per_peak
+        self.sample_count = 0
+        self._mins = []
+        self._maxs = []
+        self._carry = np.empty(0, dtype=np.float32)
+
+    def add(self, samples):
+        self.sample_count += len(samples)
+        if len(self._carry):
+            samples = np.concatenate((self._carry, samples))
+        whole = len(samples) - len(samples) % self.samples_per_peak
+        if whole:
+            blocks = samples[:whole].reshape(-1, self.samples_per_peak)
+            self._mins.append(blocks.min(axis=1))
+            self._maxs.append(blocks.max(axis=1))
+        self._carry = samples[whole:]
+
+    def finish(self):
+        """Returns (mins, maxs) as float32 arrays, including the last partial peak."""
+        if len(self._carry):
+            self._mins.append(self._carry.min(keepdims=True))
+            self._maxs.append(self._carry.max(keepdims=True))
+            self._carry = self._carry[:0]
+        if not self._mins:
+            return np.zeros(1, dtype=np.float32), np.zeros(1, dtype=np.float32)
+        return np.concatenate(self._mins), np.concatenate(self._maxs)
+
+
+def build_levels(mins, maxs, level_sizes):
+    """
+    Resamples the finest peaks to each requested number of peaks.
+
+    Each output peak is the min/max over an equal slice of the input (a
+    single reduceat per level), so every level shows the true extremes,
+    not a sampled subset. Levels never have more peaks than the input.
+
+    Returns:
+        list: One (n, 2) int8 array of (min, max) pairs per level.
+    """
+    levels = []
+    for size in level_sizes:
+        if len(mins) > size:
+            edges = np.linspace(0, len(mins), size + 1).astype(np.int64)[:-1]
+            level_mins = np.minimum.reduceat(mins, edges)
+            level_maxs = np.maximum.reduceat(maxs, edges)
+        else:
+            level_mins, level_maxs = mins, maxs
+        pairs = np.stack((level_mins, level_maxs), axis=1)
+        levels.append(np.clip(np.rint(pairs * 127), -127, 127).astype(np.int8))
+    return levels
+
+
+def pack_peaks(levels):
+    """Serializes levels from build_levels() into the compact binary format."""
+    header = _HEADER.pack(PEAKS_MAGIC, PEAKS_FORMAT_VERSION, len(levels), 0)
+    counts = struct.pack(f'<{len(levels)}I', *(len(level) for level in levels))
+    return header + counts + b''.join(level.tobytes() for level in levels)
+
+
+def unpack_peaks(data):
+    """
+    Parses pack_peaks() output.
+
+    Returns:
+        list: One list of (min, max) int pairs per level, finest first.
+
+    Raises:
+        ValueError: If data is not a packed peaks blob.
+    """
+    magic, version, level_count, _ = _HEADER.unpack_from(data)
+    if magic != PEAKS_MAGIC or version != PEAKS_FORMAT_VERSION:
+        raise ValueError("Not a packed waveform.")
+    counts = struct.unpack_from(f'<{level_count}I', data, _HEADER.size)
+
+    levels = []
+    offset = _HEADER.size + 4 * level_count
+    for count in counts:
+        values = struct.unpack_from(f'<{2 * count}b', data, offset)
+        levels.append(list(zip(values[0::2], values[1::2])))
+        offset += 2 * count
+    return levels
+
+
+def waveform_svg(overview, width=256, height=40):
+    """
+    Renders packed overview peaks as a small inline SVG: one vertical line
+    per peak, from its min to its max.
+    """
+    try:
+        peaks = unpack_peaks(overview)[0]
+    except (ValueError, struct.error):
+        return ''
+    if not peaks:
+        return ''
+
+    step = width / len(peaks)
+    middle = height / 2
+    scale = middle / 127
+    path = ''.join(
+        f"M{(i + 0.5) * step:.1f} {middle - high * scale:.1f}V{middle - min(low, high - 1) * scale:.1f}"
+        for i, (low, high) in enumerate(peaks)
+    )
+    return (
+        f'<svg width="{width}" height="{height}" viewBox="0 0 {width} {height}">'
+        f'<path d="{path}" stroke="#3b6ea5" stroke-width="{max(step * 0.8, 1):.1f}"/></svg>'
+    )
@@ -0,0 +1,90 @@
+import zipfile
+from chunk_store import iter_chunked_file
+
+# Piece size read from each S3 object while it is copied into the archive
+EXPORT_READ_SIZE = 1024 * 1024
+
+
+class _StreamSink:
+    """
+    Write-only, unseekable file object for zipfile. It just collects what
+    zipfile writes so the generator below can hand it to the client.
+    Because it can't seek, zipfile writes sizes and CRCs in data
+    descriptors after each entry instead of going back to patch headers.
+    """
+
+    def __init__(self):
+        self._pieces = []
+
+    def write(self, data):
+        self._pieces.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        data = b''.join(self._pieces)
+        self._pieces.clear()
+        return data
+
+
+def export_entries(versions, manifests):
+    """
+    Describes each Version as a plain archive entry, so the archive can be
+    built after the request (and its database session) has ended.
+
+    Args:
+        versions (list): The Versions to export, in archive order.
+        manifests (dict): version_id -> chunk manifest, for chunked versions.
+
+    Returns:
+        list: [(arcname, date_time, storage_key, manifest or None), ...]
+    """
+    return [
+        (
+            # One folder per version number keeps repeated file names apart
+            f"v{version.version_number}/{version.file_name}",
+            version.uploaded_at.timetuple()[:6],
+            version.storage_key,
+            manifests.get(version.version_id),
+        )
+        for version in versions
+    ]
+
+
+def iter_zip(storage, project_id, entries):
+    """
+    Yields a ZIP archive of the given entries as it is built.
+
+    Each file is copied from S3 piece by piece, so memory stays at about one
+    piece no matter how large the files or the archive are, and nothing is
+    written to disk. Every entry is written with ZIP64 extra fields because
+    its size isn't known up front; files are stored, not deflated, since
+    project files (audio, archives, images) rarely compress.
+
+    Takes the storage service explicitly because it runs after the request
+    context is gone.
+    """
+    sink = _StreamSink()
+    with zipfile.ZipFile(sink, mode='w', compression=zipfile.ZIP_STORED, allowZip64=True) as archive:
+        for arcname, date_time, storage_key, manifest in entries:
+            info = zipfile.ZipInfo(arcname, date_time=date_time)
+            info.compress_type = zipfile.ZIP_STORED
+
+            if manifest is not None:
+                pieces = iter_chunked_file(storage, project_id, manifest)
+            else:
+                pieces = storage.iter_object(storage_key, chunk_size=EXPORT_READ_SIZE)
+
+            with archive.open(info, mode='w', force_zip64=True) as dest:
+                for piece in pieces:
+                    dest.write(piece)
+                    data = sink.drain()
+                    if data:
+                        yield data
+            # Closing the entry wrote its data descriptor
+            yield sink.drain()
+
+    # Closing the archive wrote the central directory
+    yield sink.drain()